@@ -0,0 +1,164 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+# Benchmark of MPEG DASH manifest generation from a synthetic local HLS
+# source. Every iteration runs in a new process that loads the master
+# playlist with an empty context and renders the manifest. Wall time, peak
+# memory and the number of segment probes and subprocesses are written as
+# JSON so that results can be compared between versions.
+#
+#   PYTHONPATH=. python benchmarks/bench_manifest.py --window 1800 -o result.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+from tsutil import pat, pmt, pes
+
+SCTE35 = '/DAlAAAAAAAAAP/wFAUAAAABf+/+AAAAAH4AEHmwAAEAAAAAKHIKsQ=='
+PROFILES = [ (2500, 1280, 720), (1500, 960, 540), (800, 640, 360), (400, 480, 270), (200, 320, 180) ]
+
+def generateFixture(dirname, profiles, window, cueinterval, firstsequence=1000, duration=6):
+    master = [ '#EXTM3U' ]
+    for (bandwidth, width, height) in PROFILES[:profiles]:
+        master.append('#EXT-X-STREAM-INF:BANDWIDTH=%d,RESOLUTION=%dx%d,CODECS="avc1.4d401f,mp4a.40.2"' % (bandwidth * 1000, width, height))
+        master.append('master%d.m3u8' % bandwidth)
+        lines = [ '#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:%d' % duration, '#EXT-X-MEDIA-SEQUENCE:%d' % firstsequence ]
+        for i in range(firstsequence, firstsequence + window):
+            if cueinterval > 0:
+                # A two segment ad break every cueinterval segments
+                pos = i % cueinterval
+                if pos == 1:
+                    lines.append('#EXT-OATCLS-SCTE35:%s' % SCTE35)
+                    lines.append('#EXT-X-CUE-OUT:%d' % (2 * duration))
+                elif pos == 2:
+                    lines.append('#EXT-X-CUE-OUT-CONT:ElapsedTime=%d,Duration=%d,SCTE35=%s' % (duration, 2 * duration, SCTE35))
+                elif pos == 3:
+                    lines.append('#EXT-X-CUE-IN')
+            lines.append('#EXTINF:%d.000,' % duration)
+            lines.append('master%d_%d.ts' % (bandwidth, i))
+            pts = 900000 + i * duration * 90000
+            with open(os.path.join(dirname, 'master%d_%d.ts' % (bandwidth, i)), 'wb') as f:
+                f.write(pat() + pmt([ (0x1b, 0x100), (0x0f, 0x101) ]) + pes(0x100, 0xe0, pts) + pes(0x101, 0xc0, pts))
+        with open(os.path.join(dirname, 'master%d.m3u8' % bandwidth), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    with open(os.path.join(dirname, 'master.m3u8'), 'w') as f:
+        f.write('\n'.join(master) + '\n')
+    return os.path.join(dirname, 'master.m3u8')
+
+def _count(counters, name, fn):
+    def counted(*args, **kwargs):
+        counters[name] += 1
+        return fn(*args, **kwargs)
+    return counted
+
+def runOnce(args):
+    (playlist, multi, queue) = args
+    from hls2dash.lib import MPD
+    from hls2dash.lib import TS
+    counters = { 'probes': 0, 'subprocesses': 0 }
+    TS.Local.probe = _count(counters, 'probes', TS.Local.probe)
+    TS.Remote.probe = _count(counters, 'probes', TS.Remote.probe)
+    subprocess.Popen.__init__ = _count(counters, 'subprocesses', subprocess.Popen.__init__)
+    ctxdir = tempfile.mkdtemp(prefix='hls2dash-bench-ctx')
+    try:
+        started = time.time()
+        mpd = MPD.HLS(playlist, multi, ctxdir + '/', 'bench')
+        mpd.load()
+        loaded = time.time()
+        xml = mpd.asXML()
+        rendered = time.time()
+    finally:
+        shutil.rmtree(ctxdir, True)
+    queue.put({
+        'load': loaded - started,
+        'render': rendered - loaded,
+        'wall': rendered - started,
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'probes': counters['probes'],
+        'subprocesses': counters['subprocesses'],
+        'periods': len(mpd.getAllPeriods()),
+        'manifest_bytes': len(xml)
+    })
+
+def measure(playlist, multi):
+    # A new process for every run gives a cold start and a peak memory
+    # figure that is not affected by earlier runs
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=runOnce, args=((playlist, multi, queue),))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MPEG DASH manifest generation from a synthetic HLS source")
+    parser.add_argument('--profiles', dest='profiles', type=int, default=2, help='Number of variants (1-%d)' % len(PROFILES))
+    parser.add_argument('--window', dest='window', type=int, default=600, help='Number of segments in each media playlist')
+    parser.add_argument('--cue-interval', dest='cueinterval', type=int, default=50, help='Segments between SCTE35 ad breaks, 0 for none')
+    parser.add_argument('--multi', dest='multi', action='store_true', default=False, help='Generate multi period MPEG DASH')
+    parser.add_argument('--iterations', dest='iterations', type=int, default=5, help='Number of runs')
+    parser.add_argument('--output', '-o', dest='output', default=None, help='Write results as JSON to this file instead of stdout')
+    args = parser.parse_args()
+    if args.profiles < 1 or args.profiles > len(PROFILES):
+        parser.error('--profiles must be between 1 and %d' % len(PROFILES))
+
+    fixturedir = tempfile.mkdtemp(prefix='hls2dash-bench')
+    try:
+        playlist = generateFixture(fixturedir, args.profiles, args.window, args.cueinterval)
+        runs = [ measure(playlist, args.multi) for i in range(args.iterations) ]
+    finally:
+        shutil.rmtree(fixturedir, True)
+
+    revision = None
+    try:
+        revision = subprocess.check_output([ 'git', 'rev-parse', '--short', 'HEAD' ], stderr=open(os.devnull, 'w')).strip()
+    except Exception:
+        pass
+    result = {
+        'benchmark': 'manifest',
+        'revision': revision,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'parameters': {
+            'profiles': args.profiles,
+            'window': args.window,
+            'cueinterval': args.cueinterval,
+            'multi': args.multi,
+            'iterations': args.iterations
+        },
+        'summary': {
+            'wall_min': min([ r['wall'] for r in runs ]),
+            'wall_median': median([ r['wall'] for r in runs ]),
+            'load_median': median([ r['load'] for r in runs ]),
+            'render_median': median([ r['render'] for r in runs ]),
+            'maxrss_kb': max([ r['maxrss_kb'] for r in runs ]),
+            'probes': runs[0]['probes'],
+            'subprocesses': runs[0]['subprocesses']
+        },
+        'runs': runs
+    }
+    data = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+if __name__ == '__main__':
+    main()
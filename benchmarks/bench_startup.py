@@ -0,0 +1,91 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+# Benchmark of command line tool startup. Every run starts a new
+# interpreter that runs the main function of a tool with --version, which
+# covers interpreter start, imports and the version lookup but no work.
+# Results are written as JSON and the benchmark exits with an error if
+# the median of a tool is above --max-ms, so that it can guard startup
+# time in CI.
+#
+#   PYTHONPATH=. python benchmarks/bench_startup.py --max-ms 150 -o result.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+TOOLS = [
+    ('hls-to-dash', 'hls2dash', 'main'),
+    ('ts-to-fmp4', 'hls2dash.tsremux', 'main'),
+    ('ts-to-fmp4-batch', 'hls2dash.tsremux', 'batch'),
+    ('hls-to-dash-packager', 'hls2dash.packager', 'main')
+]
+
+def runOnce(module, function):
+    code = 'import sys\nsys.argv = [ "tool", "--version" ]\nfrom %s import %s\ntry:\n    %s()\nexcept SystemExit:\n    pass\n' % (module, function, function)
+    with open(os.devnull, 'w') as devnull:
+        started = time.time()
+        subprocess.check_call([ sys.executable, '-c', code ], stdout=devnull, stderr=devnull)
+        return time.time() - started
+
+def baseline():
+    # Interpreter start without any of our modules
+    started = time.time()
+    subprocess.check_call([ sys.executable, '-c', 'pass' ])
+    return time.time() - started
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup time of the command line tools")
+    parser.add_argument('--iterations', dest='iterations', type=int, default=20, help='Number of runs per tool')
+    parser.add_argument('--max-ms', dest='maxms', type=float, default=None, help='Fail if the median startup of a tool is above this number of milliseconds')
+    parser.add_argument('--output', '-o', dest='output', default=None, help='Write results as JSON to this file instead of stdout')
+    args = parser.parse_args()
+
+    tools = {}
+    for (name, module, function) in TOOLS:
+        runs = [ runOnce(module, function) for i in range(args.iterations) ]
+        tools[name] = { 'min_ms': min(runs) * 1000, 'median_ms': median(runs) * 1000 }
+    interpreter = median([ baseline() for i in range(args.iterations) ])
+
+    revision = None
+    try:
+        revision = subprocess.check_output([ 'git', 'rev-parse', '--short', 'HEAD' ], stderr=open(os.devnull, 'w')).strip()
+    except Exception:
+        pass
+    result = {
+        'benchmark': 'startup',
+        'revision': revision,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'parameters': {
+            'iterations': args.iterations,
+            'max_ms': args.maxms
+        },
+        'interpreter_ms': interpreter * 1000,
+        'tools': tools
+    }
+    data = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+    if args.maxms != None:
+        slow = [ name for (name, r) in sorted(tools.items()) if r['median_ms'] > args.maxms ]
+        if len(slow) > 0:
+            sys.stderr.write("Error: startup of %s above %.0f ms\n" % (', '.join(slow), args.maxms))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,25 @@
 # license that can be found in the LICENSE file.
 # Author: Jonas Birme (Eyevinn Technology)
 
-import argparse
-import pkg_resources
-from hls2dash.lib import MPD
-from hls2dash import debug
+import sys
+import os
+
+# This module is loaded with every module in the package, so the modules
+# needed by main() are imported when it runs and not here
+
+# Remux engines of TSRemux, defined here so that the command line tools
+# can list them without importing the remuxer
+ENGINES = [ 'native', 'ffmpeg', 'mp4fragment' ]
 
 def VERSION():
-    version = pkg_resources.require('hls2dash')[0].version
-    return version
+    from hls2dash.version import __version__
+    return __version__
 
 def main():
+    import tempfile
+    import argparse
+    from hls2dash import debug
+    from hls2dash import metrics
     version = VERSION()
     parser = argparse.ArgumentParser(
         description="Generate single and multi period MPEG DASH manifest from a live HLS source.\n" 
@@ -26,15 +35,69 @@ def main():
     parser.add_argument('--multi', dest='multi', action='store_true', default=False, help='Generate multi period MPEG DASH on EXT-X-CUE markers in HLS')
     parser.add_argument('--ctx', dest='ctx', default=None, help='Name of DASH session file')
     parser.add_argument('--ctxdir', dest='ctxdir', default='/tmp/', help='Where to store DASH session file. Defaults to /tmp/')
+    parser.add_argument('--ctxdb', dest='ctxdb', default=None, help='Store the DASH session in this SQLite database instead of a file in ctxdir. Can be shared by many channels')
+    parser.add_argument('--output', '-o', dest='output', default=None, help='Write MPEG DASH manifest to this file instead of stdout')
+    parser.add_argument('--watch', dest='watch', action='store_true', default=False, help='Keep running and rewrite the output file when the HLS playlist changes')
+    parser.add_argument('--serve', dest='serve', type=int, default=None, metavar='PORT', help='Serve the MPEG DASH manifest and the segments remuxed on demand over HTTP on this port')
+    parser.add_argument('--cachedir', dest='cachedir', default=None, help='Where to store remuxed segments in serve mode. Defaults to a new temporary directory')
+    parser.add_argument('--engine', dest='engine', choices=ENGINES, default='native', help='Remux engine to use in serve mode. Default is native')
+    parser.add_argument('--prefetch', dest='prefetch', type=int, default=0, metavar='WORKERS', help='In serve mode, remux new segments ahead of requests with this number of worker threads')
+    parser.add_argument('--segment-cache', dest='segmentcache', default=None, metavar='DIR', help='In serve mode, cache remuxed segments in this directory, can be shared by several processes')
+    parser.add_argument('--segment-cache-size', dest='segmentcachesize', type=int, default=1024, metavar='MB', help='Maximum size of the segment cache. Default is 1024 MB')
+    parser.add_argument('--segment-cache-age', dest='segmentcacheage', type=int, default=3600, metavar='SECONDS', help='Maximum age of a segment in the segment cache. Default is 3600 seconds')
+    parser.add_argument('--timing', dest='timing', choices=[ 'probe', 'extinf', 'pdt' ], default='probe', help='Get the start time of a period by probing its first segment (probe), from the EXTINF durations since an earlier probe (extinf) or from EXT-X-PROGRAM-DATE-TIME (pdt). Default is probe')
+    parser.add_argument('--timing-verify', dest='timingverify', type=int, default=10, metavar='N', help='With extinf or pdt timing, probe every Nth period start to verify the derived time, 0 to only probe after a discontinuity. Default is 10')
+    parser.add_argument('--verify-variants', dest='verifyvariants', action='store_true', default=False, help='Load all variant playlists concurrently and warn about variants that are not aligned')
+    parser.add_argument('--metrics-json', dest='metricsjson', default=None, help='Append timings and counters of each run as a JSON line to this file (- for stderr)')
+    parser.add_argument('--metrics-prom', dest='metricsprom', default=None, help='Write timings and counters to this Prometheus textfile collector file')
     parser.add_argument('--debug', dest='debug', action='store_true', default=False, help='Write debug info to stderr')
     parser.add_argument('--version', action='version', version='%(prog)s ('+version+')')
     args = parser.parse_args()
     debug.doDebug = args.debug
+    metrics.jsonPath = args.metricsjson
+    metrics.prometheusPath = args.metricsprom
+    if args.watch and args.output == None:
+        parser.error('--watch requires --output')
+    if args.serve != None and (args.watch or args.output):
+        parser.error('--serve can not be combined with --watch or --output')
+
+    from hls2dash.lib import MPD
+    from hls2dash.lib import ContextStore
 
-    mpd = MPD.HLS(args.playlist, args.multi, args.ctxdir, args.ctx)
-    mpd.setVersion(VERSION())
-    mpd.load()
-    print(mpd.asXML())
+    mpd = MPD.HLS(args.playlist, args.multi, args.ctxdir, args.ctx, ContextStore.create(args.ctxdir, args.ctxdb))
+    mpd.setVersion(version)
+    mpd.setVerifyVariants(args.verifyvariants)
+    mpd.setTiming(args.timing, args.timingverify)
+    if args.watch:
+        from hls2dash.lib import Channel
+        Channel.Channel(mpd, args.output).run()
+        return
+    if args.serve != None:
+        from hls2dash.lib import Origin
+        from hls2dash.lib import SegmentCache
+        cachedir = args.cachedir
+        if cachedir == None:
+            cachedir = tempfile.mkdtemp(prefix='hls2dash')
+        elif not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        origin = Origin.Origin(mpd, cachedir, args.engine)
+        if args.segmentcache != None:
+            origin.setSegmentCache(SegmentCache.SegmentCache(args.segmentcache, args.segmentcachesize * 1024 * 1024, args.segmentcacheage))
+        if args.prefetch > 0:
+            origin.startPrefetch(args.prefetch)
+        Origin.serve(origin, args.serve)
+        return
+    from hls2dash.lib import util
+    with metrics.timer('refresh'):
+        mpd.load()
+        with metrics.timer('render'):
+            if args.output:
+                if not util.writeFileIfChanged(args.output, mpd.asXML(), mpd.withoutTimestamps):
+                    debug.log("%s not changed" % args.output)
+            else:
+                mpd.writeXML(sys.stdout)
+    if metrics.isEnabled():
+        metrics.emit(mpd.getName())
 
 if __name__ == '__main__':
     try: 
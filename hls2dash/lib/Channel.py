@@ -0,0 +1,50 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import sys
+import time
+import threading
+from hls2dash.lib import util
+from hls2dash import debug
+from hls2dash import metrics
+
+# A live HLS source that is continuously repackaged to an MPEG DASH
+# manifest file. The HLS state is kept in memory between refreshes
+class Channel:
+    def __init__(self, mpd, output):
+        self.mpd = mpd
+        self.output = output
+        self.stopped = threading.Event()
+    def update(self):
+        with metrics.timer('refresh'):
+            if not self.mpd.refresh():
+                return False
+            with metrics.timer('render'):
+                xml = self.mpd.asXML()
+            # A playlist change does not always change the MPD, and the
+            # file is then kept as only the publish time would be new
+            if not util.writeFileIfChanged(self.output, xml, self.mpd.withoutTimestamps):
+                metrics.count('manifest_unchanged')
+                return False
+        metrics.count('manifest_updates')
+        debug.log("Wrote %s" % self.output)
+        return True
+    def getPollInterval(self):
+        return self.mpd.getPollInterval()
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                self.update()
+            except Exception as e:
+                metrics.count('errors')
+                sys.stderr.write("Error: failed to update %s: %s\n" % (self.output, e))
+            if metrics.isEnabled():
+                metrics.emit(self.mpd.getName())
+            elapsed = time.time() - started
+            self.stopped.wait(max(0.0, self.getPollInterval() - elapsed))
+        self.mpd.close()
+    def stop(self):
+        self.stopped.set()
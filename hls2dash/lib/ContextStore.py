@@ -0,0 +1,99 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import os
+import json
+import threading
+from hls2dash.lib import util
+from hls2dash import debug
+
+# Storage of the session context of a channel between executions. A
+# context is a dict with the keys timebase, prevsplit, nextsplit, anchor
+# ([ sequence, ticks ]), derivedstarts, pdtoffset and starttimes (a list
+# of [ uri, starttime, created ]). load() returns None for a channel
+# without a stored context. A save replaces the whole context, so a run
+# holds lock(name) from load through save: runs of the same channel at
+# the same time are serialized instead of overwriting each other's changes
+
+# One JSON file per channel. The file is replaced with an atomic rename so
+# a reader never sees a partially written context
+class FileStore:
+    def __init__(self, dir='/tmp/'):
+        if not dir.endswith('/'):
+            dir += '/'
+        self.dir = dir
+    def getFilename(self, name):
+        return self.dir + name + '.ctx'
+    def load(self, name):
+        filename = self.getFilename(name)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'r') as f:
+            return json.loads(f.read())
+    def save(self, name, obj):
+        util.writeFileAtomic(self.getFilename(name), json.dumps(obj, indent=4))
+    def lock(self, name):
+        return util.lockFile(self.getFilename(name) + '.lock')
+    def __str__(self):
+        return self.dir
+
+# All channels in one SQLite database. A context is written in a single
+# transaction, so concurrent runs of the same channel never see half of
+# an update, and the database can be shared by several processes. The
+# lock of a channel is a file next to the database, as a database lock
+# held from load through save would serialize all channels
+class SQLiteStore:
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+    def _connect(self):
+        # A connection can only be used by the thread that created it
+        conn = getattr(self.local, 'conn', None)
+        if conn == None:
+            import sqlite3
+            debug.log("Opening context database %s" % self.path)
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS context (name TEXT PRIMARY KEY, timebase REAL, prevsplit INTEGER, nextsplit INTEGER, anchorsequence INTEGER, anchorticks INTEGER, derivedstarts INTEGER, pdtoffset INTEGER)')
+                conn.execute('CREATE TABLE IF NOT EXISTS starttime (name TEXT, uri TEXT, starttime REAL, created REAL, PRIMARY KEY (name, uri))')
+            self.local.conn = conn
+        return conn
+    def load(self, name):
+        conn = self._connect()
+        row = conn.execute('SELECT timebase, prevsplit, nextsplit, anchorsequence, anchorticks, derivedstarts, pdtoffset FROM context WHERE name=?', (name,)).fetchone()
+        if row == None:
+            return None
+        obj = { 'timebase': row[0] }
+        if row[1] != None:
+            obj['prevsplit'] = row[1]
+        if row[2] != None:
+            obj['nextsplit'] = row[2]
+        if row[3] != None:
+            obj['anchor'] = [ row[3], row[4] ]
+            obj['derivedstarts'] = row[5] or 0
+        if row[6] != None:
+            obj['pdtoffset'] = row[6]
+        obj['starttimes'] = [ list(r) for r in conn.execute('SELECT uri, starttime, created FROM starttime WHERE name=? ORDER BY rowid', (name,)) ]
+        return obj
+    def save(self, name, obj):
+        conn = self._connect()
+        with conn:
+            anchor = obj.get('anchor', [ None, None ])
+            conn.execute('INSERT OR REPLACE INTO context (name, timebase, prevsplit, nextsplit, anchorsequence, anchorticks, derivedstarts, pdtoffset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (name, obj['timebase'], obj.get('prevsplit'), obj.get('nextsplit'), anchor[0], anchor[1], obj.get('derivedstarts'), obj.get('pdtoffset')))
+            conn.execute('DELETE FROM starttime WHERE name=?', (name,))
+            conn.executemany('INSERT INTO starttime (name, uri, starttime, created) VALUES (?, ?, ?, ?)', [ (name, uri, starttime, created) for (uri, starttime, created) in obj.get('starttimes', []) ])
+    def lock(self, name):
+        return util.lockFile('%s.%s.lock' % (self.path, name))
+    def __str__(self):
+        return self.path
+
+# Store for a --ctxdir/--ctxdb pair of options, the database if given
+def create(ctxdir='/tmp/', ctxdb=None):
+    if ctxdb != None:
+        return SQLiteStore(ctxdb)
+    return FileStore(ctxdir)
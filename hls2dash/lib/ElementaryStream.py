@@ -0,0 +1,269 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import struct
+from hls2dash import debug
+
+TIMESTAMP_WRAP = 2**33
+
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+AAC_SAMPLE_RATES = [ 96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350 ]
+AAC_FRAME_SAMPLES = 1024
+
+# A media sample as it is written to an MP4 fragment
+class Sample:
+    def __init__(self, data, duration, isSync, compositionOffset=0):
+        self.data = data
+        self.duration = duration
+        self.isSync = isSync
+        self.compositionOffset = compositionOffset
+
+# Split an H.264 Annex B byte stream into NAL units
+def splitNALUnits(data):
+    nals = []
+    start = None
+    pos = 0
+    end = len(data)
+    while pos + 3 <= end:
+        if data[pos] == 0x00 and data[pos+1] == 0x00 and data[pos+2] == 0x01:
+            if start != None:
+                nalend = pos
+                if data[nalend-1] == 0x00:
+                    # Four byte start code
+                    nalend -= 1
+                nals.append(data[start:nalend])
+            pos += 3
+            start = pos
+        else:
+            pos += 1
+    if start != None and start < end:
+        nals.append(data[start:end])
+    return [ n for n in nals if len(n) > 0 ]
+
+def removeEmulationPrevention(nal):
+    out = bytearray()
+    zeros = 0
+    for b in nal:
+        if zeros >= 2 and b == 0x03:
+            zeros = 0
+            continue
+        out.append(b)
+        if b == 0x00:
+            zeros += 1
+        else:
+            zeros = 0
+    return out
+
+class BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+    def readBits(self, n):
+        v = 0
+        for i in range(n):
+            byte = self.data[self.pos >> 3]
+            v = (v << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return v
+    def readUE(self):
+        zeros = 0
+        while self.readBits(1) == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.readBits(zeros)
+    def readSE(self):
+        v = self.readUE()
+        if v & 1:
+            return (v + 1) >> 1
+        return -(v >> 1)
+
+def _skipScalingList(r, size):
+    lastScale = 8
+    nextScale = 8
+    for j in range(size):
+        if nextScale != 0:
+            nextScale = (lastScale + r.readSE() + 256) % 256
+        if nextScale != 0:
+            lastScale = nextScale
+
+# Parse the profile, level and picture size from an H.264 SPS NAL unit
+def parseSPS(sps):
+    r = BitReader(removeEmulationPrevention(sps[1:]))
+    info = {}
+    info['profile'] = r.readBits(8)
+    info['compatibility'] = r.readBits(8)
+    info['level'] = r.readBits(8)
+    r.readUE()
+    chromaFormat = 1
+    if info['profile'] in [ 100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135 ]:
+        chromaFormat = r.readUE()
+        if chromaFormat == 3:
+            r.readBits(1)
+        r.readUE()
+        r.readUE()
+        r.readBits(1)
+        if r.readBits(1):
+            for i in range(8 if chromaFormat != 3 else 12):
+                if r.readBits(1):
+                    _skipScalingList(r, 16 if i < 6 else 64)
+    r.readUE()
+    pocType = r.readUE()
+    if pocType == 0:
+        r.readUE()
+    elif pocType == 1:
+        r.readBits(1)
+        r.readSE()
+        r.readSE()
+        for i in range(r.readUE()):
+            r.readSE()
+    r.readUE()
+    r.readBits(1)
+    widthInMbs = r.readUE() + 1
+    heightInMapUnits = r.readUE() + 1
+    frameMbsOnly = r.readBits(1)
+    if not frameMbsOnly:
+        r.readBits(1)
+    r.readBits(1)
+    crop = [ 0, 0, 0, 0 ]
+    if r.readBits(1):
+        crop = [ r.readUE(), r.readUE(), r.readUE(), r.readUE() ]
+    cropUnitX = 1
+    cropUnitY = 2 - frameMbsOnly
+    if chromaFormat in [ 1, 2 ]:
+        cropUnitX = 2
+    if chromaFormat == 1:
+        cropUnitY *= 2
+    info['width'] = widthInMbs * 16 - (crop[0] + crop[1]) * cropUnitX
+    info['height'] = (2 - frameMbsOnly) * heightInMapUnits * 16 - (crop[2] + crop[3]) * cropUnitY
+    return info
+
+# Parse an ADTS header. Returns None if data does not start with one
+def parseADTSHeader(data, pos=0):
+    if len(data) - pos < 7 or data[pos] != 0xff or (data[pos+1] & 0xf6) != 0xf0:
+        return None
+    header = {}
+    header['objectType'] = ((data[pos+2] >> 6) & 0x3) + 1
+    header['sampleRateIndex'] = (data[pos+2] >> 2) & 0xf
+    header['channels'] = ((data[pos+2] & 0x1) << 2) | (data[pos+3] >> 6)
+    header['frameLength'] = ((data[pos+3] & 0x3) << 11) | (data[pos+4] << 3) | (data[pos+5] >> 5)
+    header['headerLength'] = 7 if data[pos+1] & 0x1 else 9
+    return header
+
+# Base class for the elementary stream to MP4 sample converters
+class Base:
+    def __init__(self, timescale):
+        self.timescale = timescale
+        self.samples = []
+    def getTimescale(self):
+        return self.timescale
+    def getSamples(self):
+        return self.samples
+    def haveSamples(self):
+        return len(self.samples) > 0
+
+# H.264 Annex B access units to length prefixed (AVCC) samples
+class H264(Base):
+    def __init__(self):
+        Base.__init__(self, 90000)
+        self.sps = None
+        self.pps = None
+        self.firstPTS = None
+        self.firstDTS = None
+        self.lastDTS = None
+        self.dts = []
+    def addPES(self, pes):
+        nals = splitNALUnits(pes.data)
+        data = bytearray()
+        isSync = False
+        for nal in nals:
+            naltype = nal[0] & 0x1f
+            if naltype == NAL_SPS:
+                if self.sps == None:
+                    self.sps = nal
+                continue
+            if naltype == NAL_PPS:
+                if self.pps == None:
+                    self.pps = nal
+                continue
+            if naltype == NAL_AUD:
+                continue
+            if naltype == NAL_IDR:
+                isSync = True
+            data += struct.pack('>I', len(nal))
+            data += nal
+        if len(data) == 0:
+            return
+        if pes.pts == None:
+            # Access unit continued in a PES packet without timestamp
+            if self.haveSamples():
+                self.samples[-1].data += data
+            return
+        dts = pes.dts
+        if self.lastDTS != None and dts < self.lastDTS - TIMESTAMP_WRAP / 2:
+            dts += TIMESTAMP_WRAP
+        pts = pes.pts
+        if pts < dts - TIMESTAMP_WRAP / 2:
+            pts += TIMESTAMP_WRAP
+        if self.firstPTS == None:
+            self.firstPTS = pts
+            self.firstDTS = dts
+        self.lastDTS = dts
+        self.dts.append(dts)
+        self.samples.append(Sample(data, 0, isSync, pts - dts))
+    def finish(self):
+        for i in range(len(self.samples) - 1):
+            self.samples[i].duration = self.dts[i+1] - self.dts[i]
+        if self.haveSamples():
+            if len(self.samples) > 1:
+                self.samples[-1].duration = self.samples[-2].duration
+            else:
+                self.samples[-1].duration = 3000
+    def getDecodeDelay(self):
+        # Difference between presentation and decode time of the first sample
+        if self.firstPTS == None:
+            return 0
+        return self.firstPTS - self.firstDTS
+    def getInfo(self):
+        if self.sps == None or self.pps == None:
+            raise Exception("No SPS or PPS found in H.264 stream")
+        return parseSPS(self.sps)
+
+# AAC in ADTS frames to raw AAC samples
+class AAC(Base):
+    def __init__(self):
+        Base.__init__(self, 48000)
+        self.header = None
+        self.buffer = bytearray()
+    def addPES(self, pes):
+        self.buffer += pes.data
+        pos = 0
+        while True:
+            header = parseADTSHeader(self.buffer, pos)
+            if header == None:
+                if len(self.buffer) - pos >= 7:
+                    debug.log("Lost ADTS sync")
+                    pos = len(self.buffer)
+                break
+            if pos + header['frameLength'] > len(self.buffer):
+                # Frame continues in next PES packet
+                break
+            if self.header == None:
+                self.header = header
+                self.timescale = AAC_SAMPLE_RATES[header['sampleRateIndex']]
+            frame = self.buffer[pos+header['headerLength']:pos+header['frameLength']]
+            self.samples.append(Sample(frame, AAC_FRAME_SAMPLES, True))
+            pos += header['frameLength']
+        self.buffer = self.buffer[pos:]
+    def finish(self):
+        return
+    def getAudioSpecificConfig(self):
+        if self.header == None:
+            raise Exception("No ADTS header found in AAC stream")
+        return struct.pack('>H', (self.header['objectType'] << 11) | (self.header['sampleRateIndex'] << 7) | (self.header['channels'] << 3))
+    def getChannels(self):
+        return self.header['channels']
@@ -0,0 +1,181 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import io
+import os
+import re
+import time
+import threading
+import collections
+from hls2dash import debug
+from hls2dash import metrics
+
+# Response of an HTTP request
+class Response:
+    def __init__(self, url, status, body, headers):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.headers = headers
+    def getHeader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+    def text(self):
+        return self.body.decode('utf-8')
+
+# HTTP client that keeps a pool of curl handles so that connections are
+# kept alive and reused between requests. DNS lookups and TLS sessions
+# are shared between all handles. pycurl is imported when a client is
+# used so that local playlists and segments do not load it
+class Client:
+    def __init__(self, maxhandles=16, timeout=10, connecttimeout=5, retries=2, maxvalidators=1024):
+        self.maxhandles = maxhandles
+        self.maxvalidators = maxvalidators
+        self.validators = collections.OrderedDict()
+        self.timeout = timeout
+        self.connecttimeout = connecttimeout
+        self.retries = retries
+        self.handles = []
+        self.lock = threading.Lock()
+        import pycurl
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        if hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+            self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+    def _acquire(self):
+        with self.lock:
+            if len(self.handles) > 0:
+                return self.handles.pop()
+        import pycurl
+        c = pycurl.Curl()
+        # The share is kept by the handle when it is reset
+        c.setopt(c.SHARE, self.share)
+        return c
+    def _release(self, c):
+        c.reset()
+        with self.lock:
+            if len(self.handles) < self.maxhandles:
+                self.handles.append(c)
+                return
+        c.close()
+    def _setup(self, c, uri, headers):
+        c.setopt(c.URL, uri)
+        c.setopt(c.NOSIGNAL, 1)
+        c.setopt(c.FOLLOWLOCATION, 1)
+        c.setopt(c.CONNECTTIMEOUT, self.connecttimeout)
+        c.setopt(c.TIMEOUT, self.timeout)
+        if hasattr(c, 'TCP_KEEPALIVE'):
+            c.setopt(c.TCP_KEEPALIVE, 1)
+        if headers:
+            c.setopt(c.HTTPHEADER, [ '%s: %s' % (k, v) for (k, v) in headers.items() ])
+    def request(self, uri, writer, byterange=None, headers=None, compressed=False):
+        import pycurl
+        attempt = 0
+        while True:
+            responseheaders = {}
+            def headerline(line):
+                res = re.match('^([^:]+):\s*(.*?)\s*$', line.decode('iso-8859-1'))
+                if res:
+                    responseheaders[res.group(1).lower()] = res.group(2)
+            c = self._acquire()
+            try:
+                self._setup(c, uri, headers)
+                c.setopt(c.WRITEFUNCTION, writer.write)
+                c.setopt(c.HEADERFUNCTION, headerline)
+                if byterange:
+                    c.setopt(c.RANGE, '%d-%d' % byterange)
+                if compressed:
+                    c.setopt(c.ENCODING, '')
+                with metrics.timer('http'):
+                    c.perform()
+                status = c.getinfo(c.RESPONSE_CODE)
+                url = c.getinfo(c.EFFECTIVE_URL)
+                metrics.count('http_requests')
+                metrics.count('http_bytes', int(c.getinfo(c.SIZE_DOWNLOAD)))
+                self._release(c)
+            except pycurl.error as e:
+                c.close()
+                status = None
+                url = uri
+                error = e
+            if status != None and status < 500:
+                return (url, status, responseheaders)
+            attempt += 1
+            if attempt > self.retries or not hasattr(writer, 'seek'):
+                if status == None:
+                    raise Exception("Failed to fetch %s: %s" % (uri, error))
+                return (url, status, responseheaders)
+            debug.log("Retrying %s (attempt %d, status=%s)" % (uri, attempt, status))
+            metrics.count('http_retries')
+            writer.seek(0)
+            writer.truncate()
+            time.sleep(0.2 * attempt)
+    def get(self, uri, byterange=None, headers=None, compressed=False):
+        buf = io.BytesIO()
+        (url, status, responseheaders) = self.request(uri, buf, byterange, headers, compressed)
+        return Response(url, status, buf.getvalue(), responseheaders)
+    # GET with If-None-Match and If-Modified-Since from the previous
+    # response for the URI. When the server answers 304 Not Modified the
+    # response has the body of the previous response
+    def getConditional(self, uri, compressed=False):
+        with self.lock:
+            cached = self.validators.get(uri)
+        headers = {}
+        if cached != None:
+            (etag, lastmodified, previous) = cached
+            if etag != None:
+                headers['If-None-Match'] = etag
+            if lastmodified != None:
+                headers['If-Modified-Since'] = lastmodified
+        response = self.get(uri, headers=headers, compressed=compressed)
+        if response.status == 304 and cached != None:
+            metrics.count('http_not_modified')
+            return Response(previous.url, 304, previous.body, previous.headers)
+        etag = response.getHeader('ETag')
+        lastmodified = response.getHeader('Last-Modified')
+        with self.lock:
+            self.validators.pop(uri, None)
+            if response.status == 200 and (etag != None or lastmodified != None):
+                self.validators[uri] = (etag, lastmodified, response)
+                while len(self.validators) > self.maxvalidators:
+                    self.validators.popitem(last=False)
+        return response
+    def download(self, uri, fileobj):
+        (url, status, responseheaders) = self.request(uri, fileobj)
+        if status >= 400:
+            raise Exception("Failed to fetch %s (HTTP %d)" % (uri, status))
+        return status
+
+client = None
+clientlock = threading.Lock()
+
+def getClient():
+    global client
+    with clientlock:
+        if client == None:
+            client = Client()
+    return client
+
+# Load an HLS playlist from a URI or a local file
+def getPlaylist(uri):
+    (content, baseuri) = fetchPlaylist(uri)
+    return parsePlaylist(content, baseuri)
+
+# Text of an HLS playlist and the base URI of the segments in it. A
+# remote playlist is fetched with a conditional request
+def fetchPlaylist(uri):
+    if not re.match('^http', uri):
+        with open(uri) as f:
+            return (f.read().strip(), os.path.dirname(uri))
+    debug.log("Fetching playlist %s" % uri)
+    response = getClient().getConditional(uri, compressed=True)
+    if response.status >= 400:
+        raise Exception("Failed to fetch playlist %s (HTTP %d)" % (uri, response.status))
+    baseuri = response.url.split('?')[0].rsplit('/', 1)[0] + '/'
+    return (response.text().strip(), baseuri)
+
+def parsePlaylist(content, baseuri):
+    import m3u8
+    return m3u8.M3U8(content, base_uri=baseuri)
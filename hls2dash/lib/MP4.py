@@ -0,0 +1,95 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import struct
+
+SAMPLE_FLAGS_SYNC = 0x02000000
+SAMPLE_FLAGS_NON_SYNC = 0x01010000
+
+MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+def box(boxtype, *payload):
+    data = b''.join([ bytes(p) for p in payload ])
+    return struct.pack('>I', 8 + len(data)) + boxtype + data
+
+def fullbox(boxtype, version, flags, *payload):
+    return box(boxtype, struct.pack('>I', (version << 24) | flags), *payload)
+
+def _descriptor(tag, payload):
+    return struct.pack('>B', tag) + struct.pack('>4B', 0x80, 0x80, 0x80, len(payload)) + payload
+
+def avc1(width, height, sps, pps):
+    avcc = struct.pack('>5B', 1, sps[1], sps[2], sps[3], 0xff)
+    avcc += struct.pack('>BH', 0xe1, len(sps)) + bytes(sps)
+    avcc += struct.pack('>BH', 1, len(pps)) + bytes(pps)
+    return box(b'avc1',
+        struct.pack('>6xH16xHHIIIH32xHh', 1, width, height, 0x00480000, 0x00480000, 0, 1, 0x0018, -1),
+        box(b'avcC', avcc))
+
+# The sample rate is 16.16 fixed point in the sample entry, rates above
+# 65535 Hz (88.2 and 96 kHz) do not fit and are given by the decoder
+# specific info only
+def mp4a(samplerate, channels, audioSpecificConfig):
+    if samplerate > 65535:
+        samplerate = 0
+    decoderconfig = struct.pack('>BBBHII', 0x40, 0x15, 0, 0, 0, 0) + _descriptor(0x05, audioSpecificConfig)
+    es = struct.pack('>HB', 1, 0) + _descriptor(0x04, decoderconfig) + _descriptor(0x06, b'\x02')
+    return box(b'mp4a',
+        struct.pack('>6xH8xHHHHI', 1, channels, 16, 0, 0, samplerate << 16),
+        fullbox(b'esds', 0, 0, _descriptor(0x03, es)))
+
+# Description of the single track in a fragmented MP4 file
+class Track:
+    def __init__(self, handler, timescale, sampleEntry, width=0, height=0):
+        self.trackId = 1
+        self.handler = handler
+        self.timescale = timescale
+        self.sampleEntry = sampleEntry
+        self.width = width
+        self.height = height
+    def isVideo(self):
+        return self.handler == b'vide'
+
+def initSegment(track):
+    ftyp = box(b'ftyp', b'iso6', struct.pack('>I', 0), b'iso6', b'isom', b'dash', b'mp41')
+    mvhd = fullbox(b'mvhd', 0, 0, struct.pack('>IIIIIH10x', 0, 0, 1000, 0, 0x00010000, 0x0100), MATRIX, struct.pack('>24xI', track.trackId + 1))
+    volume = 0 if track.isVideo() else 0x0100
+    tkhd = fullbox(b'tkhd', 0, 0x7, struct.pack('>IIIII8xhhH2x', 0, 0, track.trackId, 0, 0, 0, 0, volume), MATRIX, struct.pack('>II', track.width << 16, track.height << 16))
+    mdhd = fullbox(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, track.timescale, 0, 0x55c4, 0))
+    if track.isVideo():
+        hdlr = fullbox(b'hdlr', 0, 0, struct.pack('>I', 0), track.handler, struct.pack('12x'), b'VideoHandler\x00')
+        mediaheader = fullbox(b'vmhd', 0, 1, struct.pack('>8x'))
+    else:
+        hdlr = fullbox(b'hdlr', 0, 0, struct.pack('>I', 0), track.handler, struct.pack('12x'), b'SoundHandler\x00')
+        mediaheader = fullbox(b'smhd', 0, 0, struct.pack('>4x'))
+    dinf = box(b'dinf', fullbox(b'dref', 0, 0, struct.pack('>I', 1), fullbox(b'url ', 0, 1)))
+    stbl = box(b'stbl',
+        fullbox(b'stsd', 0, 0, struct.pack('>I', 1), track.sampleEntry),
+        fullbox(b'stts', 0, 0, struct.pack('>I', 0)),
+        fullbox(b'stsc', 0, 0, struct.pack('>I', 0)),
+        fullbox(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+        fullbox(b'stco', 0, 0, struct.pack('>I', 0)))
+    trak = box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, box(b'minf', mediaheader, dinf, stbl)))
+    mvex = box(b'mvex', fullbox(b'trex', 0, 0, struct.pack('>IIIII', track.trackId, 1, 0, 0, 0)))
+    return ftyp + box(b'moov', mvhd, trak, mvex)
+
+# A moof and mdat with all samples and baseMediaDecodeTime in the tfdt
+def fragment(track, samples, baseMediaDecodeTime, sequenceNumber=1):
+    entries = []
+    for s in samples:
+        flags = SAMPLE_FLAGS_SYNC if s.isSync else SAMPLE_FLAGS_NON_SYNC
+        entries.append(struct.pack('>IIII', s.duration, len(s.data), flags, s.compositionOffset))
+    trunflags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | 0x000800
+    mfhd = fullbox(b'mfhd', 0, 0, struct.pack('>I', sequenceNumber))
+    tfhd = fullbox(b'tfhd', 0, 0x020000, struct.pack('>I', track.trackId))
+    tfdt = fullbox(b'tfdt', 1, 0, struct.pack('>Q', baseMediaDecodeTime))
+    # The data offset in trun is relative to the start of moof and is
+    # known once the size of moof has been calculated
+    trunsize = 8 + 4 + 8 + 16 * len(entries)
+    moofsize = 8 + len(mfhd) + 8 + len(tfhd) + len(tfdt) + trunsize
+    trun = fullbox(b'trun', 0, trunflags, struct.pack('>Ii', len(entries), moofsize + 8), *entries)
+    moof = box(b'moof', mfhd, box(b'traf', tfhd, tfdt, trun))
+    mdat = box(b'mdat', *[ s.data for s in samples ])
+    return moof + mdat
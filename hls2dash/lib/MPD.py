@@ -3,22 +3,31 @@
 # license that can be found in the LICENSE file.
 # Author: Jonas Birme (Eyevinn Technology)
 
-import tempfile
 import re
-import m3u8
 import time
 import datetime
-import pycurl
 import os
 import json
-from ffprobe import FFProbe
+import collections
 from hls2dash.lib import util
 from hls2dash.lib import MPDAdaptationSet
 from hls2dash.lib import MPDRepresentation
-from hls2dash.lib import TS
+from hls2dash.lib import MPDTimeline
+from hls2dash.lib import ContextStore
+from hls2dash.lib import HTTP
 from hls2dash import debug
+from hls2dash import metrics
 import sys
 
+TIMINGS = [ 'probe', 'extinf', 'pdt' ]
+
+# Timestamps in a TS wrap at 2^33 ticks of the 90 kHz clock
+PTS_WRAP = 2 ** 33
+
+# Largest difference in seconds between a start time derived from the
+# EXTINF durations and a probed start time that is not reported as drift
+DRIFT_TOLERANCE = 0.1
+
 # Represents an MPEG DASH period
 class Period:
     def __init__(self, periodid):
@@ -27,6 +36,7 @@ class Period:
         self.periodDuration = 0.0
         self.as_video = None
         self.as_audio = None
+        self.timeline = MPDTimeline.Timeline()
         self.eventstream = []
         self.isLastPeriod = False
     def setPeriodStart(self, start):
@@ -37,15 +47,28 @@ class Period:
         return self.id
     def increaseDuration(self, duration):
         self.periodDuration += duration
+    def addSegment(self, duration):
+        self.timeline.addSegment(duration)
+        self.increaseDuration(duration)
+    def removeFirstSegment(self):
+        # Returns False when there are no segments left in this period
+        self.periodDuration -= self.timeline.removeFirstSegment()
+        self.as_video.removeFirstSegment()
+        self.as_audio.removeFirstSegment()
+        return self.timeline.haveSegments()
+    def getTimeline(self):
+        return self.timeline
     def setAsLastPeriod(self):
         self.isLastPeriod = True
     def addAdaptationSetVideo(self, as_video):
+        as_video.setTimeline(self.timeline)
         self.as_video = as_video
     def haveAdaptationSetVideo(self):
         return self.as_video != None
     def getAdaptationSetVideo(self):
         return self.as_video
     def addAdaptationSetAudio(self, as_audio):
+        as_audio.setTimeline(self.timeline)
         self.as_audio = as_audio
     def haveAdaptationSetAudio(self):
         return self.as_audio != None
@@ -54,18 +77,19 @@ class Period:
     def addSCTE35Splice(self, id, duration, scte35):
         event = SCTE35Event(id, util.NUM(duration), scte35)
         self.eventstream.append(event)
-    def asXML(self):
-        xml = '  <Period id="%s" start="%s">\n' % (self.id, util.PT(self.periodStart))
+    def writeXML(self, out):
+        out.write('  <Period id="%s" start="%s">\n' % (self.id, util.PT(self.periodStart)))
         if len(self.eventstream) > 0:
             timescale = self.eventstream[0].getTimescale()
-            xml += '    <EventStream timescale="%d" schemeIdUri="urn:scte:scte35:2014:xml+bin">\n' % timescale
+            out.write('    <EventStream timescale="%d" schemeIdUri="urn:scte:scte35:2014:xml+bin">\n' % timescale)
             for ev in self.eventstream:
-                xml += ev.asXML()
-            xml += '    </EventStream>\n'
-        xml += self.as_video.asXML()
-        xml += self.as_audio.asXML()
-        xml += '  </Period>\n'
-        return xml
+                ev.writeXML(out)
+            out.write('    </EventStream>\n')
+        self.as_video.writeXML(out)
+        self.as_audio.writeXML(out)
+        out.write('  </Period>\n')
+    def asXML(self):
+        return util.asXML(self)
 
 # An MPEG DASH Event (base class)
 class PeriodEvent:
@@ -83,53 +107,122 @@ class SCTE35Event(PeriodEvent):
     def __init__(self, id, duration, scte35):
         PeriodEvent.__init__(self, id, duration)
         self.scte35 = scte35
+    def writeXML(self, out):
+        out.write('      <Event duration="%d" id="%d">\n' % (self.timescale * self.duration, self.getId()))
+        out.write('       <scte35:Signal>\n')
+        out.write('         <scte35:Binary>\n')
+        out.write('           %s\n' % self.scte35)
+        out.write('         </scte35:Binary>\n')
+        out.write('       </scte35:Signal>\n')
+        out.write('      </Event>\n')
     def asXML(self):
-        xml = '      <Event duration="%d" id="%d">\n' % (self.timescale * self.duration, self.getId())
-        xml += '       <scte35:Signal>\n'
-        xml += '         <scte35:Binary>\n'
-        xml += '           %s\n' % self.scte35 
-        xml += '         </scte35:Binary>\n'
-        xml += '       </scte35:Signal>\n'
-        xml += '      </Event>\n'
-        return xml
+        return util.asXML(self)
+
+# Bounded cache of segment start times with LRU and age eviction
+class StartTimeCache:
+    def __init__(self, maxentries=256, maxage=3600):
+        self.maxentries = maxentries
+        self.maxage = maxage
+        self.entries = collections.OrderedDict()
+    def get(self, uri):
+        if not uri in self.entries:
+            return None
+        (starttime, created) = self.entries.pop(uri)
+        if time.time() - created > self.maxage:
+            return None
+        self.entries[uri] = (starttime, created)
+        return starttime
+    def put(self, uri, starttime):
+        if uri in self.entries:
+            del self.entries[uri]
+        self.entries[uri] = (starttime, time.time())
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+    def size(self):
+        return len(self.entries)
+    def asList(self):
+        now = time.time()
+        return [ [ uri, e[0], e[1] ] for (uri, e) in self.entries.items() if now - e[1] <= self.maxage ]
+    def fromList(self, l):
+        self.entries.clear()
+        for (uri, starttime, created) in l:
+            self.entries[uri] = (starttime, created)
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
 
 # Store context state between executions
 class Context:
-    def __init__(self, name, dir='/tmp/'):
-        if not dir.endswith('/'):
-            dir += '/'
-        self.filename = dir + name + '.ctx'
-        #self.filename = '/tmp/' + 'TEST' + '.ctx'
+    def __init__(self, name, dir='/tmp/', store=None):
+        if store == None:
+            store = ContextStore.FileStore(dir)
+        self.name = name
+        self.store = store
         self.timebase = 90000.0
         self.prevSplitTS = None
         self.nextSplitTS = None
+        self.anchor = None
+        self.derivedStarts = 0
+        self.pdtOffset = None
+        self.startTimeCache = StartTimeCache()
+    def getStartTimeCache(self):
+        return self.startTimeCache
     def getPrevSplit(self):
         if self.prevSplitTS == None:
             return 0
         return self.prevSplitTS
     def setPrevSplit(self, t):
         self.prevSplitTS = int(float(t) * self.timebase)
+    def setPrevSplitTicks(self, ticks):
+        self.prevSplitTS = ticks
     def getNextSplit(self):
         if self.nextSplitTS == None:
             return 0
         return self.nextSplitTS
     def setNextSplit(self, t):
         self.nextSplitTS = int(float(t) * self.timebase)
+    def setNextSplitTicks(self, ticks):
+        self.nextSplitTS = ticks
     def getTimeBase(self):
         return float(self.timebase)
     def resetNextSplit(self):
         self.nextSplitTS = None
+    # Media sequence number and start time in ticks of the last segment
+    # added, used to derive start times from the EXTINF durations
+    def getAnchor(self):
+        return self.anchor
+    def setAnchor(self, sequence, ticks):
+        self.anchor = (sequence, ticks)
+    # Number of period start times derived since the last probe
+    def getDerivedStarts(self):
+        return self.derivedStarts
+    def setDerivedStarts(self, count):
+        self.derivedStarts = count
+    # Media time minus program date time, in ticks
+    def getProgramDateTimeOffset(self):
+        return self.pdtOffset
+    def setProgramDateTimeOffset(self, ticks):
+        self.pdtOffset = ticks
+    # Exclusive lock on the stored context of the channel, held from
+    # restore through save
+    def lock(self):
+        return self.store.lock(self.name)
     def restore(self):
-        debug.log('Restoring context from %s' % self.filename)
-        if os.path.isfile(self.filename):
-            with open(self.filename, 'r+') as f:
-                data = f.read()
-                obj = json.loads(data)
-                self.timebase = obj['timebase']
-                if 'prevsplit' in obj:
-                    self.prevSplitTS = obj['prevsplit']
-                if 'nextsplit' in obj:
-                    self.nextSplitTS = obj['nextsplit']
+        debug.log('Restoring context %s from %s' % (self.name, self.store))
+        obj = self.store.load(self.name)
+        if obj != None:
+            self.timebase = obj['timebase']
+            if 'prevsplit' in obj:
+                self.prevSplitTS = obj['prevsplit']
+            if 'nextsplit' in obj:
+                self.nextSplitTS = obj['nextsplit']
+            if 'starttimes' in obj:
+                self.startTimeCache.fromList(obj['starttimes'])
+            if 'anchor' in obj:
+                self.anchor = tuple(obj['anchor'])
+            if 'derivedstarts' in obj:
+                self.derivedStarts = obj['derivedstarts']
+            if 'pdtoffset' in obj:
+                self.pdtOffset = obj['pdtoffset']
         debug.log('Context: %s' % self)
     def save(self):
         obj = {}
@@ -138,17 +231,23 @@ class Context:
             obj['prevsplit'] = self.prevSplitTS
         if self.nextSplitTS != None:
             obj['nextsplit'] = self.nextSplitTS
-        with open(self.filename, 'w+') as f:
-            f.seek(0)
-            f.write(json.dumps(obj, indent=4))
-            f.truncate()
-        debug.log('Saved context %s to %s' % (obj, self.filename))
+        obj['starttimes'] = self.startTimeCache.asList()
+        if self.anchor != None:
+            obj['anchor'] = list(self.anchor)
+            obj['derivedstarts'] = self.derivedStarts
+        if self.pdtOffset != None:
+            obj['pdtoffset'] = self.pdtOffset
+        self.store.save(self.name, obj)
+        debug.log('Saved context %s to %s' % (self, self.store))
     def __str__(self):
         s = 'timebase=%d' % self.timebase
         if self.prevSplitTS != None:
             s += ',prevsplit=%d' % self.prevSplitTS
         if self.nextSplitTS != None:
             s += ',nextsplit=%d' % self.nextSplitTS
+        if self.anchor != None:
+            s += ',anchor=%d:%d' % self.anchor
+        s += ',starttimes=%d' % self.startTimeCache.size()
         return s
 
 # MPEG DASH manifest (base class)
@@ -156,6 +255,7 @@ class Base:
     def __init__(self):
         self.maxSegmentDuration = 10
         self.firstSegmentStartTime = 0
+        self.availabilityStartTime = None
         self.periods = []
         period = Period('1')
         period.setPeriodStart(0.0)
@@ -171,17 +271,29 @@ class Base:
         return self.periods;
     def appendPeriod(self, period):
         self.periods.append(period)
-    def asXML(self):
-        xml = '<?xml version="1.0"?>\n';
-        xml += '<!-- Created with hls2dash (version=%s) -->\n' % self.version;
-        xml += '<!-- https://pypi.python.org/pypi/hls2dash -->\n'
-        xml += '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:scte35="urn:scte:scte35:2014:xml+bin" profiles="urn:mpeg:dash:profile:isoff-live:2011" type="dynamic" minimumUpdatePeriod="PT10S" minBufferTime="PT1.500S" maxSegmentDuration="%s" availabilityStartTime="%s" publishTime="%s">\n' % (util.PT(self.maxSegmentDuration), self._getAvailabilityStartTime(), self._getPublishTime())
+    def writeXML(self, out):
+        out.write('<?xml version="1.0"?>\n')
+        out.write('<!-- Created with hls2dash (version=%s) -->\n' % self.version)
+        out.write('<!-- https://pypi.python.org/pypi/hls2dash -->\n')
+        out.write('<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:scte35="urn:scte:scte35:2014:xml+bin" profiles="urn:mpeg:dash:profile:isoff-live:2011" type="dynamic" minimumUpdatePeriod="PT10S" minBufferTime="PT1.500S" maxSegmentDuration="%s" availabilityStartTime="%s" publishTime="%s">\n' % (util.PT(self.maxSegmentDuration), self._getAvailabilityStartTime(), self._getPublishTime()))
         if self.havePeriods():
             for p in self.getAllPeriods():
-                xml += p.asXML()
-        xml += '</MPD>\n'
-        return xml
+                p.writeXML(out)
+        out.write('</MPD>\n')
+    def asXML(self):
+        return util.asXML(self)
+    # MPEG DASH manifest without the attributes that change on every render
+    # even when the content is the same, to compare two versions. An
+    # availability start time from the program date time only changes
+    # with the content and is kept
+    def withoutTimestamps(self, xml):
+        if self.availabilityStartTime != None:
+            return re.sub(' publishTime="[^"]*"', '', xml)
+        return re.sub(' (publishTime|availabilityStartTime)="[^"]*"', '', xml)
     def _getAvailabilityStartTime(self):
+        if self.availabilityStartTime != None:
+            # Known from the program date time of the segments
+            return datetime.datetime.utcfromtimestamp(self.availabilityStartTime).isoformat() + "Z"
         tsnow = time.time()
         availstart = tsnow - self.firstSegmentStartTime
         return datetime.datetime.fromtimestamp(availstart).isoformat() + "Z"
@@ -190,7 +302,7 @@ class Base:
  
 # MPEG DASH manifest from a HLS manifest
 class HLS(Base):
-    def __init__(self, playlistlocator, splice=False, ctxdir='/tmp/', ctxname=None):
+    def __init__(self, playlistlocator, splice=False, ctxdir='/tmp/', ctxname=None, ctxstore=None):
         Base.__init__(self)
         self.playlistlocator = playlistlocator
         self.profilepattern = '^\D+(\d+.*)\.m3u8$'
@@ -204,6 +316,21 @@ class HLS(Base):
             self.isRemote = True
         self.currentPeriodIdx = 0
         self.profiles = []
+        self.mediaplaylisturi = None
+        self.variantplaylisturis = []
+        self.verifyVariants = False
+        self.laggingVariants = []
+        self.variantPool = None
+        self.lastplaylist = None
+        self.pollInterval = 2.0
+        self.probeLimiter = None
+        self.timing = 'probe'
+        self.timingVerifyInterval = 10
+        self.nextStartTicks = None
+        self.segmenturis = collections.OrderedDict()
+        self.newsegments = []
+        # (number, segment) for each media sequence in the playlist window
+        self.window = collections.deque()
 
         # If enabled splice into multi periods on SCTE35 markers
         self.splitperiod = splice
@@ -219,28 +346,201 @@ class HLS(Base):
             self.name = ctxname
         if self.name == None:
             raise Exception("Invalid playlistlocator, not an m3u8 file")
-        self.context = Context(self.name, ctxdir)
+        self.context = Context(self.name, ctxdir, ctxstore)
+
+    def getName(self):
+        return self.name
 
     def setProfilePattern(self, profilepattern):
         self.profilepattern = profilepatten
 
+    # Load all variant playlists and check that they are aligned
+    def setVerifyVariants(self, enabled):
+        self.verifyVariants = enabled
+
+    def getLaggingVariants(self):
+        return self.laggingVariants
+
+    # Semaphore shared with other channels in the same process that limits
+    # the number of concurrent segment probes
+    def setProbeLimiter(self, limiter):
+        self.probeLimiter = limiter
+
+    # With 'extinf' timing the start time of a period is derived from the
+    # durations of the segments since an earlier probed segment. With
+    # 'pdt' timing it is derived from EXT-X-PROGRAM-DATE-TIME, which also
+    # gives the availability start time, and from the durations for
+    # segments without one. A segment is probed to verify the derived
+    # time for every verifyinterval derived period starts (0 for never)
+    # and after a discontinuity
+    def setTiming(self, timing, verifyinterval=10):
+        if not timing in TIMINGS:
+            raise Exception("Unknown timing %s" % timing)
+        self.timing = timing
+        self.timingVerifyInterval = verifyinterval
+
     def load(self):
-        self.context.restore()
-        debug.log("Loading playlist: ", self.playlistlocator)
-        m3u8_obj = m3u8.load(self.playlistlocator)
-        if m3u8_obj.is_variant:
-            if m3u8_obj.playlist_type == "VOD":
-                raise Exception("VOD playlists not yet supported")
-            self._parseMaster(m3u8_obj)
-        else:
-            raise Exception("Can only create DASH manifest from an HLS master playlist")
-        p = m3u8_obj.playlists[0]
-        debug.log("Loading playlist: ", self.baseurl + p.uri)
-        self._parsePlaylist(m3u8.load(self.baseurl + p.uri))
+        with self.context.lock():
+            self.context.restore()
+            debug.log("Loading playlist: ", self.playlistlocator)
+            with metrics.timer('master_playlist'):
+                m3u8_obj = HTTP.getPlaylist(self.playlistlocator)
+            if m3u8_obj.is_variant:
+                if m3u8_obj.playlist_type == "VOD":
+                    raise Exception("VOD playlists not yet supported")
+                self._parseMaster(m3u8_obj)
+            else:
+                raise Exception("Can only create DASH manifest from an HLS master playlist")
+            self.variantplaylisturis = [ self.baseurl + p.uri for p in m3u8_obj.playlists ]
+            self.mediaplaylisturi = self.variantplaylisturis[0]
+            self._loadMediaPlaylist()
+            self.context.save()
+
+    # Reload the media playlist and rebuild the periods if it has changed
+    # since last load. Returns True if the manifest was updated
+    def refresh(self):
+        if self.mediaplaylisturi == None:
+            self.load()
+            return True
+        with self.context.lock():
+            if not self._loadMediaPlaylist():
+                return False
+            self.context.save()
+        return True
+
+    def getPollInterval(self):
+        return self.pollInterval
+
+    def getWindowDuration(self):
+        return sum([ p.periodDuration for p in self.getAllPeriods() ])
+
+    # URI of the TS segment with a number as in the SegmentTemplate of
+    # the MPD, for the variant with a profile. Returns None if the segment
+    # is not in the current playlist window
+    def getSegmentURI(self, profile, number):
+        uri = self.segmenturis.get(int(number))
+        if uri == None:
+            return None
+        stems = dict([ (p['profile'], p['stem']) for p in self.profiles ])
+        if not profile in stems:
+            return None
+        # Segments are named as the variant playlist, master2500.m3u8
+        # has master2500_34202.ts and master1500.m3u8 has master1500_34202.ts
+        (dirname, basename) = uri.rsplit('/', 1) if '/' in uri else ('', uri)
+        first = self.profiles[0]['stem']
+        if basename.startswith(first):
+            basename = stems[profile] + basename[len(first):]
+        if dirname:
+            return dirname + '/' + basename
+        return basename
+
+    def getProfiles(self):
+        return [ p['profile'] for p in self.profiles ]
+
+    # Numbers of the segments in the current playlist window
+    def getSegmentNumbers(self):
+        return self.segmenturis.keys()
+
+    # Numbers of the segments that have been added since the last call
+    def popNewSegments(self):
+        numbers = self.newsegments
+        self.newsegments = []
+        return numbers
+
+    def _getSegmentURI(self, seg):
+        uri = seg.uri
+        if not re.match('^http', uri):
+            uri = seg.base_uri + uri
+        if self.isRemote and not re.match('^http', uri):
+            uri = self.baseurl + uri
+        return uri
+
+    # Returns the number of the segment or None if it has no number
+    def _addSegmentURI(self, seg):
+        result = re.match(self.numberpattern, seg.uri)
+        if not result:
+            return None
+        self.segmenturis[int(result.group(1))] = self._getSegmentURI(seg)
+        self.newsegments.append(int(result.group(1)))
+        return int(result.group(1))
+
+    def _loadMediaPlaylist(self):
+        with metrics.timer('media_playlist'):
+            if self.verifyVariants and len(self.variantplaylisturis) > 1:
+                playlists = self._loadVariantPlaylists()
+                self._checkVariantAlignment(playlists)
+                playlist = playlists[0]
+                content = playlist.dumps()
+            else:
+                debug.log("Loading playlist: ", self.mediaplaylisturi)
+                (content, baseuri) = HTTP.fetchPlaylist(self.mediaplaylisturi)
+                playlist = None
+        if content == self.lastplaylist:
+            # Nothing to parse or render
+            debug.log("Playlist %s not changed" % self.mediaplaylisturi)
+            metrics.count('unchanged_playlists')
+            return False
+        with metrics.timer('parse'):
+            if playlist == None:
+                playlist = HTTP.parsePlaylist(content, baseuri)
+            if self.lastplaylist == None:
+                self._parsePlaylist(playlist)
+            elif not self._updatePlaylist(playlist):
+                metrics.count('full_parses')
+                self._resetPeriods()
+                self._parsePlaylist(playlist)
+        self.lastplaylist = content
+        if playlist.target_duration:
+            self.pollInterval = playlist.target_duration / 2.0
         for per in self.getAllPeriods():
             debug.log("Audio: ", per.as_audio)
             debug.log("Video: ", per.as_video)
-        self.context.save()
+        return True
+
+    def _loadVariantPlaylists(self):
+        # Fetch all variants concurrently so that a refresh takes as long
+        # as the slowest fetch and not the sum of all of them. The pool is
+        # kept for the lifetime of this object
+        import multiprocessing.pool
+        if self.variantPool == None:
+            self.variantPool = multiprocessing.pool.ThreadPool(len(self.variantplaylisturis))
+        debug.log("Loading %d variant playlists" % len(self.variantplaylisturis))
+        result = self.variantPool.map_async(HTTP.getPlaylist, self.variantplaylisturis)
+        # A refresh must complete within one target duration
+        timeout = self.maxSegmentDuration or 10
+        try:
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            raise Exception("Variant playlists not loaded within %s seconds" % timeout)
+
+    def close(self):
+        if self.variantPool != None:
+            self.variantPool.close()
+            self.variantPool.join()
+            self.variantPool = None
+
+    def _checkVariantAlignment(self, playlists):
+        lastsequences = []
+        for playlist in playlists:
+            lastsequences.append(self._getMediaSequence(playlist) + len(playlist.segments) - 1)
+        self.laggingVariants = []
+        for (uri, playlist, last) in zip(self.variantplaylisturis, playlists, lastsequences):
+            lag = max(lastsequences) - last
+            if lag > 0 or self._getMediaSequence(playlist) != self._getMediaSequence(playlists[0]):
+                sys.stderr.write("Warning: variant %s is not aligned (media sequence %d, %d segments behind)\n" %
+                                 (uri, self._getMediaSequence(playlist), lag))
+                metrics.count('variants_lagging')
+                self.laggingVariants.append((uri, lag))
+
+    def _resetPeriods(self):
+        self.segmenturis.clear()
+        self.window.clear()
+        self.periods = []
+        self.currentPeriodIdx = 0
+        period = Period('1')
+        period.setPeriodStart(0.0)
+        self.appendPeriod(period)
+        self._initiatePeriod(period, self.profiles)
 
     def _profileFromFilename(self, filename):
         result = re.match(self.profilepattern, filename)
@@ -265,142 +565,327 @@ class HLS(Base):
     def _parsePlaylist(self, playlist):
         debug.log("Splicing enabled=%s" % self.splitperiod)
         self.maxSegmentDuration = playlist.target_duration
-        isFirstInPeriod = True
-        isFirst = True
-        doSplit = False
-        eventid = 1
-        offset = 0.0
-        state = 'initial'
-        isFirstSplit = True
-        lastnumber = None
-        periodid = 'UNDEF'
+        self.isFirstInPeriod = True
+        self.isFirst = True
+        self.doSplit = False
+        self.eventid = 1
+        self.state = 'initial'
+        self.isFirstSplit = True
+        self.firstsequence = self._getMediaSequence(playlist)
+        self.lastsequence = self.firstsequence - 1
+        if self.timing != 'probe':
+            self.nextStartTicks = self._getAnchoredStartTicks(playlist)
         for seg in playlist.segments:
-            if state == 'initial':
-                if seg.cue_out == True:
-                    state = 'insidecue'
-                else:
-                    state = 'outsidecue'
-            elif state == 'outsidecue':
-                if seg.cue_out == True:
-                    state = 'insidecue'
-                    if not isFirst:
-                        doSplit = True
-            elif state == 'insidecue':
-                if seg.cue_out == False:
-                    state = 'outsidecue'
-                    if not isFirst:
-                        doSplit = True
-            #debug.log("[%s][P%d]: %s" % (state, self.currentPeriodIdx, seg.uri))
-
-            if self.splitperiod and doSplit:
-                debug.log("-- Split period before %s" % seg.uri)
-                self.currentPeriodIdx = self.currentPeriodIdx + 1
-                newperiod = Period("P%s" % self._getStartNumberFromFilename(seg.uri))
-                self._initiatePeriod(newperiod, self.profiles)
-                self.appendPeriod(newperiod)
-                isFirstInPeriod = True
-                doSplit = False
-            duration = float(seg.duration)
-            videoseg = MPDRepresentation.Segment(duration, isFirstInPeriod)
-            audioseg = MPDRepresentation.Segment(duration, isFirstInPeriod)
-            period = self.getPeriod(self.currentPeriodIdx)
-            period.getAdaptationSetVideo().addSegment(videoseg)
-            period.getAdaptationSetAudio().addSegment(audioseg)
-            period.increaseDuration(duration)
-            offset += duration
-            if isFirstInPeriod:
-                # Add EventStream to place SCTE35 metadata
-                debug.log("SCTE35:%s (%s, %s)" % (seg.scte35, seg.cue_out, state))
-                if state == 'insidecue' and seg.cue_out == True:
-                    period.addSCTE35Splice(eventid, seg.scte35_duration, seg.scte35)
-                    eventid = eventid + 1
-                # Obtain the start time for the first segment in this period
-                firstStartTimeInPeriod = self._getStartTimeFromFile(seg.base_uri + seg.uri)
-                firstStartTimeInPeriodTicks = int(float(firstStartTimeInPeriod) * self.context.getTimeBase())
-                # Determine the period ID
-                if isFirst == True:
-                    debug.log('firstStartTimeInPeriod=%d, prevsplit=%d' % (firstStartTimeInPeriodTicks, self.context.getPrevSplit()))
-                    # Store the first segment start time in this manifest
-                    # to be able to calculate the MPD availability start time
-                    self.firstSegmentStartTime = firstStartTimeInPeriod
-                    # As this is the very first period and we then need to determine
-                    # whether the first segment belongs to a period created
-                    # in previous manifest so the correct period id is set
-                    if self.context.getPrevSplit() == 0:
-                        # We have no information of previous split so use
-                        # the start time in this period as period id
-                        # and save it for later use
-                        self.context.setPrevSplit(firstStartTimeInPeriod)
-                        periodid = self.context.getPrevSplit()
-                    elif firstStartTimeInPeriodTicks < 0:
-                        # Start time for a segment can actually be negative. No
-                        # good way to handle it but as long as it is increasing
-                        # it will eventually be back to normal
-                        periodid = firstStartTimeInPeriodTicks
-                        self.context.setPrevSplit(firstStartTimeInPeriod)
-                    elif firstStartTimeInPeriodTicks >= self.context.getPrevSplit():
-                        if self.context.getNextSplit() == 0:
-                            periodid = self.context.getPrevSplit()
-                        elif firstStartTimeInPeriodTicks < self.context.getNextSplit():
-                            # Start time for the first segment in this period
-                            # is still before the next split and we should use
-                            # period id belonging to previous manifest
-                            periodid = self.context.getPrevSplit()
-                        else:
-                            # Start time for the first segment in this period
-                            # belongs to a new period unless this is the only period
-                            # in this manifest and is actually the last split
-                            if self.context.getNextSplit() < self.context.getPrevSplit():
-                                period = self.context.getPrevSplit()
-                            else:
-                                periodid = firstStartTimeInPeriodTicks
-                                self.context.setPrevSplit(firstStartTimeInPeriod)
-                    elif firstStartTimeInPeriodTicks < self.context.getPrevSplit():
-                        # If start time of first segment is smaller than ts of
-                        # last split a segment time stamp reset / overflow must have
-                        # occured
-                        periodid = firstStartTimeInPeriodTicks
-                        self.context.setPrevSplit(firstStartTimeInPeriod)
-                else:
-                    # Start time for the first segment in this period after a split
-                    # is the period id
-                    periodid = firstStartTimeInPeriodTicks
-                    if isFirstSplit == True:
-                        # Save the segment start time for the first split
-                        self.context.setNextSplit(firstStartTimeInPeriod)
-                        isFirstSplit = False
-                period.setPeriodId(periodid)
-                # Set period start time
-                periodstartsec = float(periodid / self.context.getTimeBase())
-                period.setPeriodStart(periodstartsec)
-                # Set segment start time and start number for the video and audio segments
-                videoseg.setStartTime(firstStartTimeInPeriod)
-                audioseg.setStartTime(firstStartTimeInPeriod)
-                as_audio = period.getAdaptationSetAudio()
-                as_video = period.getAdaptationSetVideo()
-                as_video.setStartNumber(self._getStartNumberFromFilename(seg.uri))
-                as_video.setStartTime(periodstartsec)
-                as_audio.setStartNumber(self._getStartNumberFromFilename(seg.uri))
-                as_audio.setStartTime(periodstartsec)
-            isFirstInPeriod = False
-            isFirst = False
+            self._addSegment(seg)
         if self.context.getNextSplit() < self.context.getPrevSplit():
             # No new split in this manifest, last split is the current one
             self.context.resetNextSplit()
         allperiods = self.getAllPeriods()
         lastperiod = allperiods[len(allperiods)-1]
         lastperiod.setAsLastPeriod()
-    
+
+    # Apply a new version of the media playlist by removing the expired
+    # segments from the head and appending the new segments, keyed on the
+    # media sequence number. Returns False if the new playlist does not
+    # overlap the current one and a full parse is needed
+    def _updatePlaylist(self, playlist):
+        first = self._getMediaSequence(playlist)
+        last = first + len(playlist.segments) - 1
+        if first < self.firstsequence or first > self.lastsequence or last < self.lastsequence:
+            debug.log("Media sequence %d-%d does not overlap %d-%d" % (first, last, self.firstsequence, self.lastsequence))
+            return False
+        if playlist.segments[self.lastsequence - first].uri != self.lastsegmenturi:
+            debug.log("Segment %d is not %s" % (self.lastsequence, self.lastsegmenturi))
+            return False
+        debug.log("Updating media sequence %d-%d to %d-%d" % (self.firstsequence, self.lastsequence, first, last))
+        self.maxSegmentDuration = playlist.target_duration
+        if self.firstsequence < first:
+            while self.firstsequence < first:
+                self._removeFirstSegment()
+            self._updateFirstSegment()
+        lastperiod = self.getPeriod(len(self.periods) - 1)
+        for seg in playlist.segments[self.lastsequence - first + 1:]:
+            self._addSegment(seg)
+        if lastperiod != self.getPeriod(len(self.periods) - 1):
+            lastperiod.isLastPeriod = False
+            self.getPeriod(len(self.periods) - 1).setAsLastPeriod()
+        if self.context.getNextSplit() < self.context.getPrevSplit():
+            # No new split in this manifest, last split is the current one
+            self.context.resetNextSplit()
+        return True
+
+    def _getMediaSequence(self, playlist):
+        if playlist.media_sequence == None:
+            return 0
+        return int(playlist.media_sequence)
+
+    def _removeFirstSegment(self):
+        period = self.getPeriod(0)
+        self.firstsequence += 1
+        (number, seg) = self.window.popleft()
+        # A later segment in the window can have the same number
+        if number != None and self.segmenturis.get(number) == self._getSegmentURI(seg):
+            del self.segmenturis[number]
+        if period.removeFirstSegment():
+            self.firstSegmentStartTime = period.getTimeline().getStartTime()
+            return
+        # All segments in the first period have expired and the next
+        # period is now the first one
+        debug.log("Period %s expired" % period.getPeriodId())
+        self.periods.pop(0)
+        self.currentPeriodIdx -= 1
+        period = self.getPeriod(0)
+        self.firstSegmentStartTime = period.getTimeline().getStartTime()
+        self.context.setPrevSplitTicks(period.getPeriodId())
+        if len(self.periods) > 1:
+            self.context.setNextSplitTicks(self.getPeriod(1).getPeriodId())
+        else:
+            self.context.resetNextSplit()
+            self.isFirstSplit = True
+
+    # After segments have expired the first segment of the first period is
+    # another one, and the period is made as it would be by a full parse
+    # of the playlist: the SCTE35 event is the one of the new first segment
+    # and with probe timing its start time is probed
+    def _updateFirstSegment(self):
+        period = self.getPeriod(0)
+        seg = self.window[0][1]
+        period.eventstream = []
+        if seg.cue_out == True:
+            period.addSCTE35Splice(0, seg.scte35_duration, seg.scte35)
+        # Events are numbered in order of appearance
+        self.eventid = 1
+        for p in self.getAllPeriods():
+            for ev in p.eventstream:
+                ev.id = self.eventid
+                self.eventid += 1
+        if self.timing == 'probe':
+            period.getTimeline().setStartTime(self._getStartTimeFromFile(seg.base_uri + seg.uri))
+        self.firstSegmentStartTime = period.getTimeline().getStartTime()
+
+    def _addSegment(self, seg):
+        if self.state == 'initial':
+            if seg.cue_out == True:
+                self.state = 'insidecue'
+            else:
+                self.state = 'outsidecue'
+        elif self.state == 'outsidecue':
+            if seg.cue_out == True:
+                self.state = 'insidecue'
+                if not self.isFirst:
+                    self.doSplit = True
+        elif self.state == 'insidecue':
+            if seg.cue_out == False:
+                self.state = 'outsidecue'
+                if not self.isFirst:
+                    self.doSplit = True
+        #debug.log("[%s][P%d]: %s" % (self.state, self.currentPeriodIdx, seg.uri))
+
+        if self.splitperiod and self.doSplit:
+            debug.log("-- Split period before %s" % seg.uri)
+            self.currentPeriodIdx = self.currentPeriodIdx + 1
+            newperiod = Period("P%s" % self._getStartNumberFromFilename(seg.uri))
+            self._initiatePeriod(newperiod, self.profiles)
+            self.appendPeriod(newperiod)
+            self.isFirstInPeriod = True
+            self.doSplit = False
+        self.lastsequence += 1
+        self.lastsegmenturi = seg.uri
+        self.window.append((self._addSegmentURI(seg), seg))
+        segmentTicks = self.nextStartTicks
+        duration = float(seg.duration)
+        period = self.getPeriod(self.currentPeriodIdx)
+        period.addSegment(duration)
+        if self.isFirstInPeriod:
+            # Add EventStream to place SCTE35 metadata
+            debug.log("SCTE35:%s (%s, %s)" % (seg.scte35, seg.cue_out, self.state))
+            if self.state == 'insidecue' and seg.cue_out == True:
+                period.addSCTE35Splice(self.eventid, seg.scte35_duration, seg.scte35)
+                self.eventid = self.eventid + 1
+            # Obtain the start time for the first segment in this period
+            if self.timing != 'probe':
+                (firstStartTimeInPeriod, segmentTicks) = self._getDerivedStartTime(seg, segmentTicks)
+            else:
+                firstStartTimeInPeriod = self._getStartTimeFromFile(seg.base_uri + seg.uri)
+            firstStartTimeInPeriodTicks = int(float(firstStartTimeInPeriod) * self.context.getTimeBase())
+            # Determine the period ID
+            if self.isFirst == True:
+                debug.log('firstStartTimeInPeriod=%d, prevsplit=%d' % (firstStartTimeInPeriodTicks, self.context.getPrevSplit()))
+                # Store the first segment start time in this manifest
+                # to be able to calculate the MPD availability start time
+                self.firstSegmentStartTime = firstStartTimeInPeriod
+                # As this is the very first period and we then need to determine
+                # whether the first segment belongs to a period created
+                # in previous manifest so the correct period id is set
+                if self.context.getPrevSplit() == 0:
+                    # We have no information of previous split so use
+                    # the start time in this period as period id
+                    # and save it for later use
+                    self.context.setPrevSplit(firstStartTimeInPeriod)
+                    periodid = self.context.getPrevSplit()
+                elif firstStartTimeInPeriodTicks < 0:
+                    # Start time for a segment can actually be negative. No
+                    # good way to handle it but as long as it is increasing
+                    # it will eventually be back to normal
+                    periodid = firstStartTimeInPeriodTicks
+                    self.context.setPrevSplit(firstStartTimeInPeriod)
+                elif firstStartTimeInPeriodTicks >= self.context.getPrevSplit():
+                    if self.context.getNextSplit() == 0:
+                        periodid = self.context.getPrevSplit()
+                    elif firstStartTimeInPeriodTicks < self.context.getNextSplit():
+                        # Start time for the first segment in this period
+                        # is still before the next split and we should use
+                        # period id belonging to previous manifest
+                        periodid = self.context.getPrevSplit()
+                    else:
+                        # Start time for the first segment in this period
+                        # belongs to a new period unless this is the only period
+                        # in this manifest and is actually the last split
+                        if self.context.getNextSplit() < self.context.getPrevSplit():
+                            periodid = self.context.getPrevSplit()
+                        else:
+                            periodid = firstStartTimeInPeriodTicks
+                            self.context.setPrevSplit(firstStartTimeInPeriod)
+                elif firstStartTimeInPeriodTicks < self.context.getPrevSplit():
+                    # If start time of first segment is smaller than ts of
+                    # last split a segment time stamp reset / overflow must have
+                    # occured
+                    periodid = firstStartTimeInPeriodTicks
+                    self.context.setPrevSplit(firstStartTimeInPeriod)
+            else:
+                # Start time for the first segment in this period after a split
+                # is the period id
+                periodid = firstStartTimeInPeriodTicks
+                if self.isFirstSplit == True:
+                    # Save the segment start time for the first split
+                    self.context.setNextSplit(firstStartTimeInPeriod)
+                    self.isFirstSplit = False
+            period.setPeriodId(periodid)
+            # Set period start time
+            periodstartsec = float(periodid / self.context.getTimeBase())
+            period.setPeriodStart(periodstartsec)
+            # Set segment start time and start number for the video and audio segments
+            period.getTimeline().setStartTime(firstStartTimeInPeriod)
+            as_audio = period.getAdaptationSetAudio()
+            as_video = period.getAdaptationSetVideo()
+            as_video.setStartNumber(self._getStartNumberFromFilename(seg.uri))
+            as_video.setStartTime(periodstartsec)
+            as_audio.setStartNumber(self._getStartNumberFromFilename(seg.uri))
+            as_audio.setStartTime(periodstartsec)
+        if self.timing != 'probe' and segmentTicks != None:
+            self.context.setAnchor(self.lastsequence, segmentTicks % PTS_WRAP)
+            self.nextStartTicks = segmentTicks + int(round(duration * self.context.getTimeBase()))
+        self.isFirstInPeriod = False
+        self.isFirst = False
+
+    # Start time in ticks of the first segment in the playlist from the
+    # anchor in the context, or None if the anchor segment is not in it
+    def _getAnchoredStartTicks(self, playlist):
+        anchor = self.context.getAnchor()
+        if anchor == None:
+            return None
+        (sequence, ticks) = anchor
+        idx = sequence - self.firstsequence
+        if idx < 0 or idx >= len(playlist.segments):
+            debug.log("Anchor segment %d not in playlist" % sequence)
+            return None
+        for seg in playlist.segments[:idx]:
+            ticks -= int(round(float(seg.duration) * self.context.getTimeBase()))
+        return ticks
+
+    # Start time of a segment that starts a period, derived from the
+    # program date time or the EXTINF durations when possible. Returns the
+    # start time in seconds and in ticks
+    def _getDerivedStartTime(self, seg, ticks):
+        if self.timing == 'pdt':
+            pdt = self._getProgramDateTime(seg)
+            if pdt != None:
+                return self._getStartTimeFromProgramDateTime(seg, pdt)
+        timebase = self.context.getTimeBase()
+        if ticks != None and not self._isVerifyDue(seg):
+            metrics.count('derived_starttimes')
+            return ((ticks % PTS_WRAP) / timebase, ticks)
+        starttime = self._getStartTimeFromFile(seg.base_uri + seg.uri)
+        self.context.setDerivedStarts(0)
+        probedTicks = int(round(starttime * timebase))
+        if ticks != None:
+            self._checkDrift(seg, probedTicks, ticks)
+        return (starttime, probedTicks)
+
+    # The start time is the program date time plus the offset between the
+    # media timestamps and the program date time, which is found by
+    # probing once and kept in the context
+    def _getStartTimeFromProgramDateTime(self, seg, pdt):
+        timebase = self.context.getTimeBase()
+        pdtTicks = int(round(util.epoch(pdt) * timebase))
+        offset = self.context.getProgramDateTimeOffset()
+        if offset != None and not self._isVerifyDue(seg):
+            metrics.count('pdt_starttimes')
+            ticks = pdtTicks + offset
+        else:
+            starttime = self._getStartTimeFromFile(seg.base_uri + seg.uri)
+            self.context.setDerivedStarts(0)
+            ticks = int(round(starttime * timebase))
+            if offset != None:
+                self._checkDrift(seg, ticks, pdtTicks + offset)
+            self.context.setProgramDateTimeOffset(ticks - pdtTicks)
+        # Media time zero in wall clock time, the same for all segments as
+        # long as the offset is unchanged
+        self.availabilityStartTime = (pdtTicks - ticks % PTS_WRAP) / timebase
+        return ((ticks % PTS_WRAP) / timebase, ticks)
+
+    def _getProgramDateTime(self, seg):
+        pdt = getattr(seg, 'current_program_date_time', None)
+        if pdt == None:
+            pdt = seg.program_date_time
+        return pdt
+
+    # Returns True if a derived start time should be verified by probing
+    # the segment, which is on every timingVerifyInterval derived start
+    # time and after a discontinuity
+    def _isVerifyDue(self, seg):
+        derived = self.context.getDerivedStarts() + 1
+        if seg.discontinuity or (self.timingVerifyInterval != 0 and derived >= self.timingVerifyInterval):
+            return True
+        self.context.setDerivedStarts(derived)
+        return False
+
+    def _checkDrift(self, seg, probedTicks, derivedTicks):
+        timebase = self.context.getTimeBase()
+        drift = (probedTicks - derivedTicks + PTS_WRAP / 2) % PTS_WRAP - PTS_WRAP / 2
+        if abs(drift) > DRIFT_TOLERANCE * timebase:
+            debug.log("Warning: start time of %s is %f, %f seconds from the derived time" % (seg.uri, probedTicks / timebase, drift / timebase))
+            metrics.count('timing_drift')
+
     def _getStartTimeFromFile(self, uri):
+        if self.isRemote and not re.match('^http', uri):
+            uri = self.baseurl + uri
+        cache = self.context.getStartTimeCache()
+        starttime = cache.get(uri)
+        if starttime != None:
+            debug.log("Start time for %s from cache: %f" % (uri, starttime))
+            metrics.count('starttime_cache_hits')
+            return starttime
+        metrics.count('starttime_cache_misses')
+        # Imported here as it is not needed when all start times are cached
+        from hls2dash.lib import TS
         if self.isRemote:
-            if not re.match('^http', uri):
-                uri = self.baseurl + uri
             ts = TS.Remote(uri)
         else:
             ts = TS.Local(uri)
-        ts.probe()
+        metrics.count('probes')
+        if self.probeLimiter != None:
+            self.probeLimiter.acquire()
+        try:
+            with metrics.timer('probe'):
+                ts.probe()
+        finally:
+            if self.probeLimiter != None:
+                self.probeLimiter.release()
         ts.cleanup()
-        return ts.getStartTime()
+        starttime = ts.getStartTime()
+        cache.put(uri, starttime)
+        return starttime
 
     def _initiatePeriod(self, period, profiles):
         for p in profiles:
@@ -428,6 +913,7 @@ class HLS(Base):
             profile = self._profileFromFilename(playlist.uri) 
             profilemetadata = {
                 'profile': profile,
+                'stem': os.path.splitext(os.path.basename(playlist.uri))[0],
                 'videocodec': video_codec,
                 'audiocodec': audio_codec,
                 'stream': stream
@@ -3,10 +3,13 @@
 # license that can be found in the LICENSE file.
 # Author: Jonas Birme (Eyevinn Technology)
 
+from hls2dash.lib import util
+from hls2dash.lib import MPDTimeline
+
 class Base:
     def __init__(self, mimeType, codec, timescale):
         self.representations = []
-        self.segments = []
+        self.timeline = MPDTimeline.Timeline()
         self.mimeType = mimeType
         self.codec = codec
         self.timescale = timescale
@@ -16,9 +19,14 @@ class Base:
         self.representations.append(representation)
     def getRepresentations(self):
         return self.representations
-    def addSegment(self, segment):
-        segment.setTimescale(self.timescale)
-        self.segments.append(segment)
+    def setTimeline(self, timeline):
+        self.timeline = timeline
+    def getTimeline(self):
+        return self.timeline
+    def removeFirstSegment(self):
+        # Called when the first segment has been removed from the shared
+        # timeline of the period
+        self.startNumber = str(int(self.startNumber or '0') + 1)
     def setStartNumber(self, startNumber):
         self.startNumber = startNumber.lstrip('0')
     def setStartTime(self, startTime):
@@ -27,18 +35,21 @@ class Base:
         return self.presentationTimeOffset
     def getTimescale(self):
         return self.timescale
+    def writeTimeline(self, out):
+        self.timeline.writeXML(out, self.timescale)
+    def timelineAsXML(self):
+        return self.timeline.asXML(self.timescale)
     def __str__(self):
         s = "(mimeType=%s, codec=%s, representations=%d):\n" % (self.mimeType, self.codec, len(self.representations))
         for r in self.representations:
             s += "        + " + str(r) + "\n"
-        for seg in self.segments:
-            s += "           + " + str(seg) + "\n"
+        s += "           + " + str(self.timeline) + "\n"
         return s
 
 class Video(Base):
     def __init__(self, mimeType, codec):
         Base.__init__(self, mimeType, codec, 90000)
-    def asXML(self):
+    def writeXML(self, out):
         idxlist = xrange(len(self.representations))
         maxWidth = self.representations[max(idxlist, key = lambda x: self.representations[x].getWidth())].getWidth()
         maxHeight = self.representations[max(idxlist, key = lambda x: self.representations[x].getHeight())].getHeight()
@@ -46,34 +57,32 @@ class Video(Base):
         minWidth = self.representations[min(idxlist, key = lambda x: self.representations[x].getWidth())].getWidth()
         minHeight = self.representations[min(idxlist, key = lambda x: self.representations[x].getHeight())].getHeight()
         minBandwidth = self.representations[min(idxlist, key = lambda x: self.representations[x].getBandwidth())].getBandwidth()
-        xml = ''
-        xml += '    <AdaptationSet mimeType="%s" codecs="%s" minWidth="%d" maxWidth="%d" minHeight="%d" maxHeight="%d" startWithSAP="1" segmentAlignment="true" minBandwidth="%d" maxBandwidth="%d">\n' % (self.mimeType, self.codec, minWidth, maxWidth, minHeight, maxHeight, minBandwidth, maxBandwidth)
-        xml += '      <SegmentTemplate timescale="%d" media="$RepresentationID$_$Number$.dash" presentationTimeOffset="%s" startNumber="%s">\n' % (self.timescale, self.presentationTimeOffset, self.startNumber)
-        xml += '        <SegmentTimeline>\n';
-        for s in self.segments:
-            xml += s.asXML()
-        xml += '        </SegmentTimeline>\n';
-        xml += '      </SegmentTemplate>\n'
+        out.write('    <AdaptationSet mimeType="%s" codecs="%s" minWidth="%d" maxWidth="%d" minHeight="%d" maxHeight="%d" startWithSAP="1" segmentAlignment="true" minBandwidth="%d" maxBandwidth="%d">\n' % (self.mimeType, self.codec, minWidth, maxWidth, minHeight, maxHeight, minBandwidth, maxBandwidth))
+        out.write('      <SegmentTemplate timescale="%d" media="$RepresentationID$_$Number$.dash" presentationTimeOffset="%s" startNumber="%s">\n' % (self.timescale, self.presentationTimeOffset, self.startNumber))
+        out.write('        <SegmentTimeline>\n')
+        self.writeTimeline(out)
+        out.write('        </SegmentTimeline>\n')
+        out.write('      </SegmentTemplate>\n')
         for r in self.representations:
-            xml += r.asXML()
-        xml += '    </AdaptationSet>\n'
-        return xml
+            r.writeXML(out)
+        out.write('    </AdaptationSet>\n')
+    def asXML(self):
+        return util.asXML(self)
 
 class Audio(Base):
     def __init__(self, mimeType, codec):
         Base.__init__(self, mimeType, codec, 48000)
-    def asXML(self):
-        xml = ''
-        xml += '    <AdaptationSet mimeType="%s" codecs="%s">\n' % (self.mimeType, self.codec)
-        xml += '      <SegmentTemplate timescale="%d" media="$RepresentationID$_$Number$.dash" presentationTimeOffset="%s" startNumber="%s">\n' % (self.timescale, self.presentationTimeOffset, self.startNumber)
-        xml += '        <SegmentTimeline>\n';
-        for s in self.segments:
-            xml += s.asXML()
-        xml += '        </SegmentTimeline>\n';
-        xml += '      </SegmentTemplate>\n'
+    def writeXML(self, out):
+        out.write('    <AdaptationSet mimeType="%s" codecs="%s">\n' % (self.mimeType, self.codec))
+        out.write('      <SegmentTemplate timescale="%d" media="$RepresentationID$_$Number$.dash" presentationTimeOffset="%s" startNumber="%s">\n' % (self.timescale, self.presentationTimeOffset, self.startNumber))
+        out.write('        <SegmentTimeline>\n')
+        self.writeTimeline(out)
+        out.write('        </SegmentTimeline>\n')
+        out.write('      </SegmentTemplate>\n')
         for r in self.representations:
-            xml += r.asXML()
-        xml += '    </AdaptationSet>\n'
-        return xml
+            r.writeXML(out)
+        out.write('    </AdaptationSet>\n')
+    def asXML(self):
+        return util.asXML(self)
 
 
@@ -32,6 +32,8 @@ class Base:
     def asXML(self):
         xml = '      <Representation id="%s" bandwidth="%s" />\n' % (self.id, self.bandwidth)
         return xml
+    def writeXML(self, out):
+        out.write(self.asXML())
     def __str__(self):
         return "(id=%s, bandwidth=%s)" % (self.id, self.bandwidth)
 
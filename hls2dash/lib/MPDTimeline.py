@@ -0,0 +1,77 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import array
+import StringIO
+
+# Common multiple of the video (90000) and audio (48000) timescales with
+# nanosecond precision. Tick counts are stored in an array of doubles as
+# they do not fit in a 32 bit long, these are exact up to 2^53
+TIMESCALE = 720000000
+
+# Segment timeline of a period, shared by all adaptation sets in the
+# period. Start time and durations are stored as integer ticks and are
+# rescaled to the timescale of the adaptation set when written. Segment
+# boundaries are rescaled from the accumulated start time so rounding
+# errors do not add up over the timeline
+class Timeline:
+    def __init__(self):
+        self.startTicks = 0
+        self.durations = array.array('d')
+        self.head = 0
+    def setStartTime(self, startTime):
+        self.startTicks = int(round(float(startTime) * TIMESCALE))
+    def getStartTime(self):
+        return float(self.startTicks) / TIMESCALE
+    def addSegment(self, duration):
+        self.durations.append(int(round(float(duration) * TIMESCALE)))
+    def removeFirstSegment(self):
+        # Returns the duration in seconds of the removed segment. The next
+        # segment starts where the removed one ended
+        ticks = int(self.durations[self.head])
+        self.head += 1
+        self.startTicks += ticks
+        if self.head >= 1024 and self.head * 2 >= len(self.durations):
+            del self.durations[:self.head]
+            self.head = 0
+        return float(ticks) / TIMESCALE
+    def getSegmentCount(self):
+        return len(self.durations) - self.head
+    def haveSegments(self):
+        return self.getSegmentCount() > 0
+    def writeXML(self, out, timescale):
+        # Consecutive segments with the same duration are written as one
+        # S element with a repeat count
+        position = self.startTicks
+        start = position * timescale // TIMESCALE
+        attrs = ' t="%d"' % start
+        last = None
+        repeat = 0
+        for i in xrange(self.head, len(self.durations)):
+            position += int(self.durations[i])
+            end = position * timescale // TIMESCALE
+            d = end - start
+            start = end
+            if d == last:
+                repeat += 1
+                continue
+            if last != None:
+                out.write(_S(attrs, last, repeat))
+                attrs = ''
+            last = d
+            repeat = 0
+        if last != None:
+            out.write(_S(attrs, last, repeat))
+    def asXML(self, timescale):
+        buf = StringIO.StringIO()
+        self.writeXML(buf, timescale)
+        return buf.getvalue()
+    def __str__(self):
+        return '(start=%f, segments=%d)' % (self.getStartTime(), self.getSegmentCount())
+
+def _S(attrs, d, repeat):
+    if repeat > 0:
+        return '          <S%s d="%d" r="%d" />\n' % (attrs, d, repeat)
+    return '          <S%s d="%d" />\n' % (attrs, d)
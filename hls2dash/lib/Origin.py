@@ -0,0 +1,294 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import heapq
+import threading
+import StringIO
+import BaseHTTPServer
+import SocketServer
+from hls2dash.lib import TS
+from hls2dash import debug
+from hls2dash import metrics
+
+SEGMENT_PATTERN = '^(audio|video)-(.+)_(\d+)\.dash$'
+
+# Runs a function once for all callers that ask for the same key at the
+# same time. Callers arriving while the function is running wait for and
+# share its result
+class Coalescer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+    def run(self, key, fn):
+        with self.lock:
+            job = self.inflight.get(key)
+            owner = job == None
+            if owner:
+                job = { 'done': threading.Event(), 'result': None, 'error': None }
+                self.inflight[key] = job
+        if owner:
+            try:
+                job['result'] = fn()
+            except Exception as e:
+                job['error'] = e
+            finally:
+                with self.lock:
+                    del self.inflight[key]
+                job['done'].set()
+        else:
+            metrics.count('coalesced_requests')
+            job['done'].wait()
+        if job['error'] != None:
+            raise job['error']
+        return job['result']
+
+# Bounded queue of segments to remux ahead of requests. The segment with
+# the highest number (closest to the live edge) is taken first and when
+# the queue is full the segment furthest from the live edge is dropped
+class PrefetchQueue:
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.heap = []
+        self.condition = threading.Condition()
+        self.closed = False
+    def put(self, number, item):
+        with self.condition:
+            entry = (-number, item)
+            if entry in self.heap:
+                return
+            if len(self.heap) >= self.maxsize:
+                worst = max(self.heap)
+                if entry >= worst:
+                    metrics.count('prefetch_dropped')
+                    return
+                self.heap.remove(worst)
+                heapq.heapify(self.heap)
+                metrics.count('prefetch_dropped')
+            heapq.heappush(self.heap, entry)
+            self.condition.notify()
+    def get(self):
+        # Returns None when the queue has been closed
+        with self.condition:
+            while len(self.heap) == 0 and not self.closed:
+                self.condition.wait(1.0)
+            if self.closed:
+                return None
+            return heapq.heappop(self.heap)[1]
+    def size(self):
+        with self.condition:
+            return len(self.heap)
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+# Origin for one live channel. Keeps the HLS state up to date in a
+# background thread and remuxes the TS segments to fragmented MP4 when
+# they are first requested. Requests are served from the manifest and
+# segment URIs published by the last refresh, so that they never wait
+# for a refresh that is loading playlists or probing segments
+class Origin:
+    def __init__(self, mpd, cachedir, engine='native'):
+        self.mpd = mpd
+        self.cachedir = cachedir
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.refreshLock = threading.Lock()
+        self.manifest = None
+        self.segmenturis = {}
+        self.coalescer = Coalescer()
+        self.loaded = False
+        self.stopped = threading.Event()
+        self.prefetchQueue = None
+        self.segmentCache = None
+    def setSegmentCache(self, cache):
+        self.segmentCache = cache
+    def refresh(self):
+        # The HLS state is only used by the refreshing thread
+        with self.refreshLock:
+            changed = self.mpd.refresh()
+            window = self.mpd.getWindowDuration()
+            newsegments = self.mpd.popNewSegments()
+            profiles = self.mpd.getProfiles()
+            if changed or self.manifest == None:
+                buf = StringIO.StringIO()
+                with metrics.timer('render'):
+                    self.mpd.writeXML(buf)
+                segmenturis = {}
+                for number in self.mpd.getSegmentNumbers():
+                    for profile in profiles:
+                        segmenturis[(profile, number)] = self.mpd.getSegmentURI(profile, number)
+                with self.lock:
+                    self.manifest = buf.getvalue()
+                    self.segmenturis = segmenturis
+                    self.loaded = True
+        if changed:
+            self.pruneCache(window + 60)
+        if self.prefetchQueue != None:
+            for number in newsegments:
+                for profile in profiles:
+                    self.prefetchQueue.put(number, (profile, number))
+        return changed
+    # Remux new segments for all profiles in a number of worker threads as
+    # soon as they appear in the playlist
+    def startPrefetch(self, workers, queuesize=64):
+        self.prefetchQueue = PrefetchQueue(queuesize)
+        for i in range(workers):
+            t = threading.Thread(target=self._prefetchWorker)
+            t.daemon = True
+            t.start()
+    def _prefetchWorker(self):
+        while True:
+            item = self.prefetchQueue.get()
+            if item == None:
+                return
+            (profile, number) = item
+            try:
+                if self.prefetch(profile, number):
+                    metrics.count('prefetched')
+            except Exception as e:
+                sys.stderr.write("Error: failed to prefetch %s_%s: %s\n" % (profile, number, e))
+    def prefetch(self, profile, number):
+        uri = self.getSegmentURI(profile, number)
+        if uri == None:
+            # Expired while waiting in the queue
+            return False
+        filename = '%s_%s.dash' % (profile, number)
+        if os.path.isfile(os.path.join(self.cachedir, 'video-' + filename)):
+            return False
+        self.coalescer.run(filename, lambda: self._remux(uri, filename))
+        return True
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                self.refresh()
+            except Exception as e:
+                metrics.count('errors')
+                sys.stderr.write("Error: failed to refresh %s: %s\n" % (self.mpd.playlistlocator, e))
+            if metrics.isEnabled():
+                metrics.emit(self.mpd.getName())
+            elapsed = time.time() - started
+            self.stopped.wait(max(0.0, self.mpd.getPollInterval() - elapsed))
+        self.mpd.close()
+    def stop(self):
+        self.stopped.set()
+        if self.prefetchQueue != None:
+            self.prefetchQueue.close()
+    def isLoaded(self):
+        return self.loaded
+    def getManifest(self):
+        with self.lock:
+            return self.manifest
+    def getSegmentURI(self, profile, number):
+        with self.lock:
+            return self.segmenturis.get((profile, int(number)))
+    # Path to the fragmented MP4 file for a segment request or None if the
+    # segment is not in the playlist window
+    def getSegment(self, name):
+        result = re.match(SEGMENT_PATTERN, name)
+        if not result:
+            return None
+        (kind, profile, number) = result.groups()
+        uri = self.getSegmentURI(profile, number)
+        if uri == None:
+            return None
+        filename = '%s_%s.dash' % (profile, number)
+        path = os.path.join(self.cachedir, '%s-%s' % (kind, filename))
+        if not os.path.isfile(path):
+            self.coalescer.run(filename, lambda: self._remux(uri, filename))
+        else:
+            metrics.count('segment_cache_hits')
+        return path
+    def _remux(self, uri, filename):
+        # Both tracks are written by one remux. They are written to a
+        # temporary directory and moved in place when complete, so a file
+        # in the cache directory is always complete
+        if os.path.isfile(os.path.join(self.cachedir, 'video-' + filename)):
+            return
+        debug.log("Remuxing %s to %s" % (uri, filename))
+        metrics.count('segment_remuxes')
+        if re.match('^http', uri):
+            ts = TS.Remote(uri)
+        else:
+            ts = TS.Local(uri)
+        ts.setCache(self.segmentCache)
+        tmpdir = tempfile.mkdtemp(dir=self.cachedir, prefix='.remux')
+        try:
+            with metrics.timer('remux'):
+                ts.remuxMP4(tmpdir, filename, self.engine)
+            for kind in [ 'audio', 'video' ]:
+                os.rename(os.path.join(tmpdir, '%s-%s' % (kind, filename)), os.path.join(self.cachedir, '%s-%s' % (kind, filename)))
+        finally:
+            shutil.rmtree(tmpdir, True)
+    def pruneCache(self, maxage):
+        now = time.time()
+        for name in os.listdir(self.cachedir):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.cachedir, name)
+            try:
+                if now - os.path.getmtime(path) > maxage:
+                    os.remove(path)
+            except OSError:
+                pass
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def do_GET(self):
+        origin = self.server.origin
+        name = self.path.split('?')[0].rsplit('/', 1)[-1]
+        try:
+            if name.endswith('.mpd'):
+                if not origin.isLoaded():
+                    return self.sendError(503, 'Manifest not available yet')
+                return self.sendData(200, origin.getManifest(), 'application/dash+xml', 'max-age=1')
+            path = origin.getSegment(name)
+            if path == None:
+                return self.sendError(404, 'Not found')
+            with open(path, 'rb') as f:
+                data = f.read()
+            contenttype = 'video/mp4' if name.startswith('video-') else 'audio/mp4'
+            return self.sendData(200, data, contenttype, 'max-age=3600')
+        except Exception as e:
+            sys.stderr.write("Error: failed to serve %s: %s\n" % (self.path, e))
+            return self.sendError(500, 'Internal error')
+    def sendData(self, status, data, contenttype, cachecontrol):
+        self.send_response(status)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', len(data))
+        self.send_header('Cache-Control', cachecontrol)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+    def sendError(self, status, message):
+        self.sendData(status, message + '\n', 'text/plain', 'no-cache')
+    def log_message(self, format, *args):
+        debug.log("%s - %s" % (self.address_string(), format % args))
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    def __init__(self, address, origin):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.origin = origin
+
+def serve(origin, port, host=''):
+    refresher = threading.Thread(target=origin.run)
+    refresher.daemon = True
+    refresher.start()
+    server = Server((host, port), origin)
+    debug.log("Serving on port %d" % server.server_port)
+    try:
+        server.serve_forever()
+    finally:
+        origin.stop()
+        server.server_close()
@@ -0,0 +1,113 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import os
+import time
+import shutil
+import fcntl
+import hashlib
+from hls2dash.lib import util
+from hls2dash import debug
+from hls2dash import metrics
+
+TRACKS = [ 'audio', 'video' ]
+
+# Disk cache of remuxed segments that can be shared by several processes.
+# An entry is the audio and video fragmented MP4 of a source segment and
+# is keyed on the source URI and the start time (tfdt) of the segment.
+# Files are written to a temporary file and renamed in place so a reader
+# never sees a partial file. Reading an entry updates its modification
+# time, and entries are evicted when older than maxage or, least
+# recently used first, when the cache grows beyond maxbytes
+class SegmentCache:
+    def __init__(self, cachedir, maxbytes=1024*1024*1024, maxage=3600):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                # Created by another process
+                if not os.path.isdir(cachedir):
+                    raise
+    def key(self, uri, starttime):
+        ticks = int(round(float(starttime) * 90000))
+        return hashlib.sha1('%s\n%d' % (uri, ticks)).hexdigest()
+    def _path(self, key, track):
+        return os.path.join(self.cachedir, '%s.%s' % (key, track))
+    # Copy the cached entry to the audio and video output files. Returns
+    # False if not in cache
+    def fetch(self, uri, starttime, outdir, filename):
+        key = self.key(uri, starttime)
+        try:
+            for track in TRACKS:
+                path = self._path(key, track)
+                if time.time() - os.path.getmtime(path) > self.maxage:
+                    metrics.count('remux_cache_misses')
+                    return False
+                os.utime(path, None)
+            for track in TRACKS:
+                _copyAtomic(self._path(key, track), os.path.join(outdir, '%s-%s' % (track, filename)))
+        except (IOError, OSError):
+            # Not in cache or evicted by another process while reading
+            metrics.count('remux_cache_misses')
+            return False
+        debug.log("Segment cache hit for %s (%s)" % (uri, key))
+        metrics.count('remux_cache_hits')
+        return True
+    # Add the audio and video output files of a remux to the cache
+    def store(self, uri, starttime, outdir, filename):
+        key = self.key(uri, starttime)
+        for track in TRACKS:
+            _copyAtomic(os.path.join(outdir, '%s-%s' % (track, filename)), self._path(key, track))
+        self.evict()
+    def evict(self):
+        # Only one process at a time evicts, others skip it
+        with open(os.path.join(self.cachedir, '.lock'), 'a') as lockfile:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return
+            try:
+                self._evict()
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+    def _evict(self):
+        now = time.time()
+        entries = {}
+        for name in os.listdir(self.cachedir):
+            if name.startswith('.'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cachedir, name))
+            except OSError:
+                continue
+            key = name.split('.')[0]
+            (mtime, size) = entries.get(key, (0, 0))
+            entries[key] = (max(mtime, st.st_mtime), size + st.st_size)
+        total = sum([ size for (mtime, size) in entries.values() ])
+        for (key, (mtime, size)) in sorted(entries.items(), key=lambda e: e[1][0]):
+            if now - mtime <= self.maxage and total <= self.maxbytes:
+                break
+            debug.log("Evicting %s from segment cache" % key)
+            metrics.count('remux_cache_evictions')
+            for track in TRACKS:
+                try:
+                    os.remove(self._path(key, track))
+                except OSError:
+                    pass
+            total -= size
+    def size(self):
+        total = 0
+        for name in os.listdir(self.cachedir):
+            if not name.startswith('.'):
+                total += os.path.getsize(os.path.join(self.cachedir, name))
+        return total
+
+def _copyAtomic(src, dst):
+    with util.openFileAtomic(dst) as f:
+        with open(src, 'rb') as s:
+            shutil.copyfileobj(s, f)
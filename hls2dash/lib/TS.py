@@ -3,25 +3,64 @@
 # license that can be found in the LICENSE file.
 # Author: Jonas Birme (Eyevinn Technology)
 
-
-import pycurl
-from ffprobe import FFProbe
 import tempfile
 import re
 import os
-from hls2dash.lib.TSRemux import tsremux
+from hls2dash.lib import TSParser
+from hls2dash.lib import HTTP
 from hls2dash import debug
+from hls2dash import metrics
+
+PROBE_CHUNK_SIZE = 348 * TSParser.PACKET_SIZE
+PROBE_RANGE_MAX = 32 * PROBE_CHUNK_SIZE
 
 class Base:
     def __init__(self):
         self.startTime = 0
+        self.videoStartTime = None
+        self.audioStartTime = None
         self.duration = 0
         self.streams = []
+        self.cache = None
+    def setCache(self, cache):
+        # SegmentCache for the remux output
+        self.cache = cache
     def parsedata(self, probedata):
         if len(probedata.streams) > 0:
             self.startTime = float(probedata.streams[0].start_time)
+    def parseprobe(self, probe):
+        self.streams = probe.getStreams()
+        self.videoStartTime = probe.getVideoStartTime()
+        self.audioStartTime = probe.getAudioStartTime()
+        if self.videoStartTime != None:
+            self.startTime = self.videoStartTime
+        elif self.audioStartTime != None:
+            self.startTime = self.audioStartTime
+    def probeFile(self, path):
+        # Scan the TS packets in-process and only fall back on ffprobe
+        # when no timestamp could be found
+        probe = TSParser.Probe()
+        with metrics.timer('file_probe'):
+            with open(path, 'rb') as f:
+                while not probe.isComplete():
+                    data = f.read(PROBE_CHUNK_SIZE)
+                    if not data:
+                        break
+                    probe.feed(data)
+        if probe.getStartTime() == None:
+            debug.log("No PTS found in %s, using ffprobe" % path)
+            metrics.count('ffprobe')
+            from ffprobe import FFProbe
+            with metrics.timer('ffprobe'):
+                self.parsedata(FFProbe(path))
+        else:
+            self.parseprobe(probe)
     def getStartTime(self):
         return self.startTime
+    def getVideoStartTime(self):
+        return self.videoStartTime
+    def getAudioStartTime(self):
+        return self.audioStartTime
     def cleanup(self):
         return
 
@@ -30,50 +69,117 @@ class Remote(Base):
     def __init__(self, uri):
         Base.__init__(self)
         self.uri = uri
+        self.data = None
         self.downloadedFile = None
-        self.tmpdir = '/tmp/'
-        self._initTempFile()
+        self.tmpdir = None
+        self.rangeProbe = True
+        res = re.match('.*/(.*?)(\?.*)?$', self.uri)
+        self.fname = res.group(1) if res else 'segment.ts'
+    def setRangeProbe(self, enabled):
+        self.rangeProbe = enabled
     def setTmpDir(self, tmpdir):
+        # Directory for the temporary copy of the segment that is only made
+        # when a tool needs a file. Defaults to the system temporary directory
         self.tmpdir = tmpdir
-        if not self.tmpdir.endswith('/'):
-            self.tmpdir += '/'
-        self._initTempFile()
-    def _initTempFile(self):
-        res = re.match('.*/(.*\.ts)$', self.uri)
-        self.fname = res.group(1)
-        self.fpath = self.tmpdir + self.fname
+    def fetch(self):
+        # Download the segment to memory
+        if self.data == None:
+            debug.log("Fetching %s" % self.uri)
+            with metrics.timer('segment_download'):
+                response = HTTP.getClient().get(self.uri)
+            if response.status >= 400:
+                raise Exception("Failed to fetch %s (HTTP %d)" % (self.uri, response.status))
+            self.data = response.body
+            metrics.count('segment_downloads')
+        return self.data
     def download(self):
+        # Write the segment to a temporary file with a unique name
         if self.downloadedFile == None:
-            debug.log("Downloading %s to %s" % (self.uri, self.fname))
-            self.downloadedFile = open(self.fpath, 'wb')
-            c = pycurl.Curl()
-            c.setopt(c.URL, self.uri)
-            c.setopt(c.WRITEDATA, self.downloadedFile)
-            c.perform()
-            c.close
-            self.downloadedFile.close()
+            (fd, path) = tempfile.mkstemp(dir=self.tmpdir, prefix='hls2dash-', suffix='-' + self.fname)
+            debug.log("Downloading %s to %s" % (self.uri, path))
+            self.downloadedFile = path
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.fetch())
+    def fetchRange(self, first, last):
+        response = HTTP.getClient().get(self.uri, (first, last))
+        if response.status >= 400 and response.status != 416:
+            raise Exception("Failed to fetch %s (HTTP %d)" % (self.uri, response.status))
+        return (response.status, response.body)
+    def probeRange(self):
+        # Fetch the head of the segment in memory, doubling the window
+        # until a PTS has been found for all streams
+        probe = TSParser.Probe()
+        offset = 0
+        size = PROBE_CHUNK_SIZE
+        while offset < PROBE_RANGE_MAX:
+            debug.log("Fetching bytes %d-%d of %s" % (offset, offset + size - 1, self.uri))
+            (status, data) = self.fetchRange(offset, offset + size - 1)
+            if status == 416:
+                break
+            if status != 206:
+                # Range not supported by server and we got the whole segment
+                self.data = data
+                probe.feed(data[offset:])
+                break
+            if probe.feed(data) or len(data) < size:
+                break
+            offset += size
+            size = min(size * 2, PROBE_RANGE_MAX - offset)
+        return probe
     def probe(self):
+        if self.data == None and self.rangeProbe:
+            with metrics.timer('range_probe'):
+                probe = self.probeRange()
+            if probe.getStartTime() != None:
+                self.parseprobe(probe)
+                return
+            debug.log("No PTS found in head of %s, fetching segment" % self.uri)
+        probe = TSParser.Probe()
+        probe.feed(self.fetch())
+        if probe.getStartTime() != None:
+            self.parseprobe(probe)
+            return
+        # ffprobe needs a file
         self.download()
-        self.parsedata(FFProbe(self.downloadedFile.name))
-    def remuxMP4(self, outdir, filename):
-        self.download()
+        self.probeFile(self.downloadedFile)
+    def remuxMP4(self, outdir, filename, engine='native'):
+        # Imported here as it is not needed to probe a segment
+        from hls2dash.lib import TSRemux
+        if self.cache == None:
+            self.fetch()
+        # With a cache the start time is found with a range request so a
+        # cached segment is not downloaded
         self.probe()
-        tsremux(self.downloadedFile.name, outdir, filename, self.getStartTime())
+        if self.cache != None and self.cache.fetch(self.uri, self.getStartTime(), outdir, filename):
+            self.cleanup()
+            return
+        TSRemux.tsremuxData(self.fetch(), outdir, filename, self.getStartTime(), engine)
+        if self.cache != None:
+            self.cache.store(self.uri, self.getStartTime(), outdir, filename)
         self.cleanup()
     def getFilename(self):
-        return self.downloadedFile.name
+        self.download()
+        return self.downloadedFile
     def cleanup(self):
-        os.remove(self.fpath)
+        if self.downloadedFile != None and os.path.isfile(self.downloadedFile):
+            os.remove(self.downloadedFile)
+        self.downloadedFile = None
 
 class Local(Base):
     def __init__(self, path):
         Base.__init__(self)
         self.path = path
     def probe(self):
-        self.parsedata(FFProbe(self.path))
-    def remuxMP4(self, outdir, filename):
+        self.probeFile(self.path)
+    def remuxMP4(self, outdir, filename, engine='native'):
+        # Imported here as it is not needed to probe a segment
+        from hls2dash.lib import TSRemux
         self.probe()
-        tsremux(self.path, outdir, filename, self.getStartTime())
+        if self.cache != None and self.cache.fetch(os.path.abspath(self.path), self.getStartTime(), outdir, filename):
+            return
+        TSRemux.tsremux(self.path, outdir, filename, self.getStartTime(), engine)
+        if self.cache != None:
+            self.cache.store(os.path.abspath(self.path), self.getStartTime(), outdir, filename)
     def getFilename(self):
         return self.path
 
@@ -0,0 +1,225 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+from hls2dash import debug
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PTS_CLOCK = 90000.0
+
+VIDEO_STREAM_TYPES = [ 0x01, 0x02, 0x10, 0x1B, 0x24 ]
+AUDIO_STREAM_TYPES = [ 0x03, 0x04, 0x0F, 0x11, 0x81 ]
+
+# PES stream ids that do not carry the optional PES header
+PES_NO_HEADER_STREAM_IDS = [ 0xBC, 0xBE, 0xBF, 0xF0, 0xF1, 0xF2, 0xF8, 0xFF ]
+
+def readTimestamp(b, offset):
+    return (((b[offset] >> 1) & 0x07) << 30 | b[offset+1] << 22 |
+            (b[offset+2] >> 1) << 15 | b[offset+3] << 7 | b[offset+4] >> 1)
+
+# Parse the PTS and DTS from the header of a PES packet. Returns a tuple
+# (pts, dts, headerlength) where pts and dts are None if not present
+def parsePESHeader(b):
+    if len(b) < 9 or b[0] != 0x00 or b[1] != 0x00 or b[2] != 0x01:
+        return (None, None, 0)
+    if b[3] in PES_NO_HEADER_STREAM_IDS:
+        return (None, None, 6)
+    flags = b[7] >> 6
+    headerlength = 9 + b[8]
+    pts = None
+    dts = None
+    if flags & 0x2 and len(b) >= 14:
+        pts = readTimestamp(b, 9)
+        dts = pts
+        if flags == 0x3 and len(b) >= 19:
+            dts = readTimestamp(b, 14)
+    return (pts, dts, headerlength)
+
+# An elementary stream declared in the PMT
+class Stream:
+    def __init__(self, pid, streamType):
+        self.pid = pid
+        self.streamType = streamType
+        self.pts = None
+        self.dts = None
+        self.kind = None
+        if streamType in VIDEO_STREAM_TYPES:
+            self.kind = 'video'
+        elif streamType in AUDIO_STREAM_TYPES:
+            self.kind = 'audio'
+    def isAudioVideo(self):
+        return self.kind != None
+    def getStartTime(self):
+        if self.pts == None:
+            return None
+        return self.pts / PTS_CLOCK
+    def __str__(self):
+        return "(pid=%d, type=0x%02x, kind=%s, pts=%s, dts=%s)" % (self.pid, self.streamType, self.kind, self.pts, self.dts)
+
+# MPEG2 TS packet parser (base class). Tracks PAT and PMT and hands
+# over the payload of the elementary streams to _onPayload()
+class Parser:
+    def __init__(self):
+        self.pmtpids = []
+        self.streams = {}
+        self.streamorder = []
+        self.havePMT = False
+        self.remainder = bytearray()
+        self.bytesParsed = 0
+    def feed(self, data):
+        buf = self.remainder + bytearray(data)
+        pos = 0
+        end = len(buf)
+        while pos + PACKET_SIZE <= end:
+            if buf[pos] != SYNC_BYTE:
+                # Lost sync, scan forward to the next sync byte
+                pos += 1
+                continue
+            self._parsePacket(buf, pos)
+            pos += PACKET_SIZE
+            if self.isComplete():
+                break
+        self.bytesParsed += pos
+        self.remainder = buf[pos:]
+        return self.isComplete()
+    def isComplete(self):
+        return False
+    def getStreams(self):
+        return [ self.streams[pid] for pid in self.streamorder ]
+    def _parsePacket(self, buf, pos):
+        pusi = (buf[pos+1] & 0x40) != 0
+        pid = ((buf[pos+1] & 0x1f) << 8) | buf[pos+2]
+        afc = (buf[pos+3] >> 4) & 0x3
+        start = pos + 4
+        if afc & 0x2:
+            start += 1 + buf[pos+4]
+        if not afc & 0x1 or start >= pos + PACKET_SIZE:
+            return
+        payload = buf[start:pos+PACKET_SIZE]
+        if pid == 0x0000:
+            if pusi:
+                self._parsePAT(payload)
+        elif pid in self.pmtpids:
+            if pusi:
+                self._parsePMT(payload)
+        elif pid in self.streams:
+            self._onPayload(self.streams[pid], pusi, payload)
+    def _section(self, payload):
+        pointer = payload[0]
+        section = payload[1+pointer:]
+        if len(section) < 3:
+            return None
+        sectionlength = ((section[1] & 0x0f) << 8) | section[2]
+        # PSI sections spanning several packets are not supported, these
+        # are only found with very large PMTs
+        return section[:3+sectionlength]
+    def _parsePAT(self, payload):
+        section = self._section(payload)
+        if section == None or section[0] != 0x00:
+            return
+        pos = 8
+        end = len(section) - 4
+        while pos + 4 <= end:
+            program = (section[pos] << 8) | section[pos+1]
+            pid = ((section[pos+2] & 0x1f) << 8) | section[pos+3]
+            if program != 0 and not pid in self.pmtpids:
+                self.pmtpids.append(pid)
+            pos += 4
+    def _parsePMT(self, payload):
+        section = self._section(payload)
+        if section == None or section[0] != 0x02 or len(section) < 12:
+            return
+        programinfolength = ((section[10] & 0x0f) << 8) | section[11]
+        pos = 12 + programinfolength
+        end = len(section) - 4
+        while pos + 5 <= end:
+            streamtype = section[pos]
+            pid = ((section[pos+1] & 0x1f) << 8) | section[pos+2]
+            esinfolength = ((section[pos+3] & 0x0f) << 8) | section[pos+4]
+            if not pid in self.streams:
+                self.streams[pid] = Stream(pid, streamtype)
+                self.streamorder.append(pid)
+            pos += 5 + esinfolength
+        self.havePMT = True
+    def _onPayload(self, stream, isStart, payload):
+        return
+
+# Obtain the first PTS and DTS of each audio and video stream. Stops
+# as soon as a timestamp for all streams in the PMT has been found
+class Probe(Parser):
+    def __init__(self):
+        Parser.__init__(self)
+        self.pending = {}
+    def isComplete(self):
+        if not self.havePMT:
+            return False
+        for s in self.getStreams():
+            if s.isAudioVideo() and s.pts == None:
+                return False
+        return True
+    def _onPayload(self, stream, isStart, payload):
+        if stream.pts != None:
+            return
+        if isStart:
+            self.pending[stream.pid] = payload
+        elif stream.pid in self.pending:
+            # The PES header is split over more than one packet
+            self.pending[stream.pid] += payload
+        else:
+            return
+        (pts, dts, headerlength) = parsePESHeader(self.pending[stream.pid])
+        if pts != None or len(self.pending[stream.pid]) >= 19:
+            stream.pts = pts
+            stream.dts = dts
+            del self.pending[stream.pid]
+            debug.log("First timestamp in stream %s" % stream)
+    def getStartTime(self, kind=None):
+        for s in self.getStreams():
+            if s.pts != None and (kind == None or s.kind == kind):
+                return s.getStartTime()
+        return None
+    def getVideoStartTime(self):
+        return self.getStartTime('video')
+    def getAudioStartTime(self):
+        return self.getStartTime('audio')
+
+# A complete PES packet without the PES header
+class PESPacket:
+    def __init__(self, pts, dts, data):
+        self.pts = pts
+        self.dts = dts
+        self.data = data
+
+# Collect the PES packets of all audio and video streams
+class Demuxer(Parser):
+    def __init__(self):
+        Parser.__init__(self)
+        self.packets = {}
+        self.current = {}
+    def _onPayload(self, stream, isStart, payload):
+        if not stream.isAudioVideo():
+            return
+        if isStart:
+            self._flushStream(stream)
+            self.current[stream.pid] = bytearray(payload)
+        elif stream.pid in self.current:
+            self.current[stream.pid] += payload
+    def _flushStream(self, stream):
+        data = self.current.pop(stream.pid, None)
+        if data == None:
+            return
+        (pts, dts, headerlength) = parsePESHeader(data)
+        if headerlength == 0:
+            return
+        if stream.pts == None:
+            stream.pts = pts
+            stream.dts = dts
+        self.packets.setdefault(stream.pid, []).append(PESPacket(pts, dts, data[headerlength:]))
+    def flush(self):
+        # The last PES packet of each stream is only complete at end of data
+        for stream in self.getStreams():
+            self._flushStream(stream)
+    def getPackets(self, stream):
+        return self.packets.get(stream.pid, [])
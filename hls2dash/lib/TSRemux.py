@@ -3,31 +3,140 @@
 # license that can be found in the LICENSE file.
 # Author: Jonas Birme (Eyevinn Technology)
 
+import io
 import tempfile
 import shlex
 import os
 import subprocess
+from hls2dash.lib import TSParser
+from hls2dash.lib import ElementaryStream
+from hls2dash.lib import MP4
+from hls2dash.lib import util
+from hls2dash import ENGINES
 from hls2dash import debug
+from hls2dash import metrics
 
-def tsremux(tsfile, outdir, filename, starttime):
+READ_CHUNK_SIZE = 1024 * TSParser.PACKET_SIZE
+
+FRAGMENT_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof+frag_discont'
+
+def tsremux(tsfile, outdir, filename, starttime, engine='native'):
     audiofile = '%s/audio-%s' % (outdir, filename)
     videofile = '%s/video-%s' % (outdir, filename)
-    debug.log("Remuxing %s to %s and %s" % (tsfile, audiofile, videofile))
-    tmpaudio = tempfile.NamedTemporaryFile(dir='/tmp/', suffix='.mp4')
-    tmpvideo = tempfile.NamedTemporaryFile(dir='/tmp/', suffix='.mp4')
+    debug.log("Remuxing %s to %s and %s (engine=%s)" % (tsfile, audiofile, videofile, engine))
+    if engine == 'native':
+        try:
+            with metrics.timer('remux_native'):
+                with open(tsfile, 'rb') as f:
+                    (audio, video) = remuxfMP4(f, starttime)
+            writeTracks(audio, video, audiofile, videofile)
+            return
+        except Exception as e:
+            debug.log("Native remux failed (%s), falling back on ffmpeg and mp4fragment" % e)
+    elif engine == 'ffmpeg':
+        FFMpegSplit(tsfile, audiofile, videofile, starttime)
+        return
+    tmpaudio = tempfile.NamedTemporaryFile(suffix='.mp4')
+    tmpvideo = tempfile.NamedTemporaryFile(suffix='.mp4')
     FFMpegCommand(tsfile, tmpaudio.name, '-y -bsf:a aac_adtstoasc -acodec copy -vn')
     FFMpegCommand(tsfile, tmpvideo.name, '-y -vcodec copy -an')
     Mp4Fragment(tmpaudio.name, audiofile, starttime)
     Mp4Fragment(tmpvideo.name, videofile, starttime)
 
-def runcmd(cmd, name):
+# Remux a TS segment that is held in memory. The native engine demuxes
+# from the buffer and ffmpeg reads it from a pipe, so no copy of the
+# segment is written to disk. Only the mp4fragment path, that needs
+# seekable intermediate files, goes through the temporary directory
+def tsremuxData(data, outdir, filename, starttime, engine='native'):
+    audiofile = '%s/audio-%s' % (outdir, filename)
+    videofile = '%s/video-%s' % (outdir, filename)
+    debug.log("Remuxing %d bytes to %s and %s (engine=%s)" % (len(data), audiofile, videofile, engine))
+    if engine == 'native':
+        try:
+            with metrics.timer('remux_native'):
+                (audio, video) = remuxfMP4(io.BytesIO(data), starttime)
+            writeTracks(audio, video, audiofile, videofile)
+            return
+        except Exception as e:
+            debug.log("Native remux failed (%s), falling back on ffmpeg and mp4fragment" % e)
+    elif engine == 'ffmpeg':
+        FFMpegSplit('pipe:0', audiofile, videofile, starttime, data)
+        return
+    tmpts = tempfile.NamedTemporaryFile(suffix='.ts')
+    try:
+        tmpts.write(data)
+        tmpts.flush()
+        tsremux(tmpts.name, outdir, filename, starttime, 'mp4fragment')
+    finally:
+        tmpts.close()
+
+# A track file is only in place when it is complete
+def writeTracks(audio, video, audiofile, videofile):
+    util.writeFileAtomic(audiofile, audio)
+    util.writeFileAtomic(videofile, video)
+
+# Demux the TS in file object f and return a tuple (audio, video) with
+# the data of a fragmented MP4 for each track, where the first sample
+# of each track is presented at starttime
+def remuxfMP4(f, starttime):
+    demuxer = TSParser.Demuxer()
+    while True:
+        data = f.read(READ_CHUNK_SIZE)
+        if not data:
+            break
+        demuxer.feed(data)
+    demuxer.flush()
+    video = None
+    audio = None
+    for stream in demuxer.getStreams():
+        if stream.kind == 'video' and video == None:
+            if stream.streamType != 0x1B:
+                raise Exception("Unsupported video stream type 0x%02x" % stream.streamType)
+            video = ElementaryStream.H264()
+            es = video
+        elif stream.kind == 'audio' and audio == None:
+            if stream.streamType != 0x0F:
+                raise Exception("Unsupported audio stream type 0x%02x" % stream.streamType)
+            audio = ElementaryStream.AAC()
+            es = audio
+        else:
+            continue
+        for pes in demuxer.getPackets(stream):
+            es.addPES(pes)
+        es.finish()
+    if video == None or audio == None or not video.haveSamples() or not audio.haveSamples():
+        raise Exception("Did not find both an audio and a video stream")
+
+    info = video.getInfo()
+    videotrack = MP4.Track(b'vide', video.getTimescale(), MP4.avc1(info['width'], info['height'], video.sps, video.pps), info['width'], info['height'])
+    # Decode time is set so that the first frame is presented at starttime
+    videostart = int(round(starttime * video.getTimescale())) - video.getDecodeDelay()
+    videodata = MP4.initSegment(videotrack) + MP4.fragment(videotrack, video.getSamples(), max(0, videostart))
+
+    audiotrack = MP4.Track(b'soun', audio.getTimescale(), MP4.mp4a(audio.getTimescale(), audio.getChannels(), audio.getAudioSpecificConfig()))
+    audiostart = int(round(starttime * audio.getTimescale()))
+    audiodata = MP4.initSegment(audiotrack) + MP4.fragment(audiotrack, audio.getSamples(), max(0, audiostart))
+    return (audiodata, videodata)
+
+# Run a command, with stdin (if any) written to the standard input of
+# the process
+def runcmd(cmd, name, stdin=None):
     debug.log('COMMAND: %s' % cmd)
+    metrics.count('subprocesses')
     try:
         FNULL = open(os.devnull, 'w')
-        if debug.doDebug:
-            return subprocess.call(cmd)
-        else:
-            return subprocess.call(cmd, stdout=FNULL, stderr=subprocess.STDOUT)
+        with metrics.timer('subprocess_' + name):
+            if stdin != None:
+                if debug.doDebug:
+                    p = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+                else:
+                    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=FNULL, stderr=subprocess.STDOUT)
+                p.communicate(stdin)
+                return p.returncode
+            if debug.doDebug:
+                return subprocess.call(cmd)
+            else:
+                return subprocess.call(cmd, stdout=FNULL, stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError as e:
         message = "binary tool failed with error %d" % e.returncode
         raise Exception(message)
@@ -43,6 +152,34 @@ def FFMpegCommand(infile, outfile, opts):
     cmd.append(outfile)
     runcmd(cmd, 'ffmpeg')
 
+# Read the TS once and write a fragmented MP4 for each of the audio and
+# the video track in the same ffmpeg process. The source timestamps are
+# kept and shifted so that each track starts at starttime, which
+# corresponds to --tfdt-start in Mp4Fragment. If data is given the TS is
+# passed to ffmpeg on stdin and infile should be 'pipe:0'
+def FFMpegSplit(infile, audiofile, videofile, starttime, data=None):
+    probe = TSParser.Probe()
+    if data != None:
+        probe.feed(data)
+    else:
+        with open(infile, 'rb') as f:
+            while not probe.isComplete():
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                probe.feed(chunk)
+    audiooffset = starttime - (probe.getAudioStartTime() or starttime)
+    videooffset = starttime - (probe.getVideoStartTime() or starttime)
+    cmd = [os.path.basename('ffmpeg'), '-y', '-copyts', '-i', infile]
+    cmd += shlex.split('-map 0:a:0 -acodec copy -bsf:a aac_adtstoasc -movflags %s -output_ts_offset %f -f mp4' % (FRAGMENT_MOVFLAGS, audiooffset))
+    cmd.append(audiofile)
+    cmd += shlex.split('-map 0:v:0 -vcodec copy -movflags %s -output_ts_offset %f -f mp4' % (FRAGMENT_MOVFLAGS, videooffset))
+    cmd.append(videofile)
+    if data != None:
+        runcmd(cmd, 'ffmpeg', data)
+    else:
+        runcmd(cmd, 'ffmpeg')
+
 def Mp4Fragment(infile, outfile, starttime):
     cmd = [os.path.basename('mp4fragment')]
     opts = '--tfdt-start %f' % starttime
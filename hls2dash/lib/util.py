@@ -3,6 +3,12 @@
 # license that can be found in the LICENSE file.
 # Author: Jonas Birme (Eyevinn Technology)
 
+import os
+import fcntl
+import calendar
+import tempfile
+import contextlib
+import StringIO
 
 class PT:
     def __init__(self, seconds):
@@ -15,3 +21,64 @@ def NUM(s):
         return int(s)
     except ValueError:
         return float(s)
+
+# Seconds since the epoch for a datetime, which is in UTC if it is naive
+def epoch(dt):
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1000000.0
+
+# Serialize an object with a writeXML(out) method to a string
+def asXML(obj):
+    buf = StringIO.StringIO()
+    obj.writeXML(buf)
+    return buf.getvalue()
+
+# File object whose content replaces the file at path when the block
+# completes. Readers never see a partially written file
+@contextlib.contextmanager
+def openFileAtomic(path):
+    dirname = os.path.dirname(os.path.abspath(path))
+    (fd, tmppath) = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.chmod(tmppath, 0o644)
+        os.rename(tmppath, path)
+    except:
+        os.remove(tmppath)
+        raise
+
+def writeFileAtomic(path, data):
+    with openFileAtomic(path) as f:
+        f.write(data)
+
+# Replace the file at path with data unless the file has the same content
+# when both are passed through normalize. Returns True if it was replaced
+def writeFileIfChanged(path, data, normalize=lambda x: x):
+    try:
+        with open(path, 'rb') as f:
+            if normalize(f.read()) == normalize(data):
+                return False
+    except IOError:
+        pass
+    writeFileAtomic(path, data)
+    return True
+
+# Exclusive lock on path for the duration of the block, across processes
+# and threads. The lock file is removed on release, so a waiter that got
+# the lock on a file that was removed meanwhile opens the path again
+@contextlib.contextmanager
+def lockFile(path):
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                break
+        except OSError:
+            pass
+        os.close(fd)
+    try:
+        yield
+    finally:
+        os.remove(path)
+        os.close(fd)
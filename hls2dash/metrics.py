@@ -0,0 +1,118 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import sys
+import time
+import json
+import threading
+import contextlib
+from hls2dash.lib import util
+
+# Timers and counters for the phases of a run. Timers count the number of
+# calls and the total time spent. Values are cumulative for the lifetime of
+# the process, emit() writes what has changed since the previous emit as a
+# JSON line and/or the cumulative values as a Prometheus textfile
+global jsonPath
+jsonPath = None
+global prometheusPath
+prometheusPath = None
+
+PREFIX = 'hls2dash'
+
+lock = threading.Lock()
+counters = {}
+timers = {}
+lastEmitted = ({}, {})
+
+def count(name, value=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + value
+
+def addTime(name, seconds):
+    with lock:
+        (calls, total) = timers.get(name, (0, 0.0))
+        timers[name] = (calls + 1, total + seconds)
+
+@contextlib.contextmanager
+def timer(name):
+    started = time.time()
+    try:
+        yield
+    finally:
+        addTime(name, time.time() - started)
+
+def getCounter(name):
+    with lock:
+        return counters.get(name, 0)
+
+def getTimer(name):
+    with lock:
+        return timers.get(name, (0, 0.0))
+
+def reset():
+    global lastEmitted
+    with lock:
+        counters.clear()
+        timers.clear()
+        lastEmitted = ({}, {})
+
+def isEnabled():
+    return jsonPath != None or prometheusPath != None
+
+def asJSON(label=None):
+    # Values changed since the previous call
+    global lastEmitted
+    with lock:
+        (lastcounters, lasttimers) = lastEmitted
+        record = { 'time': time.time(), 'counters': {}, 'timers': {} }
+        if label != None:
+            record['channel'] = label
+        for (name, value) in counters.items():
+            if value != lastcounters.get(name, 0):
+                record['counters'][name] = value - lastcounters.get(name, 0)
+        for (name, (calls, total)) in timers.items():
+            (lastcalls, lasttotal) = lasttimers.get(name, (0, 0.0))
+            if calls != lastcalls:
+                record['timers'][name] = { 'count': calls - lastcalls, 'seconds': round(total - lasttotal, 6) }
+        lastEmitted = (dict(counters), dict(timers))
+    return json.dumps(record, sort_keys=True)
+
+def asPrometheus(labels=None):
+    labelstr = ''
+    if labels:
+        labelstr = ','.join([ '%s="%s"' % (k, v) for (k, v) in sorted(labels.items()) ])
+    def series(name, extra=''):
+        l = ','.join([ x for x in [ labelstr, extra ] if x ])
+        if l:
+            return '%s_%s{%s}' % (PREFIX, name, l)
+        return '%s_%s' % (PREFIX, name)
+    with lock:
+        lines = []
+        for name in sorted(counters.keys()):
+            lines.append('# TYPE %s_%s_total counter' % (PREFIX, name))
+            lines.append('%s %s' % (series(name + '_total'), counters[name]))
+        if len(timers) > 0:
+            lines.append('# TYPE %s_phase_seconds_total counter' % PREFIX)
+            for name in sorted(timers.keys()):
+                lines.append('%s %f' % (series('phase_seconds_total', 'phase="%s"' % name), timers[name][1]))
+            lines.append('# TYPE %s_phase_calls_total counter' % PREFIX)
+            for name in sorted(timers.keys()):
+                lines.append('%s %d' % (series('phase_calls_total', 'phase="%s"' % name), timers[name][0]))
+        lines.append('# TYPE %s_last_run_timestamp_seconds gauge' % PREFIX)
+        lines.append('%s %f' % (series('last_run_timestamp_seconds'), time.time()))
+    return '\n'.join(lines) + '\n'
+
+def emit(label=None):
+    if jsonPath == '-':
+        sys.stderr.write(asJSON(label) + '\n')
+    elif jsonPath != None:
+        with open(jsonPath, 'a') as f:
+            f.write(asJSON(label) + '\n')
+    if prometheusPath != None:
+        # The textfile collector must never see a partially written file
+        labels = None
+        if label != None:
+            labels = { 'channel': label }
+        util.writeFileAtomic(prometheusPath, asPrometheus(labels))
@@ -0,0 +1,168 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+import argparse
+import json
+import sys
+import time
+import signal
+import threading
+import multiprocessing
+from hls2dash.lib import MPD
+from hls2dash.lib import HTTP
+from hls2dash.lib import Channel
+from hls2dash.lib import ContextStore
+from hls2dash import debug
+from hls2dash.version import __version__
+
+DEFAULTS = {
+    'workers': multiprocessing.cpu_count(),
+    'probes': 4,
+    'connections': 16,
+    'ctxdir': '/tmp/',
+    'ctxdb': None,
+    'timing': 'probe',
+    'timingverify': 10
+}
+
+# Read and validate the packager configuration file:
+#
+# {
+#   "workers": 4,
+#   "probes": 4,
+#   "connections": 16,
+#   "ctxdir": "/var/lib/hls2dash/",
+#   "ctxdb": "/var/lib/hls2dash/context.db",
+#   "timing": "extinf",
+#   "channels": [
+#     { "playlist": "http://example.com/chan1/master.m3u8", "output": "/var/www/chan1/stream.mpd", "multi": true },
+#     { "playlist": "http://example.com/chan2/master.m3u8", "output": "/var/www/chan2/stream.mpd", "ctx": "chan2" }
+#   ]
+# }
+def loadConfig(path):
+    with open(path, 'r') as f:
+        config = json.load(f)
+    for (key, value) in DEFAULTS.items():
+        config.setdefault(key, value)
+    if not isinstance(config.get('channels'), list) or len(config['channels']) == 0:
+        raise Exception("No channels defined in %s" % path)
+    outputs = []
+    for ch in config['channels']:
+        for key in [ 'playlist', 'output' ]:
+            if not key in ch:
+                raise Exception("Channel without %s in %s" % (key, path))
+        if ch['output'] in outputs:
+            raise Exception("More than one channel writes to %s" % ch['output'])
+        outputs.append(ch['output'])
+        ch.setdefault('multi', False)
+        ch.setdefault('ctx', None)
+        ch.setdefault('ctxdir', config['ctxdir'])
+        ch.setdefault('ctxdb', config['ctxdb'])
+        ch.setdefault('timing', config['timing'])
+        ch.setdefault('timingverify', config['timingverify'])
+        if not ch['timing'] in MPD.TIMINGS:
+            raise Exception("Unknown timing %s for channel %s" % (ch['timing'], ch['output']))
+        ch.setdefault('verifyvariants', False)
+    return config
+
+# Spread the channels over the worker processes
+def assignChannels(channels, workers):
+    workers = max(1, min(workers, len(channels)))
+    assigned = [ [] for i in range(workers) ]
+    for (idx, ch) in enumerate(channels):
+        assigned[idx % workers].append(ch)
+    return assigned
+
+def createChannel(ch, probeLimiter, version='UNDEF', ctxstores=None):
+    # Channels with the same context database share one store
+    if ctxstores == None:
+        ctxstores = {}
+    key = (ch['ctxdir'], ch['ctxdb'])
+    if not key in ctxstores:
+        ctxstores[key] = ContextStore.create(ch['ctxdir'], ch['ctxdb'])
+    mpd = MPD.HLS(ch['playlist'], ch['multi'], ch['ctxdir'], ch['ctx'], ctxstores[key])
+    mpd.setVersion(version)
+    mpd.setVerifyVariants(ch['verifyvariants'])
+    mpd.setTiming(ch['timing'], ch['timingverify'])
+    mpd.setProbeLimiter(probeLimiter)
+    return Channel.Channel(mpd, ch['output'])
+
+# Worker process. Every channel is refreshed in its own thread so that a
+# slow channel does not delay the others. The HTTP connections and the
+# probe slots are shared by all channels in the process
+def runWorker(channels, config, version, doDebug):
+    debug.doDebug = doDebug
+    HTTP.client = HTTP.Client(maxhandles=config['connections'])
+    probeLimiter = threading.BoundedSemaphore(config['probes'])
+    stopped = threading.Event()
+    def stop(signum, frame):
+        stopped.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    ctxstores = {}
+    running = []
+    for ch in channels:
+        try:
+            channel = createChannel(ch, probeLimiter, version, ctxstores)
+        except Exception as e:
+            sys.stderr.write("Error: failed to create channel %s: %s\n" % (ch['playlist'], e))
+            continue
+        t = threading.Thread(target=channel.run, name=ch['output'])
+        t.daemon = True
+        t.start()
+        running.append((channel, t))
+        debug.log("Started channel %s -> %s" % (ch['playlist'], ch['output']))
+    while not stopped.is_set():
+        stopped.wait(1.0)
+    for (channel, t) in running:
+        channel.stop()
+    for (channel, t) in running:
+        t.join(10.0)
+
+def main():
+    version = __version__
+    parser = argparse.ArgumentParser(
+        description="Repackage many live HLS channels to MPEG DASH in one process group.\n\n"
+                    "The channels are listed in a JSON configuration file and are spread\n"
+                    "over a number of worker processes. Within a worker process every\n"
+                    "channel is refreshed in its own thread."
+        ,formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('config', metavar='CONFIG', help='Path to JSON configuration file')
+    parser.add_argument('--workers', dest='workers', type=int, default=None, help='Number of worker processes. Overrides the configuration file')
+    parser.add_argument('--debug', dest='debug', action='store_true', default=False, help='Write debug info to stderr')
+    parser.add_argument('--version', action='version', version='%(prog)s ('+version+')')
+    args = parser.parse_args()
+    debug.doDebug = args.debug
+
+    try:
+        config = loadConfig(args.config)
+    except Exception as e:
+        parser.error(str(e))
+    if args.workers != None:
+        config['workers'] = args.workers
+
+    assigned = assignChannels(config['channels'], config['workers'])
+    def startWorker(channels):
+        p = multiprocessing.Process(target=runWorker, args=(channels, config, version, args.debug))
+        p.start()
+        return p
+    workers = [ startWorker(channels) for channels in assigned ]
+    debug.log("Started %d workers for %d channels" % (len(workers), len(config['channels'])))
+
+    stopped = threading.Event()
+    def stop(signum, frame):
+        stopped.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopped.is_set():
+        stopped.wait(1.0)
+        for (idx, p) in enumerate(workers):
+            if not p.is_alive() and not stopped.is_set():
+                sys.stderr.write("Warning: worker %d exited with %s, restarting\n" % (idx, p.exitcode))
+                workers[idx] = startWorker(assigned[idx])
+    for p in workers:
+        p.terminate()
+    for p in workers:
+        p.join()
@@ -4,27 +4,148 @@
 # Author: Jonas Birme (Eyevinn Technology)
 
 import argparse
-import pkg_resources
 import re
+import os
+import sys
+import glob
+import time
+import multiprocessing
 from hls2dash import debug
+from hls2dash import metrics
+from hls2dash.version import __version__
 from hls2dash.lib import TS
+from hls2dash.lib import TSRemux
+from hls2dash.lib import HTTP
+from hls2dash.lib import SegmentCache
 
 def main():
-    version = pkg_resources.require('hls2dash')[0].version
+    version = __version__
     parser = argparse.ArgumentParser(
         description="Rewrap a MPEG2 TS segment to a fragmented MP4"
         ,formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('tsfile', metavar='TSFILE', help='Path to TS file. Can be a URI or local file.')
     parser.add_argument('output', metavar='OUTPUT', help='Output file name')
     parser.add_argument('--outdir', dest='outdir', default='.', help='Directory where the fragmented MP4 will be stored. Default is current directory')
+    parser.add_argument('--engine', dest='engine', choices=TSRemux.ENGINES, default='native', help='Remux in-process (native), with a single ffmpeg pass (ffmpeg) or with ffmpeg and mp4fragment. Default is native')
+    parser.add_argument('--segment-cache', dest='segmentcache', default=None, metavar='DIR', help='Cache remuxed segments in this directory, can be shared by several processes')
+    parser.add_argument('--segment-cache-size', dest='segmentcachesize', type=int, default=1024, metavar='MB', help='Maximum size of the segment cache. Default is 1024 MB')
+    parser.add_argument('--segment-cache-age', dest='segmentcacheage', type=int, default=3600, metavar='SECONDS', help='Maximum age of a segment in the segment cache. Default is 3600 seconds')
+    parser.add_argument('--metrics-json', dest='metricsjson', default=None, help='Append timings and counters as a JSON line to this file (- for stderr)')
+    parser.add_argument('--metrics-prom', dest='metricsprom', default=None, help='Write timings and counters to this Prometheus textfile collector file')
     parser.add_argument('--debug', dest='debug', action='store_true', default=False, help='Write debug info to stderr')
     parser.add_argument('--version', action='version', version='%(prog)s ('+version+')')
     args = parser.parse_args()
     debug.doDebug = args.debug
+    metrics.jsonPath = args.metricsjson
+    metrics.prometheusPath = args.metricsprom
 
     ts = None
     if re.match('^http', args.tsfile):
         ts = TS.Remote(args.tsfile)
     else:
         ts = TS.Local(args.tsfile)
-    ts.remuxMP4(args.outdir, args.output)
+    ts.setCache(createSegmentCache(args))
+    with metrics.timer('remux'):
+        ts.remuxMP4(args.outdir, args.output, args.engine)
+    if metrics.isEnabled():
+        metrics.emit(args.output)
+
+# Output file name for a segment, master2500_19274.ts -> 2500_19274.dash
+def outputFromFilename(tsfile, pattern='^\D+(\d+.*)\.ts$'):
+    basename = os.path.basename(tsfile)
+    result = re.match(pattern, basename)
+    if result:
+        return result.group(1) + '.dash'
+    return os.path.splitext(basename)[0] + '.dash'
+
+# List the TS files of a media playlist, a glob pattern or a list file
+def listSegments(source):
+    if re.match('^.*\.m3u8$', source):
+        playlist = HTTP.getPlaylist(source)
+        segments = []
+        for seg in playlist.segments:
+            if re.match('^http', seg.uri):
+                segments.append(seg.uri)
+            else:
+                segments.append(seg.base_uri + seg.uri)
+        return segments
+    if re.search('[*?[]', source):
+        return sorted(glob.glob(source))
+    with open(source, 'r') as f:
+        return [ l.strip() for l in f if l.strip() and not l.startswith('#') ]
+
+def createSegmentCache(args):
+    if args.segmentcache == None:
+        return None
+    return SegmentCache.SegmentCache(args.segmentcache, args.segmentcachesize * 1024 * 1024, args.segmentcacheage)
+
+def remuxItem(item):
+    (tsfile, outdir, output, engine, cache) = item
+    audiofile = '%s/audio-%s' % (outdir, output)
+    videofile = '%s/video-%s' % (outdir, output)
+    if os.path.isfile(audiofile) and os.path.isfile(videofile):
+        return (tsfile, 'SKIP', None, 0)
+    try:
+        if re.match('^http', tsfile):
+            ts = TS.Remote(tsfile)
+        else:
+            ts = TS.Local(tsfile)
+        ts.setCache(cache)
+        ts.remuxMP4(outdir, output, engine)
+        return (tsfile, 'OK', None, os.path.getsize(audiofile) + os.path.getsize(videofile))
+    except Exception as e:
+        return (tsfile, 'FAIL', str(e), 0)
+
+def batch():
+    version = __version__
+    parser = argparse.ArgumentParser(
+        description="Rewrap many MPEG2 TS segments to fragmented MP4 in parallel.\n\n"
+                    "SOURCE is a media playlist (URI or local file), a glob pattern\n"
+                    "or a file with one TS file or URI per line. The output names are\n"
+                    "derived from the segment names, master2500_19274.ts -> 2500_19274.dash"
+        ,formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('source', metavar='SOURCE', help='Media playlist, glob pattern or list file')
+    parser.add_argument('--outdir', dest='outdir', default='.', help='Directory where the fragmented MP4 will be stored. Default is current directory')
+    parser.add_argument('--workers', dest='workers', type=int, default=multiprocessing.cpu_count(), help='Number of worker processes. Default is number of CPUs')
+    parser.add_argument('--engine', dest='engine', choices=TSRemux.ENGINES, default='native', help='Remux engine to use. Default is native')
+    parser.add_argument('--force', dest='force', action='store_true', default=False, help='Remux also when the output files already exist')
+    parser.add_argument('--segment-cache', dest='segmentcache', default=None, metavar='DIR', help='Cache remuxed segments in this directory, can be shared by several processes')
+    parser.add_argument('--segment-cache-size', dest='segmentcachesize', type=int, default=1024, metavar='MB', help='Maximum size of the segment cache. Default is 1024 MB')
+    parser.add_argument('--segment-cache-age', dest='segmentcacheage', type=int, default=3600, metavar='SECONDS', help='Maximum age of a segment in the segment cache. Default is 3600 seconds')
+    parser.add_argument('--debug', dest='debug', action='store_true', default=False, help='Write debug info to stderr')
+    parser.add_argument('--version', action='version', version='%(prog)s ('+version+')')
+    args = parser.parse_args()
+    debug.doDebug = args.debug
+
+    segments = listSegments(args.source)
+    cache = createSegmentCache(args)
+    items = []
+    for tsfile in segments:
+        output = outputFromFilename(tsfile)
+        if args.force:
+            for prefix in [ 'audio', 'video' ]:
+                path = '%s/%s-%s' % (args.outdir, prefix, output)
+                if os.path.isfile(path):
+                    os.remove(path)
+        items.append((tsfile, args.outdir, output, args.engine, cache))
+
+    started = time.time()
+    counts = { 'OK': 0, 'SKIP': 0, 'FAIL': 0 }
+    totalbytes = 0
+    pool = multiprocessing.Pool(max(1, args.workers))
+    try:
+        for (tsfile, status, error, size) in pool.imap_unordered(remuxItem, items):
+            counts[status] += 1
+            totalbytes += size
+            if error:
+                sys.stderr.write("%s %s: %s\n" % (status, tsfile, error))
+            else:
+                debug.log("%s %s" % (status, tsfile))
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = max(time.time() - started, 0.001)
+    print("%d remuxed, %d skipped, %d failed in %.1fs (%.1f segments/s, %.1f MB/s)" %
+          (counts['OK'], counts['SKIP'], counts['FAIL'], elapsed, counts['OK'] / elapsed, totalbytes / elapsed / 1000000.0))
+    if counts['FAIL'] > 0:
+        sys.exit(1)
@@ -0,0 +1,8 @@
+# Copyright 2016 Eyevinn Technology. All rights reserved
+# Use of this source code is governed by a MIT License
+# license that can be found in the LICENSE file.
+# Author: Jonas Birme (Eyevinn Technology)
+
+# Read by setup.py and by the command line tools, which would otherwise
+# have to look the version up with pkg_resources on every start
+__version__ = '0.2.2'
@@ -14,9 +14,13 @@ if exists("README.md"):
 
 install_reqs = [req for req in open(abspath(join(dirname(__file__), 'requirements.txt')))]
 
+# The version is kept in hls2dash/version.py, read without importing the package
+version = {}
+exec(open(abspath(join(dirname(__file__), 'hls2dash', 'version.py'))).read(), version)
+
 setup(
     name = "hls2dash",
-    version = "0.2.2",
+    version = version['__version__'],
     author = "Jonas Birme",
     author_email = "jonas.birme@eyevinn.se",
     description = "Command line tools for HLS to MPEG DASH repackaging",
@@ -24,11 +28,13 @@ setup(
     license = "MIT",
     install_requires=install_reqs,
     url = "https://github.com/Eyevinn/hls-to-dash",
-    packages = ['hls2dash', 'hls2dash/lib', 'hls2dash/tsremux'],
+    packages = ['hls2dash', 'hls2dash/lib', 'hls2dash/tsremux', 'hls2dash/packager'],
     entry_points = {
         'console_scripts': [
             'hls-to-dash=hls2dash:main',
-            'ts-to-fmp4=hls2dash.tsremux:main'
+            'ts-to-fmp4=hls2dash.tsremux:main',
+            'ts-to-fmp4-batch=hls2dash.tsremux:batch',
+            'hls-to-dash-packager=hls2dash.packager:main'
         ]
     }
 )
@@ -0,0 +1,77 @@
+import pytest
+import os
+from hls2dash.lib import MPD
+from hls2dash.lib import HTTP
+from hls2dash.lib import Channel
+from hls2dash import metrics
+from tsutil import segment
+
+MASTER = '''#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"
+master2500.m3u8
+'''
+
+def mediaPlaylist(first, count):
+    lines = [ '#EXTM3U', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:%d' % first ]
+    for n in range(first, first + count):
+        lines += [ '#EXTINF:6.000,', 'master2500_%d.ts' % n ]
+    return '\n'.join(lines)
+
+# Channel whose playlists are served by a stub of HTTP.fetchPlaylist from
+# the dict that is returned, segments are read from disk
+@pytest.fixture
+def playlists(tmpdir, monkeypatch):
+    chan = tmpdir.mkdir('chan')
+    for n in range(100, 110):
+        chan.join('master2500_%d.ts' % n).write_binary(bytes(segment(900000 + n * 540000)))
+    playlists = { 'master.m3u8': MASTER, 'master2500.m3u8': mediaPlaylist(100, 3) }
+    def fetchPlaylist(uri):
+        return (playlists[os.path.basename(uri)], str(chan) + '/')
+    monkeypatch.setattr(HTTP, 'fetchPlaylist', fetchPlaylist)
+    return playlists
+
+@pytest.fixture
+def channel(tmpdir, playlists):
+    mpd = MPD.HLS(str(tmpdir.join('chan', 'master.m3u8')), False, str(tmpdir) + '/')
+    return Channel.Channel(mpd, str(tmpdir.mkdir('out').join('manifest.mpd')))
+
+def test_unchanged_playlist(channel):
+    assert channel.update() == True
+    inode = os.stat(channel.output).st_ino
+    metrics.reset()
+    assert channel.mpd.refresh() == False
+    assert channel.update() == False
+    assert metrics.getCounter('unchanged_playlists') == 2
+    assert os.stat(channel.output).st_ino == inode
+
+def test_changed_playlist_rebuilds_mpd(channel, playlists):
+    channel.update()
+    playlists['master2500.m3u8'] = mediaPlaylist(101, 3)
+    metrics.reset()
+    assert channel.update() == True
+    assert 'startNumber="101"' in open(channel.output).read()
+    assert metrics.getCounter('full_parses') == 0
+    # A playlist that does not overlap the current one is parsed again
+    playlists['master2500.m3u8'] = mediaPlaylist(106, 3)
+    assert channel.update() == True
+    assert 'startNumber="106"' in open(channel.output).read()
+    assert metrics.getCounter('full_parses') == 1
+
+def test_manifest_is_replaced_atomically(channel, playlists, monkeypatch):
+    channel.update()
+    inode = os.stat(channel.output).st_ino
+    previous = open(channel.output).read()
+    playlists['master2500.m3u8'] = mediaPlaylist(101, 3)
+    def failingRename(src, dst):
+        raise OSError("rename failed")
+    with monkeypatch.context() as m:
+        m.setattr(os, 'rename', failingRename)
+        with pytest.raises(OSError):
+            channel.update()
+    # The old manifest is intact and no temporary file is left behind
+    assert open(channel.output).read() == previous
+    assert os.listdir(os.path.dirname(channel.output)) == [ 'manifest.mpd' ]
+    playlists['master2500.m3u8'] = mediaPlaylist(102, 3)
+    assert channel.update() == True
+    assert os.stat(channel.output).st_ino != inode
+    assert os.listdir(os.path.dirname(channel.output)) == [ 'manifest.mpd' ]
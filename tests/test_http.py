@@ -0,0 +1,137 @@
+import pytest
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+from hls2dash.lib import HTTP
+from hls2dash.lib import TS
+from tsutil import packet, pat, pmt, pes
+
+PLAYLIST = '#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6.000,\nmaster2500_1.ts\n'
+
+# Segment where the first PES packets come after padding bytes of null
+# packets, or without PES packets if pts is None
+def paddedSegment(padding, pts=None):
+    data = pat() + pmt([ (0x1b, 0x100), (0x0f, 0x101) ])
+    data += packet(0x1fff, b'', False) * (padding // 188)
+    if pts != None:
+        data += pes(0x100, 0xe0, pts) + pes(0x101, 0xc0, pts)
+    return str(data)
+
+SEGMENTS = {
+    'head.ts': paddedSegment(0, 900000),
+    'late.ts': paddedSegment(2 * TS.PROBE_CHUNK_SIZE, 900000),
+    'nopts.ts': paddedSegment(2 * TS.PROBE_RANGE_MAX)
+}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = []
+    sockets = []
+    ranges = []
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        Handler.connections.append(self.client_address)
+        Handler.sockets.append(self.connection)
+    def do_GET(self):
+        if '/seg/' in self.path:
+            return self.sendSegment(self.path.split('/')[-1])
+        data = PLAYLIST
+        status = 200
+        if self.headers.get('Range') == 'bytes=0-5':
+            data = data[0:6]
+            status = 206
+        elif self.headers.get('If-None-Match') == '"1"':
+            data = ''
+            status = 304
+        self.send_response(status)
+        self.send_header('ETag', '"1"')
+        self.send_header('Content-Length', len(data))
+        self.end_headers()
+        self.wfile.write(data)
+    def sendSegment(self, name):
+        # Segments under /norange/ are served as if Range is not supported
+        data = SEGMENTS[name]
+        status = 200
+        byterange = self.headers.get('Range')
+        if byterange != None and not '/norange/' in self.path:
+            (first, last) = [ int(x) for x in byterange.split('=')[1].split('-') ]
+            Handler.ranges.append((first, last))
+            data = data[first:last + 1]
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', len(data))
+        self.end_headers()
+        self.wfile.write(data)
+    def log_message(self, *args):
+        return
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    def handle_error(self, request, client_address):
+        return
+
+@pytest.fixture
+def server():
+    s = Server(('127.0.0.1', 0), Handler)
+    t = threading.Thread(target=s.serve_forever)
+    t.daemon = True
+    t.start()
+    Handler.connections = []
+    Handler.sockets = []
+    Handler.ranges = []
+    yield 'http://127.0.0.1:%d' % s.server_port
+    s.shutdown()
+    # End the kept alive connections so no handler outlives the test
+    for conn in Handler.sockets:
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+    s.server_close()
+
+def test_connection_is_reused(server):
+    client = HTTP.Client()
+    assert client.get(server + '/live/master2500.m3u8').body == PLAYLIST
+    response = client.get(server + '/live/master2500_1.ts', (0, 5))
+    assert response.status == 206
+    assert response.body == '#EXTM3'
+    assert response.getHeader('Content-Length') == '6'
+    assert len(Handler.connections) == 1
+
+def test_get_playlist(server):
+    playlist = HTTP.getPlaylist(server + '/live/master2500.m3u8')
+    assert playlist.target_duration == 6
+    assert playlist.segments[0].base_uri + playlist.segments[0].uri == server + '/live/master2500_1.ts'
+
+def test_conditional_get(server):
+    client = HTTP.Client()
+    response = client.getConditional(server + '/live/master2500.m3u8')
+    assert (response.status, response.body) == (200, PLAYLIST)
+    response = client.getConditional(server + '/live/master2500.m3u8')
+    assert (response.status, response.body) == (304, PLAYLIST)
+    assert client.getConditional(server + '/live/master1500.m3u8').status == 200
+
+def test_probe_range_in_first_window(server):
+    ts = TS.Remote(server + '/seg/head.ts')
+    assert ts.probeRange().getStartTime() == 10.0
+    assert Handler.ranges == [ (0, TS.PROBE_CHUNK_SIZE - 1) ]
+    assert ts.data == None
+
+def test_probe_range_doubles_window(server):
+    chunk = TS.PROBE_CHUNK_SIZE
+    ts = TS.Remote(server + '/seg/late.ts')
+    assert ts.probeRange().getStartTime() == 10.0
+    assert Handler.ranges == [ (0, chunk - 1), (chunk, 3 * chunk - 1) ]
+
+def test_probe_range_is_capped(server):
+    ts = TS.Remote(server + '/seg/nopts.ts')
+    assert ts.probeRange().getStartTime() == None
+    assert sum([ last - first + 1 for (first, last) in Handler.ranges ]) == TS.PROBE_RANGE_MAX
+    assert Handler.ranges[-1][1] == TS.PROBE_RANGE_MAX - 1
+
+def test_probe_range_without_range_support(server):
+    ts = TS.Remote(server + '/norange/seg/late.ts')
+    assert ts.probeRange().getStartTime() == 10.0
+    # The whole segment was returned and is kept for the remux
+    assert ts.data == SEGMENTS['late.ts']
@@ -0,0 +1,26 @@
+import pytest
+import json
+from hls2dash import metrics
+
+def test_json_line_has_changes_since_last_emit():
+    metrics.reset()
+    metrics.count('probes', 2)
+    with metrics.timer('render'):
+        pass
+    first = json.loads(metrics.asJSON('chan'))
+    assert first['channel'] == 'chan'
+    assert first['counters'] == { 'probes': 2 }
+    assert first['timers']['render']['count'] == 1
+    metrics.count('probes')
+    second = json.loads(metrics.asJSON())
+    assert second['counters'] == { 'probes': 1 }
+    assert second['timers'] == {}
+
+def test_prometheus_textfile():
+    metrics.reset()
+    metrics.count('http_bytes', 1024)
+    metrics.addTime('media_playlist', 0.5)
+    text = metrics.asPrometheus({ 'channel': 'chan' })
+    assert 'hls2dash_http_bytes_total{channel="chan"} 1024\n' in text
+    assert 'hls2dash_phase_seconds_total{channel="chan",phase="media_playlist"} 0.500000\n' in text
+    assert 'hls2dash_phase_calls_total{channel="chan",phase="media_playlist"} 1\n' in text
@@ -1,5 +1,14 @@
 import pytest
+import os
+import datetime
+import re
+import time
+import threading
 from hls2dash.lib import MPD
+from hls2dash.lib import ContextStore
+from hls2dash import metrics
+from hls2dash.lib import HTTP
+from tsutil import pat, pmt, pes, segment
 
 def test_init_baseclass():
     obj = MPD.Base()
@@ -18,3 +27,274 @@ def test_init_hlsclass_with_invalid_locator():
         obj = MPD.HLS("asfsfsdf")
 
     
+def test_starttime_cache_eviction():
+    cache = MPD.StartTimeCache(maxentries=2)
+    cache.put('a.ts', 1.0)
+    cache.put('b.ts', 2.0)
+    assert cache.get('a.ts') == 1.0
+    cache.put('c.ts', 3.0)
+    assert cache.get('b.ts') == None
+    assert cache.get('a.ts') == 1.0
+    cache.entries['c.ts'] = (3.0, 0)
+    assert cache.get('c.ts') == None
+
+def test_context_persists_starttimes(tmpdir):
+    ctx = MPD.Context('test', str(tmpdir))
+    ctx.setPrevSplit(10.0)
+    ctx.getStartTimeCache().put('http://example.com/master2500_1.ts', 10.0)
+    ctx.save()
+    restored = MPD.Context('test', str(tmpdir))
+    restored.restore()
+    assert restored.getPrevSplit() == 900000
+    assert restored.getStartTimeCache().get('http://example.com/master2500_1.ts') == 10.0
+
+def test_context_sqlite_store(tmpdir):
+    store = ContextStore.SQLiteStore(str(tmpdir.join('context.db')))
+    ctx = MPD.Context('chan1', store=store)
+    ctx.setPrevSplit(10.0)
+    ctx.getStartTimeCache().put('http://example.com/master2500_1.ts', 10.0)
+    ctx.getStartTimeCache().put('http://example.com/master2500_2.ts', 16.0)
+    ctx.save()
+    MPD.Context('chan2', store=store).save()
+    restored = MPD.Context('chan1', store=ContextStore.SQLiteStore(str(tmpdir.join('context.db'))))
+    restored.restore()
+    assert restored.getPrevSplit() == 900000
+    assert restored.getNextSplit() == 0
+    assert [ e[0] for e in restored.getStartTimeCache().asList() ] == [ 'http://example.com/master2500_1.ts', 'http://example.com/master2500_2.ts' ]
+    assert store.load('chan3') == None
+
+def test_context_file_store_is_replaced_atomically(tmpdir):
+    ctx = MPD.Context('test', str(tmpdir))
+    ctx.save()
+    ctx.setPrevSplit(10.0)
+    ctx.save()
+    assert os.listdir(str(tmpdir)) == [ 'test.ctx' ]
+
+@pytest.mark.parametrize('sqlite', [ False, True ])
+def test_context_lock_serializes_runs(tmpdir, sqlite):
+    if sqlite:
+        store = ContextStore.SQLiteStore(str(tmpdir.join('context.db')))
+    else:
+        store = ContextStore.FileStore(str(tmpdir))
+    events = []
+    def run(name, hold):
+        ctx = MPD.Context('test', store=store)
+        with ctx.lock():
+            events.append(name + ' start')
+            ctx.restore()
+            time.sleep(hold)
+            ctx.setPrevSplit(ctx.getPrevSplit() / ctx.getTimeBase() + 1.0)
+            ctx.save()
+            events.append(name + ' end')
+    threads = [ threading.Thread(target=run, args=('a', 0.2)) ]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=run, args=('b', 0.0)))
+    threads[1].start()
+    for t in threads:
+        t.join()
+    # The second run sees the changes of the first and no lock file is left
+    assert events == [ 'a start', 'a end', 'b start', 'b end' ]
+    restored = MPD.Context('test', store=store)
+    restored.restore()
+    assert restored.getPrevSplit() == 180000
+    assert not [ f for f in os.listdir(str(tmpdir)) if f.endswith('.lock') ]
+
+MASTER = '''#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"
+master2500.m3u8
+'''
+
+SCTE35 = '/DAlAAAAAAAAAP/wFAUAAAABf+/+AAAAAH4AEHmwAAEAAAAAKHIKsQ=='
+
+# Channel with an ad break every third segment, where the segments are
+# step ticks apart and the EXTINF duration is 6 seconds. Segment 100 has
+# program date time 2016-06-01T10:00:00Z if pdt is set
+def writeChannel(chan, first, count, step=540000, pdt=False):
+    chan.join('master.m3u8').write(MASTER)
+    lines = [ '#EXTM3U', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:%d' % first ]
+    for n in range(first, first + count):
+        if n % 3 == 1:
+            lines += [ '#EXT-OATCLS-SCTE35:%s' % SCTE35, '#EXT-X-CUE-OUT:6' ]
+        elif n % 3 == 2:
+            lines += [ '#EXT-X-CUE-IN' ]
+        if pdt:
+            lines += [ '#EXT-X-PROGRAM-DATE-TIME:%s' % (datetime.datetime(2016, 6, 1, 10, 0, 0) + datetime.timedelta(seconds=(n - 100) * 6)).isoformat() + 'Z' ]
+        lines += [ '#EXTINF:6.000,', 'master2500_%d.ts' % n ]
+        chan.join('master2500_%d.ts' % n).write_binary(bytes(segment(900000 + n * step)))
+    chan.join('master2500.m3u8').write('\n'.join(lines) + '\n')
+
+def periodStarts(mpd):
+    return [ (p.getPeriodId(), p.getTimeline().getStartTime()) for p in mpd.getAllPeriods() ]
+
+def test_extinf_timing_without_probes(tmpdir):
+    chan = tmpdir.mkdir('chan')
+    writeChannel(chan, 100, 9)
+    reference = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir.mkdir('a')))
+    reference.load()
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir.mkdir('b')))
+    mpd.setTiming('extinf', 0)
+    metrics.reset()
+    mpd.load()
+    assert metrics.getCounter('probes') == 1
+    writeChannel(chan, 103, 9)
+    reference.load()
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir.join('b')))
+    mpd.setTiming('extinf', 0)
+    metrics.reset()
+    mpd.load()
+    assert metrics.getCounter('probes') == 0
+    assert periodStarts(mpd) == periodStarts(reference)
+
+def test_extinf_timing_drift(tmpdir):
+    # Segments are 6.1s apart but EXTINF says 6s
+    chan = tmpdir.mkdir('chan')
+    writeChannel(chan, 100, 12, 549000)
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir))
+    mpd.setTiming('extinf', 3)
+    metrics.reset()
+    mpd.load()
+    assert metrics.getCounter('timing_drift') > 0
+    # The period start before the last one is probed, so the last one
+    # is only one segment off
+    (periodid, starttime) = periodStarts(mpd)[-1]
+    assert abs(starttime - (900000 + 110 * 549000) / 90000.0) < 0.2
+
+def test_pdt_timing(tmpdir):
+    chan = tmpdir.mkdir('chan')
+    writeChannel(chan, 100, 9, pdt=True)
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir))
+    mpd.setTiming('pdt', 0)
+    metrics.reset()
+    mpd.load()
+    assert metrics.getCounter('probes') == 1
+    # The first frame of segment 100 is presented at media time 610.033367
+    assert mpd._getAvailabilityStartTime() == '2016-06-01T09:49:49.966633Z'
+    writeChannel(chan, 104, 9, pdt=True)
+    reference = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir.mkdir('ref')))
+    reference.load()
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir))
+    mpd.setTiming('pdt', 0)
+    metrics.reset()
+    mpd.load()
+    assert metrics.getCounter('probes') == 0
+    assert metrics.getCounter('pdt_starttimes') == len(mpd.getAllPeriods())
+    assert periodStarts(mpd) == periodStarts(reference)
+    assert mpd._getAvailabilityStartTime() == '2016-06-01T09:49:49.966633Z'
+
+def test_compare_without_timestamps(tmpdir):
+    chan = tmpdir.mkdir('chan')
+    writeChannel(chan, 100, 3, pdt=True)
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), False, str(tmpdir))
+    mpd.load()
+    xml = mpd.asXML()
+    mpd.firstSegmentStartTime += 1
+    assert mpd.withoutTimestamps(mpd.asXML()) == mpd.withoutTimestamps(xml)
+    # From the program date time the availability start time only changes
+    # with the content
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), False, str(tmpdir))
+    mpd.setTiming('pdt', 0)
+    mpd.load()
+    xml = mpd.asXML()
+    assert not 'publishTime=' in mpd.withoutTimestamps(xml)
+    mpd.availabilityStartTime += 1
+    assert mpd.withoutTimestamps(mpd.asXML()) != mpd.withoutTimestamps(xml)
+
+def withoutTimes(xml):
+    return '\n'.join([ l for l in xml.split('\n') if not 'Time=' in l ])
+
+@pytest.mark.parametrize('splice', [ False, True ])
+def test_incremental_update_equals_full_parse(tmpdir, splice):
+    # Segments are 6.1s apart but EXTINF says 6s, so start times of
+    # expired heads are probed as in a full parse
+    chan = tmpdir.mkdir('chan')
+    writeChannel(chan, 100, 9, 549000)
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), splice, str(tmpdir.mkdir('a')))
+    mpd.load()
+    MPD.HLS(str(chan.join('master.m3u8')), splice, str(tmpdir.mkdir('b'))).load()
+    metrics.reset()
+    for first in range(101, 106):
+        writeChannel(chan, first, 9, 549000)
+        assert mpd.refresh() == True
+        reference = MPD.HLS(str(chan.join('master.m3u8')), splice, str(tmpdir.join('b')))
+        reference.load()
+        assert withoutTimes(mpd.asXML()) == withoutTimes(reference.asXML())
+        assert mpd.segmenturis == reference.segmenturis
+    assert metrics.getCounter('full_parses') == 0
+
+def test_previous_split_after_next_split(tmpdir):
+    # The stored next split is before the previous split, so the first
+    # period keeps the previous split as id
+    chan = tmpdir.mkdir('chan')
+    chan.join('master.m3u8').write('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"\nmaster2500.m3u8\n')
+    chan.join('master2500.m3u8').write('#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:1\n#EXTINF:6.000,\nmaster2500_1.ts\n')
+    chan.join('master2500_1.ts').write_binary(bytes(pat() + pmt([ (0x1b, 0x100), (0x0f, 0x101) ]) + pes(0x100, 0xe0, 1800000) + pes(0x101, 0xc0, 1800000)))
+    ctx = MPD.Context('test', str(tmpdir))
+    ctx.setPrevSplit(10.0)
+    ctx.setNextSplit(5.0)
+    ctx.save()
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), False, str(tmpdir), 'test')
+    mpd.load()
+    assert mpd.getPeriod(0).getPeriodId() == 900000
+
+def test_events_renumbered_on_update(tmpdir):
+    chan = tmpdir.mkdir('chan')
+    chan.join('master.m3u8').write('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"\nmaster2500.m3u8\n')
+    def writePlaylist(first):
+        # An ad break every third segment
+        lines = [ '#EXTM3U', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:%d' % first ]
+        for n in range(first, first + 9):
+            if n % 3 == 1:
+                lines += [ '#EXT-OATCLS-SCTE35:/DAlAAAAAAAAAP/wFAUAAAABf+/+AAAAAH4AEHmwAAEAAAAAKHIKsQ==', '#EXT-X-CUE-OUT:6' ]
+            elif n % 3 == 2:
+                lines += [ '#EXT-X-CUE-IN' ]
+            lines += [ '#EXTINF:6.000,', 'master2500_%d.ts' % n ]
+            pts = 900000 + n * 540000
+            chan.join('master2500_%d.ts' % n).write_binary(bytes(pat() + pmt([ (0x1b, 0x100), (0x0f, 0x101) ]) + pes(0x100, 0xe0, pts) + pes(0x101, 0xc0, pts)))
+        chan.join('master2500.m3u8').write('\n'.join(lines) + '\n')
+    writePlaylist(100)
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), True, str(tmpdir))
+    mpd.load()
+    writePlaylist(102)
+    assert mpd.refresh() == True
+    assert re.findall('<Event duration="\d+" id="(\d+)">', mpd.asXML()) == [ '1', '2', '3' ]
+
+def test_verify_variants_warns_about_lagging_variant(tmpdir, monkeypatch, capsys):
+    chan = tmpdir.mkdir('chan')
+    chan.join('master.m3u8').write('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"\nmaster2500.m3u8\n#EXT-X-STREAM-INF:BANDWIDTH=1500000,RESOLUTION=960x540,CODECS="avc1.4d401f,mp4a.40.2"\nmaster1500.m3u8\n')
+    for (profile, count) in [ ('2500', 6), ('1500', 4) ]:
+        lines = [ '#EXTM3U', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:100' ]
+        for n in range(100, 100 + count):
+            lines += [ '#EXTINF:6.000,', 'master%s_%d.ts' % (profile, n) ]
+        chan.join('master%s.m3u8' % profile).write('\n'.join(lines) + '\n')
+    for n in range(100, 106):
+        chan.join('master2500_%d.ts' % n).write_binary(bytes(segment(900000 + n * 540000)))
+    # Variant playlists are loaded at the same time
+    getPlaylist = HTTP.getPlaylist
+    active = [ 0, 0 ]
+    lock = threading.Lock()
+    def slowGetPlaylist(uri):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+        return getPlaylist(uri)
+    monkeypatch.setattr(HTTP, 'getPlaylist', slowGetPlaylist)
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), False, str(tmpdir))
+    mpd.setVerifyVariants(True)
+    metrics.reset()
+    try:
+        mpd.load()
+        pool = mpd.variantPool
+        mpd.refresh()
+        assert mpd.variantPool is pool
+    finally:
+        mpd.close()
+    assert active[1] == 2
+    assert mpd.getLaggingVariants() == [ (str(chan.join('master1500.m3u8')), 2) ]
+    assert 'startNumber="100"' in mpd.asXML()
+    # Checked on every refresh
+    assert metrics.getCounter('variants_lagging') == 2
+    assert 'Warning: variant %s is not aligned' % chan.join('master1500.m3u8') in capsys.readouterr()[1]
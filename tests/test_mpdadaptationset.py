@@ -1,5 +1,6 @@
 import pytest
 from hls2dash.lib import MPDAdaptationSet
+from hls2dash.lib import MPDTimeline
 
 def test_init_baseclass():
     obj = MPDAdaptationSet.Base('video/mp4', 'codec', 13000)
@@ -28,3 +29,17 @@ def test_calc_presentation_time_offset():
     obj = MPDAdaptationSet.Audio('audio/mp4', 'codec')
     obj.setStartTime(70403.6)
     assert obj.getPresentationTimeOffset() != 6336324000
+
+def test_remove_first_segment():
+    obj = MPDAdaptationSet.Video('video/mp4', 'codec')
+    obj.setStartNumber('0100')
+    timeline = MPDTimeline.Timeline()
+    timeline.setStartTime(10.0)
+    timeline.addSegment(6.0)
+    timeline.addSegment(6.0)
+    obj.setTimeline(timeline)
+    timeline.removeFirstSegment()
+    obj.removeFirstSegment()
+    assert obj.getTimeline().haveSegments() == True
+    assert obj.timelineAsXML() == '          <S t="1440000" d="540000" />\n'
+    assert obj.startNumber == '101'
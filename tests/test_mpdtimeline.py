@@ -0,0 +1,35 @@
+import pytest
+from hls2dash.lib import MPDTimeline
+
+def test_repeat_count():
+    obj = MPDTimeline.Timeline()
+    obj.setStartTime(10.0)
+    for d in [ 6.0, 6.0, 6.0, 4.0, 6.0 ]:
+        obj.addSegment(d)
+    assert obj.asXML(48000) == (
+        '          <S t="480000" d="288000" r="2" />\n'
+        '          <S d="192000" />\n'
+        '          <S d="288000" />\n')
+
+def test_no_rounding_drift():
+    obj = MPDTimeline.Timeline()
+    obj.setStartTime(0.0)
+    for i in range(1000):
+        obj.addSegment(4.63999375)
+    xml = obj.asXML(48000)
+    total = 0
+    for line in xml.splitlines():
+        d = int(line.split('d="')[1].split('"')[0])
+        r = int(line.split('r="')[1].split('"')[0]) if 'r="' in line else 0
+        total += d * (r + 1)
+    assert total == int(1000 * 4.63999375 * 48000)
+
+def test_remove_first_segment():
+    obj = MPDTimeline.Timeline()
+    obj.setStartTime(10.0)
+    obj.addSegment(6.0)
+    obj.addSegment(4.0)
+    assert obj.removeFirstSegment() == 6.0
+    assert obj.getStartTime() == 16.0
+    assert obj.getSegmentCount() == 1
+    assert obj.asXML(90000) == '          <S t="1440000" d="360000" />\n'
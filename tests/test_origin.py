@@ -0,0 +1,92 @@
+import pytest
+import os
+import threading
+import time
+from hls2dash.lib import MPD
+from hls2dash.lib import Origin
+from tsutil import segment
+
+MASTER = '''#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"
+master2500.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1500000,RESOLUTION=960x540,CODECS="avc1.4d401f,mp4a.40.2"
+master1500.m3u8
+'''
+
+@pytest.fixture
+def origin(tmpdir):
+    chan = tmpdir.mkdir('chan')
+    chan.join('master.m3u8').write(MASTER)
+    for profile in [ '2500', '1500' ]:
+        lines = [ '#EXTM3U', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:100' ]
+        for n in range(100, 103):
+            lines += [ '#EXTINF:6.000,', 'master%s_%d.ts' % (profile, n) ]
+            chan.join('master%s_%d.ts' % (profile, n)).write_binary(bytes(segment(900000 + n * 540000)))
+        chan.join('master%s.m3u8' % profile).write('\n'.join(lines) + '\n')
+    mpd = MPD.HLS(str(chan.join('master.m3u8')), False, str(tmpdir) + '/')
+    return Origin.Origin(mpd, str(tmpdir.mkdir('cache')))
+
+def test_manifest_and_segment(origin):
+    origin.refresh()
+    assert '<MPD' in origin.getManifest()
+    path = origin.getSegment('video-1500_101.dash')
+    assert os.path.isfile(path)
+    assert os.path.isfile(path.replace('video-', 'audio-'))
+    assert origin.getSegment('video-1500_99.dash') == None
+    assert origin.getSegment('video-800_101.dash') == None
+    assert origin.getSegment('stream.m4s') == None
+
+def test_coalescer_runs_once():
+    coalescer = Origin.Coalescer()
+    calls = []
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'done'
+    results = []
+    threads = [ threading.Thread(target=lambda: results.append(coalescer.run('seg', work))) for i in range(4) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [ 'done' ] * 4
+
+def test_prefetch_queue_prefers_live_edge():
+    queue = Origin.PrefetchQueue(3)
+    for n in [ 100, 101, 102, 103 ]:
+        queue.put(n, n)
+    queue.put(99, 99)
+    assert queue.size() == 3
+    assert [ queue.get(), queue.get(), queue.get() ] == [ 103, 102, 101 ]
+
+def test_prefetch_new_segments(origin):
+    origin.prefetchQueue = Origin.PrefetchQueue()
+    origin.refresh()
+    assert origin.prefetchQueue.size() == 6
+    (profile, number) = origin.prefetchQueue.get()
+    assert number == 102
+    assert origin.prefetch(profile, number) == True
+    assert origin.prefetch(profile, number) == False
+    assert os.path.isfile(os.path.join(origin.cachedir, 'audio-%s_102.dash' % profile))
+
+def test_requests_do_not_wait_for_refresh(origin):
+    origin.refresh()
+    manifest = origin.getManifest()
+    loading = threading.Event()
+    release = threading.Event()
+    refresh = origin.mpd.refresh
+    def slowRefresh():
+        loading.set()
+        release.wait(5)
+        return refresh()
+    origin.mpd.refresh = slowRefresh
+    t = threading.Thread(target=origin.refresh)
+    t.start()
+    try:
+        assert loading.wait(5)
+        assert origin.getManifest() == manifest
+        assert origin.getSegmentURI('1500', '101').endswith('master1500_101.ts')
+    finally:
+        release.set()
+        t.join()
@@ -0,0 +1,28 @@
+import pytest
+import json
+from hls2dash import packager
+
+def writeConfig(tmpdir, config):
+    path = tmpdir.join('packager.json')
+    path.write(json.dumps(config))
+    return str(path)
+
+def test_load_config_defaults(tmpdir):
+    path = writeConfig(tmpdir, { 'ctxdir': '/var/tmp/', 'channels': [ { 'playlist': 'http://example.com/chan1/master.m3u8', 'output': 'chan1.mpd' } ] })
+    config = packager.loadConfig(path)
+    assert config['probes'] == 4
+    assert config['channels'][0]['multi'] == False
+    assert config['channels'][0]['ctxdir'] == '/var/tmp/'
+
+def test_load_config_invalid(tmpdir):
+    with pytest.raises(Exception):
+        packager.loadConfig(writeConfig(tmpdir, { 'channels': [] }))
+    with pytest.raises(Exception):
+        packager.loadConfig(writeConfig(tmpdir, { 'channels': [ { 'playlist': 'master.m3u8' } ] }))
+    with pytest.raises(Exception):
+        packager.loadConfig(writeConfig(tmpdir, { 'channels': [ { 'playlist': 'a/master.m3u8', 'output': 'x.mpd' }, { 'playlist': 'b/master.m3u8', 'output': 'x.mpd' } ] }))
+
+def test_assign_channels():
+    assigned = packager.assignChannels(range(5), 2)
+    assert assigned == [ [ 0, 2, 4 ], [ 1, 3 ] ]
+    assert len(packager.assignChannels(range(2), 8)) == 2
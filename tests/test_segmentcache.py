@@ -0,0 +1,52 @@
+import pytest
+import os
+import time
+from hls2dash.lib import SegmentCache
+from hls2dash.lib import TS
+from hls2dash.lib import TSRemux
+from tsutil import segment
+
+def writeOutput(outdir, filename, size):
+    for track in [ 'audio', 'video' ]:
+        outdir.join('%s-%s' % (track, filename)).write('x' * size)
+
+def test_store_and_fetch(tmpdir):
+    cache = SegmentCache.SegmentCache(str(tmpdir.join('cache')))
+    src = tmpdir.mkdir('src')
+    dst = tmpdir.mkdir('dst')
+    writeOutput(src, '2500_1.dash', 10)
+    assert cache.fetch('http://example.com/master2500_1.ts', 10.0, str(dst), '2500_1.dash') == False
+    cache.store('http://example.com/master2500_1.ts', 10.0, str(src), '2500_1.dash')
+    assert cache.fetch('http://example.com/master2500_1.ts', 10.0, str(dst), '2500_1.dash') == True
+    assert dst.join('video-2500_1.dash').read() == 'x' * 10
+    assert cache.fetch('http://example.com/master2500_1.ts', 16.0, str(dst), '2500_1.dash') == False
+
+def test_evict_least_recently_used(tmpdir):
+    cache = SegmentCache.SegmentCache(str(tmpdir.join('cache')))
+    src = tmpdir.mkdir('src')
+    writeOutput(src, 'seg.dash', 20)
+    for n in range(3):
+        cache.store('seg%d.ts' % n, n, str(src), 'seg.dash')
+        for track in [ 'audio', 'video' ]:
+            path = cache._path(cache.key('seg%d.ts' % n, n), track)
+            os.utime(path, (time.time() - 100 + n, time.time() - 100 + n))
+    cache.fetch('seg0.ts', 0, str(src), 'seg.dash')
+    cache.maxbytes = 100
+    cache.evict()
+    assert cache.size() == 80
+    assert cache.fetch('seg1.ts', 1, str(src), 'seg.dash') == False
+    assert cache.fetch('seg0.ts', 0, str(src), 'seg.dash') == True
+
+def test_local_remux_from_cache(tmpdir, monkeypatch):
+    tsfile = tmpdir.join('master2500_1.ts')
+    tsfile.write_binary(bytes(segment(900000)))
+    cache = SegmentCache.SegmentCache(str(tmpdir.join('cache')))
+    calls = []
+    remux = TSRemux.tsremux
+    monkeypatch.setattr(TSRemux, 'tsremux', lambda *args: calls.append(args) or remux(*args))
+    for outdir in [ tmpdir.mkdir('a'), tmpdir.mkdir('b') ]:
+        ts = TS.Local(str(tsfile))
+        ts.setCache(cache)
+        ts.remuxMP4(str(outdir), '2500_1.dash')
+    assert len(calls) == 1
+    assert tmpdir.join('b').join('video-2500_1.dash').read_binary() == tmpdir.join('a').join('video-2500_1.dash').read_binary()
@@ -0,0 +1,35 @@
+import pytest
+import os
+import sys
+import subprocess
+
+from tsutil import segment
+
+HEAVY = [ 'pkg_resources', 'pycurl', 'm3u8', 'ffprobe', 'sqlite3' ]
+
+REMUX = [ 'hls2dash.lib.TSRemux', 'hls2dash.lib.ElementaryStream', 'hls2dash.lib.MP4' ]
+
+# Run the main function of a command line tool with arguments, --version
+# by default, in a new interpreter and return the modules of a list that
+# it loaded
+def loadedModules(module, function, args=[ '--version' ], modules=HEAVY):
+    code = 'import sys\nsys.argv = %r\nfrom %s import %s\ntry:\n    %s()\nexcept SystemExit:\n    pass\nsys.stdout.write(" ".join([ m for m in %r if m in sys.modules ]))\n' % ([ 'tool' ] + args, module, function, function, modules)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    output = subprocess.check_output([ sys.executable, '-c', code ], env=env, stderr=open(os.devnull, 'w'))
+    return output.split()
+
+def test_cli_startup_is_lazy():
+    assert loadedModules('hls2dash', 'main') == []
+    assert loadedModules('hls2dash.tsremux', 'main') == []
+    assert loadedModules('hls2dash.tsremux', 'batch') == []
+    assert loadedModules('hls2dash.packager', 'main') == []
+
+def test_manifest_without_remux_modules(tmpdir):
+    chan = tmpdir.mkdir('chan')
+    chan.join('master.m3u8').write('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"\nmaster2500.m3u8\n')
+    chan.join('master2500.m3u8').write('#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:1\n#EXTINF:6.000,\nmaster2500_1.ts\n')
+    chan.join('master2500_1.ts').write_binary(bytes(segment(900000)))
+    args = [ str(chan.join('master.m3u8')), '--ctxdir', str(tmpdir), '-o', str(tmpdir.join('manifest.mpd')) ]
+    assert loadedModules('hls2dash', 'main', args, REMUX) == []
+    assert '<MPD' in tmpdir.join('manifest.mpd').read()
@@ -0,0 +1,29 @@
+import pytest
+from hls2dash.lib import TSParser
+from tsutil import pat, pmt, pes
+
+def test_probe_video_and_audio():
+    data = pat() + pmt([ (0x1b, 0x100), (0x0f, 0x101) ]) + pes(0x101, 0xc0, 900000) + pes(0x100, 0xe0, 903600, 900000)
+    probe = TSParser.Probe()
+    assert probe.feed(data) == True
+    assert probe.getVideoStartTime() == 903600 / 90000.0
+    assert probe.getAudioStartTime() == 10.0
+    assert probe.getStreams()[0].dts == 900000
+
+def test_probe_incomplete_without_all_streams():
+    probe = TSParser.Probe()
+    assert probe.feed(pat() + pmt([ (0x1b, 0x100), (0x0f, 0x101) ]) + pes(0x100, 0xe0, 1000)) == False
+    assert probe.getAudioStartTime() == None
+    assert probe.getStartTime() == 1000 / 90000.0
+
+def test_probe_split_feed_and_resync():
+    data = bytearray([ 0x00, 0x12 ]) + pat() + pmt([ (0x1b, 0x100) ]) + pes(0x100, 0xe0, 2**33 - 1)
+    probe = TSParser.Probe()
+    assert probe.feed(data[:200]) == False
+    assert probe.feed(data[200:]) == True
+    assert probe.getVideoStartTime() == (2**33 - 1) / 90000.0
+
+def test_pes_header_without_pts():
+    (pts, dts, headerlength) = TSParser.parsePESHeader(bytearray([ 0x00, 0x00, 0x01, 0xe0, 0x00, 0x00, 0x80, 0x00, 0x00 ]))
+    assert pts == None
+    assert headerlength == 9
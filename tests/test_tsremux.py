@@ -0,0 +1,121 @@
+import pytest
+import io
+import os
+import tempfile
+import struct
+from hls2dash.lib import TSRemux
+from hls2dash.lib import ElementaryStream
+from tsutil import segment, sps
+
+def boxes(data, pos=0, end=None):
+    if end == None:
+        end = len(data)
+    result = []
+    while pos < end:
+        (size, boxtype) = struct.unpack('>I4s', data[pos:pos+8])
+        result.append((boxtype, pos, size))
+        pos += size
+    return result
+
+def child(data, parent, boxtype):
+    (name, pos, size) = parent
+    for b in boxes(data, pos + 8, pos + size):
+        if b[0] == boxtype:
+            return b
+    return None
+
+def test_parse_sps():
+    info = ElementaryStream.parseSPS(sps(1280, 720))
+    assert (info['profile'], info['level'], info['width'], info['height']) == (66, 31, 1280, 720)
+    info = ElementaryStream.parseSPS(sps(1920, 1080))
+    assert (info['width'], info['height']) == (1920, 1080)
+
+def test_remux_native():
+    (audio, video) = TSRemux.remuxfMP4(io.BytesIO(bytes(segment(900000))), 10.0)
+    assert [ b[0] for b in boxes(video) ] == [ b'ftyp', b'moov', b'moof', b'mdat' ]
+    assert [ b[0] for b in boxes(audio) ] == [ b'ftyp', b'moov', b'moof', b'mdat' ]
+    traf = child(video, boxes(video)[2], b'traf')
+    tfdt = child(video, traf, b'tfdt')
+    # First frame is presented at 10.0s with a decode delay of 3003
+    assert struct.unpack('>Q', video[tfdt[1]+12:tfdt[1]+20])[0] == 900000 - 3003
+    trun = child(video, traf, b'trun')
+    (count, offset) = struct.unpack('>Ii', video[trun[1]+12:trun[1]+20])
+    assert count == 2
+    assert boxes(video)[2][1] + offset == boxes(video)[3][1] + 8
+    traf = child(audio, boxes(audio)[2], b'traf')
+    tfdt = child(audio, traf, b'tfdt')
+    assert struct.unpack('>Q', audio[tfdt[1]+12:tfdt[1]+20])[0] == 480000
+    mdat = boxes(audio)[3]
+    assert mdat[2] == 8 + 50 + 60
+
+def test_remux_native_96khz_audio():
+    (audio, video) = TSRemux.remuxfMP4(io.BytesIO(bytes(segment(900000, samplerateindex=0))), 10.0)
+    # 96000 << 16 does not fit in the 16.16 sample rate of the sample entry
+    pos = audio.index(b'mp4a') - 4
+    assert struct.unpack('>I', audio[pos+32:pos+36])[0] == 0
+    traf = child(audio, boxes(audio)[2], b'traf')
+    tfdt = child(audio, traf, b'tfdt')
+    assert struct.unpack('>Q', audio[tfdt[1]+12:tfdt[1]+20])[0] == 960000
+
+def test_write_tracks_atomically(tmpdir, monkeypatch):
+    audiofile = str(tmpdir.join('audio-2500_1.dash'))
+    videofile = str(tmpdir.join('video-2500_1.dash'))
+    def failingRename(src, dst):
+        raise OSError("rename failed")
+    with monkeypatch.context() as m:
+        m.setattr(os, 'rename', failingRename)
+        with pytest.raises(OSError):
+            TSRemux.writeTracks(b'audio', b'video', audiofile, videofile)
+    assert os.listdir(str(tmpdir)) == []
+    TSRemux.writeTracks(b'audio', b'video', audiofile, videofile)
+    assert sorted(os.listdir(str(tmpdir))) == [ 'audio-2500_1.dash', 'video-2500_1.dash' ]
+    assert tmpdir.join('video-2500_1.dash').read_binary() == b'video'
+
+def test_remux_native_unsupported_stream():
+    with pytest.raises(Exception):
+        TSRemux.remuxfMP4(io.BytesIO(b'\x47' + b'\x00' * 187), 0.0)
+
+def test_ffmpeg_split_single_pass(tmpdir, monkeypatch):
+    tsfile = tmpdir.join('master2500_1.ts')
+    tsfile.write_binary(bytes(segment(900000)))
+    commands = []
+    monkeypatch.setattr(TSRemux, 'runcmd', lambda cmd, name: commands.append(cmd))
+    TSRemux.tsremux(str(tsfile), str(tmpdir), '2500_1.dash', 10.0, 'ffmpeg')
+    assert len(commands) == 1
+    cmd = commands[0]
+    assert cmd.count('-i') == 1
+    assert cmd[-1] == '%s/video-2500_1.dash' % tmpdir
+    assert '%s/audio-2500_1.dash' % tmpdir in cmd
+    assert cmd[cmd.index('-output_ts_offset') + 1] == '0.000000'
+    assert cmd[len(cmd) - 1 - cmd[::-1].index('-output_ts_offset') + 1] == '-0.033367'
+
+def test_batch_output_names_and_sources(tmpdir):
+    from hls2dash import tsremux
+    assert tsremux.outputFromFilename('http://example.com/live/master2500_19274.ts') == '2500_19274.dash'
+    assert tsremux.outputFromFilename('segment.ts') == 'segment.dash'
+    tmpdir.join('master2500_2.ts').write('')
+    tmpdir.join('master2500_1.ts').write('')
+    assert tsremux.listSegments(str(tmpdir.join('*.ts'))) == [ str(tmpdir.join('master2500_1.ts')), str(tmpdir.join('master2500_2.ts')) ]
+    tmpdir.join('list.txt').write('# segments\nmaster2500_1.ts\n\nhttp://example.com/master2500_2.ts\n')
+    assert tsremux.listSegments(str(tmpdir.join('list.txt'))) == [ 'master2500_1.ts', 'http://example.com/master2500_2.ts' ]
+
+def test_remote_remux_in_memory(tmpdir, monkeypatch):
+    from hls2dash.lib import TS
+    from hls2dash.lib import HTTP
+    class Client:
+        def get(self, uri, byterange=None, headers=None, compressed=False):
+            return HTTP.Response(uri, 200, bytes(segment(900000)), {})
+    monkeypatch.setattr(HTTP, 'client', Client())
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.mkdir('tmp')))
+    out = tmpdir.mkdir('out')
+    ts = TS.Remote('http://example.com/live/master2500_1.ts')
+    ts.remuxMP4(str(out), '2500_1.dash')
+    assert round(ts.getStartTime(), 3) == 10.033
+    assert sorted(out.listdir()) == [ out.join('audio-2500_1.dash'), out.join('video-2500_1.dash') ]
+    assert tmpdir.join('tmp').listdir() == []
+    commands = []
+    monkeypatch.setattr(TSRemux, 'runcmd', lambda cmd, name, stdin=None: commands.append((cmd, stdin)))
+    TSRemux.tsremuxData(bytes(segment(900000)), str(out), '2500_1.dash', 10.0, 'ffmpeg')
+    (cmd, stdin) = commands[0]
+    assert cmd[cmd.index('-i') + 1] == 'pipe:0'
+    assert stdin == bytes(segment(900000))
@@ -0,0 +1,29 @@
+import pytest
+import os
+from hls2dash.lib import util
+
+def test_write_file_atomic(tmpdir):
+    path = str(tmpdir.join('stream.mpd'))
+    util.writeFileAtomic(path, 'first')
+    util.writeFileAtomic(path, 'second')
+    assert open(path).read() == 'second'
+    assert os.listdir(str(tmpdir)) == [ 'stream.mpd' ]
+
+def test_open_file_atomic_discards_on_error(tmpdir):
+    path = str(tmpdir.join('stream.mpd'))
+    util.writeFileAtomic(path, 'first')
+    with pytest.raises(ValueError):
+        with util.openFileAtomic(path) as f:
+            f.write('partial')
+            raise ValueError()
+    assert open(path).read() == 'first'
+    assert os.listdir(str(tmpdir)) == [ 'stream.mpd' ]
+
+def test_write_file_if_changed(tmpdir):
+    path = str(tmpdir.join('stream.mpd'))
+    normalize = lambda x: x.split(' ')[1]
+    assert util.writeFileIfChanged(path, '1 a', normalize) == True
+    assert util.writeFileIfChanged(path, '2 a', normalize) == False
+    assert open(path).read() == '1 a'
+    assert util.writeFileIfChanged(path, '3 b', normalize) == True
+    assert open(path).read() == '3 b'
@@ -0,0 +1,120 @@
+# Helpers to build small synthetic MPEG2 TS segments for the tests
+
+def packet(pid, payload, start=True):
+    header = bytearray([ 0x47, (0x40 if start else 0x00) | (pid >> 8), pid & 0xff, 0x10 ])
+    data = header + bytearray(payload)
+    return data + bytearray([ 0xff ] * (188 - len(data)))
+
+def packets(pid, payload):
+    # Split payload over as many packets as needed. Stuffing is placed in
+    # an adaptation field so that the payload is kept intact
+    data = bytearray()
+    payload = bytearray(payload)
+    start = True
+    while len(payload) > 0:
+        chunk = payload[:184]
+        payload = payload[184:]
+        header = bytearray([ 0x47, (0x40 if start else 0x00) | (pid >> 8), pid & 0xff ])
+        stuffing = 184 - len(chunk)
+        if stuffing == 0:
+            header += bytearray([ 0x10 ])
+        elif stuffing == 1:
+            header += bytearray([ 0x30, 0x00 ])
+        else:
+            header += bytearray([ 0x30, stuffing - 1, 0x00 ]) + bytearray([ 0xff ] * (stuffing - 2))
+        data += header + chunk
+        start = False
+    return data
+
+def section(tableid, body):
+    length = len(body) + 5 + 4
+    return bytearray([ 0x00, tableid, 0xb0 | (length >> 8), length & 0xff, 0x00, 0x01, 0xc1, 0x00, 0x00 ]) + body + bytearray(4)
+
+def pat():
+    return packet(0, section(0x00, bytearray([ 0x00, 0x01, 0xf0, 0x00 ])))
+
+def pmt(streams):
+    body = bytearray([ 0xe1, 0x00, 0xf0, 0x00 ])
+    for (streamtype, pid) in streams:
+        body += bytearray([ streamtype, 0xe0 | (pid >> 8), pid & 0xff, 0xf0, 0x00 ])
+    return packet(0x1000, section(0x02, body))
+
+def timestamp(prefix, ts):
+    return bytearray([ (prefix << 4) | ((ts >> 29) & 0x0e) | 0x01, (ts >> 22) & 0xff, ((ts >> 14) & 0xfe) | 0x01, (ts >> 7) & 0xff, ((ts << 1) & 0xfe) | 0x01 ])
+
+def pesheader(streamid, pts, dts=None):
+    if dts == None:
+        header = bytearray([ 0x80, 0x80, 0x05 ]) + timestamp(0x2, pts)
+    else:
+        header = bytearray([ 0x80, 0xc0, 0x0a ]) + timestamp(0x3, pts) + timestamp(0x1, dts)
+    return bytearray([ 0x00, 0x00, 0x01, streamid, 0x00, 0x00 ]) + header
+
+def pes(pid, streamid, pts, dts=None, data=b''):
+    return packets(pid, pesheader(streamid, pts, dts) + bytearray(data))
+
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+    def bits_(self, v, n):
+        for i in range(n - 1, -1, -1):
+            self.bits.append((v >> i) & 1)
+    def ue(self, v):
+        v += 1
+        n = v.bit_length()
+        self.bits_(0, n - 1)
+        self.bits_(v, n)
+    def data(self):
+        bits = self.bits + [ 1 ]
+        bits += [ 0 ] * (-len(bits) % 8)
+        return bytearray([ int(''.join(map(str, bits[i:i+8])), 2) for i in range(0, len(bits), 8) ])
+
+def sps(width, height, profile=66, level=31):
+    w = BitWriter()
+    w.bits_(profile, 8)
+    w.bits_(0xc0, 8)
+    w.bits_(level, 8)
+    w.ue(0)
+    w.ue(0)
+    w.ue(0)
+    w.ue(0)
+    w.ue(1)
+    w.bits_(0, 1)
+    w.ue((width + 15) // 16 - 1)
+    w.ue((height + 15) // 16 - 1)
+    w.bits_(1, 1)
+    w.bits_(1, 1)
+    crop = ((height + 15) // 16) * 16 - height
+    if crop:
+        w.bits_(1, 1)
+        w.ue(0)
+        w.ue(0)
+        w.ue(0)
+        w.ue(crop // 2)
+    else:
+        w.bits_(0, 1)
+    w.bits_(0, 1)
+    return bytearray([ 0x67 ]) + w.data()
+
+def accessunit(nals):
+    data = bytearray()
+    for nal in nals:
+        data += bytearray([ 0x00, 0x00, 0x00, 0x01 ]) + bytearray(nal)
+    return data
+
+def adts(payload, samplerateindex=3, channels=2):
+    length = 7 + len(payload)
+    return bytearray([ 0xff, 0xf1, (1 << 6) | (samplerateindex << 2) | (channels >> 2),
+                       ((channels & 0x3) << 6) | (length >> 11), (length >> 3) & 0xff, ((length & 0x7) << 5) | 0x1f, 0xfc ]) + bytearray(payload)
+
+def segment(pts, frames=2, width=1280, height=720, samplerateindex=3):
+    # A segment with one H.264 and one AAC stream starting at pts
+    data = pat() + pmt([ (0x1b, 0x100), (0x0f, 0x101) ])
+    for i in range(frames):
+        nals = [ [ 0x09, 0xf0 ] ]
+        if i == 0:
+            nals += [ sps(width, height), [ 0x68, 0xce, 0x3c, 0x80 ], [ 0x65 ] + [ 0x88 ] * 300 ]
+        else:
+            nals += [ [ 0x41 ] + [ 0x9a ] * 100 ]
+        data += pes(0x100, 0xe0, pts + 3003 + i * 3003, pts + i * 3003, accessunit(nals))
+    data += pes(0x101, 0xc0, pts, None, adts([ 0x21 ] * 50, samplerateindex) + adts([ 0x21 ] * 60, samplerateindex))
+    return data